@@ -14,10 +14,14 @@ from brainflow import BrainFlowError, DataFilter
 from brainflow.board_shim import BoardShim, BrainFlowInputParams, BoardIds, BrainFlowPresets
 import sys
 
-from player.PlayerSession import PlayerSession
+from Player.PlayerSession import PlayerSession
 
 sys.path.append("../")
+from EEG.ring_buffer import BoardPoller
+from EEG.signal_quality import SignalQualityMonitor
 from utils import get_com_port
+from utils.dsp import processor_for
+from utils.recording import BinaryRecorder, channel_names
 from utils.utils import load_config
 
 
@@ -27,7 +31,13 @@ class EEG:
         self.board = None
         self.board_id = board_id
         self.config = config
+        self.live = None
+        self.qc = None
+        self.recorder = None
+        self.processor = None
         self.file = Path(root_data_path / 'eeg' / config["DATA_CAPTURE"]["EEG"])
+        # "binary": eeg.bin + eeg.json (see utils.recording), "csv": BrainFlow's text file streamer
+        self.recording_format = config["DATA_CAPTURE"].get("RECORDING_FORMAT", "csv")
         BoardShim.enable_dev_board_logger()
 
         params = BrainFlowInputParams()
@@ -90,10 +100,8 @@ class EEG:
             pass
 
     def prep_stream_file(self):
-        header_list = ["package_number", "ch1", "ch2", "ch3", "ch4", "ch5", "ch6", "ch7", "ch8", "ch9", "ch10", "ch11",
-                       "ch12", "ch13", "ch14", "ch15", "ch16", "acc_x", "acc_y", "acc_z", "gyr_x", "gyr_y", "gyr_z",
-                       "eda",
-                       "ppg1", "ppg2", "temp", "res_1", "res_2", "battery", "timestamp", "marker_ch", "num_rows"]
+        # one name per row the board actually sends, taken from the board description
+        header_list = channel_names(self.board_id, BrainFlowPresets.DEFAULT_PRESET)
         try:
             with open(self.file, 'w', newline='') as csvfile:
                 csvwriter = csv.writer(csvfile, delimiter="\t")
@@ -115,8 +123,60 @@ class EEG:
         data = self.board.get_board_data()
         DataFilter.write_file(data, str(self.file.resolve()), 'a')  # use 'a' for append mode
 
+    def record_binary(self):
+        """record to eeg.bin + eeg.json instead of the text file streamer, fed by the live buffer"""
+        self.recorder = BinaryRecorder(self.file.with_suffix(""), self.board_id)
+
+    def start_live_buffer(self, seconds: float = 30.0, poll_interval: float = 0.05, buffer=None) -> BoardPoller:
+        """
+        keep the last seconds of data in memory (self.live.buffer), next to the file streamer, so live QC and
+        feature extraction don't have to read the csv. Don't use save_to_file/common_capture while it runs,
+        both drain the same board buffer. A binary recorder and the filter chain, if any, get every polled chunk.
+        :param seconds: how much data is kept
+        :param poll_interval: seconds between polls of the board
+        :param buffer: a SharedRingBuffer to fill instead, when the board runs in a worker process
+        """
+        listeners = [listener for listener in (self.recorder, self.processor) if listener is not None]
+        self.live = BoardPoller(self.board, seconds=seconds, poll_interval=poll_interval, listeners=listeners,
+                                buffer=buffer)
+        self.live.start()
+        logging.info("live EEG buffer: last {}s at {} Hz".format(seconds, self.live.sampling_rate))
+        return self.live
+
+    def start_processing(self):
+        """filter the live data with the DATA_CAPTURE.DSP.EEG chain into eeg_filtered.bin (see utils.dsp)"""
+        self.processor = processor_for(self.config, "EEG", self.file, self.board_id, types=("eeg",))
+
+    def start_qc(self, **kwargs) -> SignalQualityMonitor:
+        """
+        check the signal quality of the live buffer in the background (see EEG.signal_quality), results in
+        the log and in eeg/qc.json next to the recording
+        :param kwargs: SignalQualityMonitor options (window, interval, line_frequency, ...)
+        """
+        kwargs.setdefault("out_file", self.file.with_name("qc.json"))
+        self.qc = SignalQualityMonitor.for_board(lambda seconds: self.live.latest_seconds(seconds, copy=True),
+                                                 self.board_id, **kwargs)
+        self.qc.start()
+        return self.qc
+
+    def stop_qc(self):
+        if self.qc is not None:
+            self.qc.stop()
+            self.qc = None
+
+    def stop_live_buffer(self):
+        if self.live is not None:
+            self.live.stop()
+            self.live = None
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+        if self.processor is not None:
+            self.processor.close()
+            self.processor = None
+
     def insert_marker(self, i: float):
-        logging.info("inserting {}".format(i))
+        logging.debug("inserting {}".format(i))
 
         self.board.insert_marker(i)
 
@@ -158,12 +218,23 @@ class EEG:
         self.board.config_board("j")
         logging.info("stopping SD card recording")
 
-    def launch_eeg(self):
-        self.prep_stream_file()
+    def launch_eeg(self, append: bool = False, live_buffer=None):
+        """
+        :param append: continue an existing csv recording (after a restart) instead of starting it with a
+            fresh header, binary recordings always append
+        :param live_buffer: SharedRingBuffer for the live data, see start_live_buffer()
+        """
+        if self.recording_format == "binary":
+            self.record_binary()
+        else:
+            if not append:
+                self.prep_stream_file()
+            self.stream_to_file()
+        self.start_processing()
         # self.stream_to_ip()
-        self.stream_to_file()
         self.config_board()
         self.board.start_stream()
+        self.start_live_buffer(buffer=live_buffer)
         # self.common_capture()
         logging.info("EEG started")
 
@@ -191,6 +262,9 @@ class EEG:
     def stop_eeg(self):
         # make sure we clean the connection if the application is stopped
         logging.info("finishing up EEG")
+        self.stop_qc()
         self.stop_sd_recording()
         self.board.stop_stream()
+        # after stop_stream, so the last poll also gets the samples that were still in the board buffer
+        self.stop_live_buffer()
         self.board.release_session()
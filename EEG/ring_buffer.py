@@ -0,0 +1,280 @@
+import logging
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+from brainflow import BrainFlowError
+from brainflow.board_shim import BoardShim, BrainFlowPresets
+
+
+class RingBuffer:
+    """
+    preallocated (channels x capacity) ring buffer for live board data
+
+    every sample is stored twice, at i and i + capacity, so any window of up to capacity samples is one
+    contiguous slice: latest() and since() return numpy views without copying. A view stays valid until
+    the writer has written (capacity - len(view)) new samples, ask for copy=True to keep data longer.
+    """
+
+    def __init__(self, channels: int, capacity: int, dtype=np.float64, timestamp_row: int = None):
+        """
+        :param channels: number of rows, e.g. BoardShim.get_num_rows()
+        :param capacity: number of samples kept
+        :param timestamp_row: row holding the (increasing) timestamps, needed for since()
+        """
+        if capacity <= 0:
+            raise ValueError("capacity must be positive")
+        self.channels = channels
+        self.capacity = capacity
+        self.timestamp_row = timestamp_row
+        self._data = np.zeros((channels, 2 * capacity), dtype=dtype)
+        self._head = 0  # next write position, in [0, capacity)
+        self._count = 0  # total samples ever written
+        self._lock = threading.Lock()
+
+    @property
+    def count(self) -> int:
+        """total number of samples written since the buffer was created"""
+        return self._count
+
+    def __len__(self):
+        return min(self._count, self.capacity)
+
+    def write(self, chunk: np.ndarray):
+        """append a (channels x n) chunk, only the last capacity samples are kept"""
+        if chunk.ndim != 2 or chunk.shape[0] != self.channels:
+            raise ValueError("expected a ({} x n) chunk, got {}".format(self.channels, chunk.shape))
+        n = chunk.shape[1]
+        if n == 0:
+            return
+        with self._lock:
+            skipped = max(0, n - self.capacity)
+            if skipped:
+                chunk = chunk[:, skipped:]
+                n = self.capacity
+            head = (self._head + skipped) % self.capacity
+            first = min(n, self.capacity - head)
+            for offset in (0, self.capacity):
+                self._data[:, offset + head:offset + head + first] = chunk[:, :first]
+                if first < n:
+                    self._data[:, offset:offset + n - first] = chunk[:, first:]
+            self._head = (head + n) % self.capacity
+            self._count += n + skipped
+
+    def latest(self, n: int = None, copy: bool = False) -> np.ndarray:
+        """
+        the last n samples (all kept samples if n is None) as a (channels x n) array, oldest first
+        :param copy: return a copy instead of a read-only view into the buffer
+        """
+        with self._lock:
+            available = min(self._count, self.capacity)
+            n = available if n is None else max(0, min(n, available))
+            start = (self._head - n) % self.capacity
+            window = self._data[:, start:start + n]
+        if copy:
+            return window.copy()
+        view = window.view()
+        view.flags.writeable = False
+        return view
+
+    def since(self, timestamp: float, copy: bool = False) -> np.ndarray:
+        """all kept samples with a timestamp >= timestamp, see latest()"""
+        if self.timestamp_row is None:
+            raise ValueError("this buffer has no timestamp row")
+        window = self.latest()
+        first = int(np.searchsorted(window[self.timestamp_row], timestamp, side="left"))
+        window = window[:, first:]
+        return window.copy() if copy else window
+
+
+class SharedRingBuffer:
+    """
+    RingBuffer in multiprocessing.shared_memory, written by one process (the board worker) and read by
+    others without pickling
+
+    same mirrored layout as RingBuffer, after a small header (sequence, head, count). The writer makes the
+    sequence odd while it writes and even again when it's done, a reader copies its window and retries
+    when the sequence changed in the meantime (a seqlock), so reads always return copies.
+    """
+
+    HEADER = 4  # int64: sequence, head, count, reserved
+
+    def __init__(self, channels: int, capacity: int, timestamp_row: int = None, name: str = None,
+                 create: bool = True):
+        """
+        :param channels: number of rows
+        :param capacity: number of samples kept
+        :param timestamp_row: row holding the timestamps, needed for since()
+        :param name: shared memory name, generated when creating without one
+        :param create: create the block (the owner, who also unlinks it) or attach to an existing one
+        """
+        if capacity <= 0:
+            raise ValueError("capacity must be positive")
+        self.channels = channels
+        self.capacity = capacity
+        self.timestamp_row = timestamp_row
+        size = self.HEADER * 8 + channels * 2 * capacity * 8
+        self.shm = shared_memory.SharedMemory(name=name, create=create, size=size if create else 0)
+        self._header = np.ndarray((self.HEADER,), dtype=np.int64, buffer=self.shm.buf)
+        self._data = np.ndarray((channels, 2 * capacity), dtype=np.float64, buffer=self.shm.buf,
+                                offset=self.HEADER * 8)
+        if create:
+            self._header[:] = 0
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def descriptor(self) -> dict:
+        """everything another process needs for attach()"""
+        return {"name": self.name, "channels": self.channels, "capacity": self.capacity,
+                "timestamp_row": self.timestamp_row}
+
+    @classmethod
+    def attach(cls, descriptor: dict) -> "SharedRingBuffer":
+        return cls(descriptor["channels"], descriptor["capacity"], descriptor["timestamp_row"],
+                   name=descriptor["name"], create=False)
+
+    @property
+    def count(self) -> int:
+        return int(self._header[2])
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def write(self, chunk: np.ndarray):
+        """append a (channels x n) chunk, single writer only"""
+        if chunk.ndim != 2 or chunk.shape[0] != self.channels:
+            raise ValueError("expected a ({} x n) chunk, got {}".format(self.channels, chunk.shape))
+        n = chunk.shape[1]
+        if n == 0:
+            return
+        skipped = max(0, n - self.capacity)
+        if skipped:
+            chunk = chunk[:, skipped:]
+            n = self.capacity
+        head = (int(self._header[1]) + skipped) % self.capacity
+        first = min(n, self.capacity - head)
+        self._header[0] += 1
+        for offset in (0, self.capacity):
+            self._data[:, offset + head:offset + head + first] = chunk[:, :first]
+            if first < n:
+                self._data[:, offset:offset + n - first] = chunk[:, first:]
+        self._header[1] = (head + n) % self.capacity
+        self._header[2] += n + skipped
+        self._header[0] += 1
+
+    def latest(self, n: int = None, copy: bool = True) -> np.ndarray:
+        """
+        the last n samples (all kept samples if n is None) as a (channels x n) array, oldest first
+        :param copy: ignored, a read always copies (another process writes the block, a view could change
+            under the reader), it's there so this buffer can stand in for a RingBuffer (BoardPoller)
+        """
+        while True:
+            sequence = int(self._header[0])
+            if sequence % 2:
+                time.sleep(0)
+                continue
+            head, count = int(self._header[1]), int(self._header[2])
+            available = min(count, self.capacity)
+            m = available if n is None else max(0, min(n, available))
+            start = (head - m) % self.capacity
+            window = self._data[:, start:start + m].copy()
+            if int(self._header[0]) == sequence:
+                return window
+
+    def since(self, timestamp: float, copy: bool = True) -> np.ndarray:
+        """all kept samples with a timestamp >= timestamp, always a copy (see latest())"""
+        if self.timestamp_row is None:
+            raise ValueError("this buffer has no timestamp row")
+        window = self.latest()
+        return window[:, int(np.searchsorted(window[self.timestamp_row], timestamp, side="left")):]
+
+    def close(self):
+        """detach this process, the block stays until the owner unlinks it"""
+        self._header = None
+        self._data = None
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
+
+
+def shared_ring(board_id: int, seconds: float = 30.0,
+                preset: BrainFlowPresets = BrainFlowPresets.DEFAULT_PRESET) -> SharedRingBuffer:
+    """a new SharedRingBuffer sized for seconds of a board, created before the board is opened"""
+    rate = BoardShim.get_sampling_rate(board_id, preset)
+    return SharedRingBuffer(BoardShim.get_num_rows(board_id, preset), max(1, int(seconds * rate)),
+                            BoardShim.get_timestamp_channel(board_id, preset))
+
+
+class BoardPoller(threading.Thread):
+    """
+    keeps the last seconds of a BrainFlow board in a RingBuffer
+
+    polls get_board_data(n) with the number of samples available, so it drains the board's internal
+    buffer: don't combine it with get_board_data() elsewhere (streamers added with add_streamer, like the
+    file streamer, get their data before that buffer and are not affected).
+    """
+
+    def __init__(self, board: BoardShim, seconds: float = 30.0, poll_interval: float = 0.05,
+                 preset: BrainFlowPresets = BrainFlowPresets.DEFAULT_PRESET, listeners: list = None,
+                 buffer=None):
+        """
+        :param board: a prepared (and usually streaming) board
+        :param seconds: how much data the buffer keeps
+        :param poll_interval: seconds between polls
+        :param preset: preset to poll, EmotiBit has three
+        :param listeners: callables listener(chunk) that get every polled (rows x n) chunk, e.g. a
+            utils.recording.BinaryRecorder
+        :param buffer: buffer to fill instead of a new RingBuffer of seconds, e.g. a SharedRingBuffer
+            read by another process
+        """
+        super().__init__(name="BoardPoller", daemon=True)
+        self.board = board
+        self.preset = preset
+        self.poll_interval = poll_interval
+        self.listeners = list(listeners) if listeners is not None else []
+        self.sampling_rate = BoardShim.get_sampling_rate(board.board_id, preset)
+        timestamp_row = BoardShim.get_timestamp_channel(board.board_id, preset)
+        if buffer is None:
+            buffer = RingBuffer(BoardShim.get_num_rows(board.board_id, preset),
+                                max(1, int(seconds * self.sampling_rate)), timestamp_row=timestamp_row)
+        self.buffer = buffer
+        self._stop_event = threading.Event()
+
+    def stop(self, timeout: float = 2.0):
+        self._stop_event.set()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join(timeout)
+
+    def latest_seconds(self, seconds: float, copy: bool = False) -> np.ndarray:
+        """the last seconds of data, see RingBuffer.latest()"""
+        return self.buffer.latest(int(seconds * self.sampling_rate), copy=copy)
+
+    def poll(self) -> int:
+        """move everything the board has into the ring buffer, returns the number of samples"""
+        available = self.board.get_board_data_count(self.preset)
+        if available <= 0:
+            return 0
+        data = self.board.get_board_data(available, self.preset)
+        self.buffer.write(data)
+        for listener in self.listeners:
+            try:
+                listener(data)
+            except Exception as e:
+                logging.error("live buffer listener {} failed: {}".format(listener, e))
+        return data.shape[1]
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.poll()
+            except BrainFlowError as e:
+                logging.warning("live buffer poll failed: {}".format(e))
+            self._stop_event.wait(self.poll_interval)
+        try:
+            self.poll()
+        except BrainFlowError:
+            pass
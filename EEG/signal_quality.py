@@ -0,0 +1,213 @@
+"""
+live signal quality of the EEG channels, so bad electrodes show up during the session instead of after it
+
+every interval the last window seconds of the live buffer are checked per channel (numpy, all channels at
+once, a 2 s window of 8 Cyton channels is well below a millisecond):
+
+    rms          µV, after removing the offset and linear drift of the window
+    line_rms     µV in line_frequency ± line_width Hz (one Hann windowed FFT of the window)
+    line_ratio   share of the 1 Hz - Nyquist power that is line noise
+    ptp          peak to peak in µV
+    railed       share of the samples at or beyond rail_fraction of the ADC range
+
+and gets a status: railed, flat, line noise, noisy or ok (the first that applies). Status changes are
+logged (and so end up in the GUI log panel), every summary_interval a one line summary is logged, and the
+latest metrics are written to a JSON file (replaced atomically, readable at any time).
+"""
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+from brainflow.board_shim import BoardShim, BoardIds
+
+from utils.recording import channel_map
+
+# ADS1299 at gain 24: ±4.5 V / 24 in µV, what the Cyton reports when an electrode is off
+CYTON_RAIL_UV = 187500.0
+
+OK = "ok"
+RAILED = "railed"
+FLAT = "flat"
+LINE_NOISE = "line noise"
+NOISY = "noisy"
+
+
+def quality_metrics(window: np.ndarray, sampling_rate: float, line_frequency: float = 50.0,
+                    line_width: float = 1.0, rail: float = CYTON_RAIL_UV, rail_fraction: float = 0.9) -> dict:
+    """
+    metrics of a (channels x n) window of µV, each an array with one value per channel
+    :param line_frequency: mains frequency, 50 Hz in Europe
+    :param line_width: half width of the line noise band in Hz
+    :param rail: ADC range in µV
+    :param rail_fraction: samples beyond rail_fraction * rail count as railed
+    """
+    window = np.asarray(window, dtype=np.float64)
+    n = window.shape[1]
+    railed = np.mean(np.abs(window) >= rail_fraction * rail, axis=1)
+    ptp = np.ptp(window, axis=1)
+    # remove offset and linear drift, the Cyton has large DC offsets
+    t = np.arange(n) - (n - 1) / 2.0
+    centered = window - window.mean(axis=1, keepdims=True)
+    slope = centered @ t / max(float(t @ t), 1.0)
+    detrended = centered - np.outer(slope, t)
+    rms = np.sqrt(np.mean(detrended ** 2, axis=1))
+    # one sided power spectrum, scaled so the sum over a band is the mean square of the signal in that band
+    taper = np.hanning(n)
+    spectrum = np.abs(np.fft.rfft(detrended * taper, axis=1)) ** 2
+    spectrum[:, 1:] *= 2.0
+    spectrum /= n * n * max(np.mean(taper ** 2), 1e-12)
+    frequencies = np.fft.rfftfreq(n, 1.0 / sampling_rate)
+    line_band = np.abs(frequencies - line_frequency) <= line_width
+    total_band = frequencies >= 1.0
+    line_power = spectrum[:, line_band].sum(axis=1)
+    total_power = spectrum[:, total_band].sum(axis=1)
+    return {"rms": rms, "line_rms": np.sqrt(line_power), "ptp": ptp, "railed": railed,
+            "line_ratio": np.divide(line_power, total_power, out=np.zeros_like(line_power),
+                                    where=total_power > 0)}
+
+
+def classify(metrics: dict, flat_uv: float = 0.5, railed_share: float = 0.05, line_uv: float = 10.0,
+             line_ratio: float = 0.5, noisy_uv: float = 100.0) -> list:
+    """
+    a status per channel
+    :param flat_uv: peak to peak below this is a flat line (disconnected, shorted or a dead channel)
+    :param railed_share: share of railed samples from which a channel is railed
+    :param line_uv: line noise (µV rms) above this ...
+    :param line_ratio: ... that is also this share of the power is line noise (a loose or dry electrode)
+    :param noisy_uv: rms above this is noisy (movement, muscle, bad contact)
+    """
+    status = []
+    for i in range(len(metrics["rms"])):
+        if metrics["railed"][i] >= railed_share:
+            status.append(RAILED)
+        elif metrics["ptp"][i] < flat_uv:
+            status.append(FLAT)
+        elif metrics["line_rms"][i] > line_uv and metrics["line_ratio"][i] > line_ratio:
+            status.append(LINE_NOISE)
+        elif metrics["rms"][i] > noisy_uv:
+            status.append(NOISY)
+        else:
+            status.append(OK)
+    return status
+
+
+class SignalQualityMonitor(threading.Thread):
+    """checks the live EEG buffer every interval seconds, see the module docstring"""
+
+    def __init__(self, source, sampling_rate: float, channels: list, out_file: Path = None,
+                 window: float = 2.0, interval: float = 0.5, line_frequency: float = 50.0,
+                 summary_interval: float = 10.0, listeners: list = None, thresholds: dict = None,
+                 rail: float = CYTON_RAIL_UV):
+        """
+        :param source: source(seconds) -> (rows x n) array of the last seconds, or None when there is no
+            data yet, e.g. EEG.live.latest_seconds or BoardProcess.latest_seconds
+        :param channels: (row, name) of the channels to check
+        :param out_file: JSON file with the latest metrics, e.g. <session>/eeg/qc.json
+        :param window: seconds per check, at least 1 s for a useful line noise estimate
+        :param interval: seconds between checks
+        :param summary_interval: seconds between summary lines in the log, 0 for none
+        :param listeners: callables listener(metrics) that get every result, e.g. a GUI panel
+        :param thresholds: keyword arguments for classify()
+        :param rail: ADC range in µV
+        """
+        super().__init__(name="SignalQuality", daemon=True)
+        self.source = source
+        self.sampling_rate = sampling_rate
+        self.rows = [row for row, _ in channels]
+        self.names = [name for _, name in channels]
+        self.out_file = Path(out_file) if out_file is not None else None
+        self.window = window
+        self.interval = interval
+        self.line_frequency = line_frequency
+        self.summary_interval = summary_interval
+        self.listeners = list(listeners) if listeners is not None else []
+        self.thresholds = thresholds or {}
+        self.rail = rail
+        self.latest = None
+        self._status = [None] * len(self.rows)
+        self._next_summary = 0.0
+        self._stop_event = threading.Event()
+
+    @classmethod
+    def for_board(cls, source, board_id: int = BoardIds.CYTON_BOARD, **kwargs) -> "SignalQualityMonitor":
+        """a monitor of every eeg channel of a board"""
+        channels = [(row["row"], row["name"]) for row in channel_map(board_id) if row["type"] == "eeg"]
+        return cls(source, BoardShim.get_sampling_rate(board_id), channels, **kwargs)
+
+    def stop(self, timeout: float = 2.0):
+        self._stop_event.set()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join(timeout)
+
+    def check(self) -> dict:
+        """check the current window once, returns the metrics or None when there isn't a full window yet"""
+        started = time.perf_counter()
+        data = self.source(self.window)
+        if data is None or data.shape[1] < int(self.window * self.sampling_rate):
+            return None
+        metrics = quality_metrics(data[self.rows], self.sampling_rate, self.line_frequency, rail=self.rail)
+        status = classify(metrics, **self.thresholds)
+        result = {
+            "time": datetime.now(timezone.utc).isoformat(),
+            "window": self.window,
+            "sampling_rate": self.sampling_rate,
+            "channels": [dict({key: round(float(values[i]), 3) for key, values in metrics.items()},
+                              row=self.rows[i], name=self.names[i], status=status[i])
+                         for i in range(len(self.rows))],
+        }
+        result["compute_ms"] = round((time.perf_counter() - started) * 1e3, 3)
+        self.latest = result
+        return result
+
+    def _publish(self, result: dict):
+        for i, channel in enumerate(result["channels"]):
+            previous = self._status[i]
+            if channel["status"] != previous:
+                if channel["status"] != OK:
+                    logging.warning("⚠ EEG {}: {} (rms {:.1f} µV, {:.0f} Hz {:.1f} µV)".format(
+                        channel["name"], channel["status"], channel["rms"], self.line_frequency,
+                        channel["line_rms"]))
+                elif previous is not None:
+                    logging.info("✓ EEG {}: ok again".format(channel["name"]))
+                self._status[i] = channel["status"]
+        now = time.monotonic()
+        if self.summary_interval and now >= self._next_summary:
+            self._next_summary = now + self.summary_interval
+            bad = [c["name"] for c in result["channels"] if c["status"] != OK]
+            logging.info("EEG quality: rms {} µV, {}".format(
+                " ".join("{:.0f}".format(c["rms"]) for c in result["channels"]),
+                "bad: {}".format(", ".join(bad)) if bad else "all ok"))
+        if self.out_file is not None:
+            self._write(result)
+        for listener in self.listeners:
+            try:
+                listener(result)
+            except Exception as e:
+                logging.error("quality listener {} failed: {}".format(listener, e))
+
+    def _write(self, result: dict):
+        temporary = self.out_file.with_name(self.out_file.name + ".tmp")
+        try:
+            with open(temporary, "w", encoding="utf-8") as f:
+                json.dump(result, f, indent=1)
+            os.replace(temporary, self.out_file)
+        except OSError as e:
+            logging.warning("could not write {}: {}".format(self.out_file, e))
+
+    def run(self):
+        next_check = time.monotonic()
+        while not self._stop_event.is_set():
+            try:
+                result = self.check()
+                if result is not None:
+                    self._publish(result)
+            except Exception as e:
+                logging.error("signal quality check failed: {}".format(e))
+            # fixed rate, but always half an interval of rest, so a slow machine doesn't spend all its time here
+            next_check = max(next_check + self.interval, time.monotonic() + 0.5 * self.interval)
+            self._stop_event.wait(next_check - time.monotonic())
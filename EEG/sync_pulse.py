@@ -0,0 +1,360 @@
+"""
+hardware sync pulses on an FTDI pin (the cable into the Cyton / EmotiBit), for aligning recordings
+
+a pulse train is an iterable of Edge(offset, level, marker): offset in seconds from the start of the
+train, level 1/0, marker a name (or None) that is inserted in BrainFlow and the session log when the edge
+goes out. periodic() and coded() build the usual trains. Both use one fixed marker, the number of a coded()
+pulse group goes in the value of its first edge (and in its bits), so it doesn't need a marker code of its own.
+
+SyncPulseGenerator runs a train on its own (raised priority) thread. Every edge is scheduled against the
+start time of the train, not against the previous edge, so sleep errors don't add up over a long
+session: it sleeps until shortly before the edge and spins the last spin_ms. The moment each edge was
+written is stamped (utils.clock) and handed to the sinks, analysis.clock_alignment.pulse_edges finds the
+same edges back in the recorded channel.
+
+FakeBackend stands in for the FTDI device, it only records what would have been written.
+"""
+import argparse
+import itertools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from typing import NamedTuple
+
+from utils.clock import ReceiveStamp, stamp_now
+
+SYNC_MARKER = "sync_pulse"
+
+
+class Edge(NamedTuple):
+    offset: float  # seconds from the start of the train
+    level: int
+    marker: str = None
+    value: int = None  # number of a coded() pulse group, on its start edge
+
+
+class PulseEdge(NamedTuple):
+    """an edge as it was emitted"""
+    index: int
+    level: int
+    marker: str
+    scheduled_ns: int  # perf_counter_ns the edge was planned for
+    emitted_ns: int  # perf_counter_ns right after the write returned
+    write_ns: int  # how long the write to the device took
+    stamp: ReceiveStamp  # the same moment on the monotonic / wall / LSL clocks
+    value: int = None
+
+    @property
+    def late_us(self) -> float:
+        return (self.emitted_ns - self.scheduled_ns) / 1e3
+
+
+def periodic(period: float = 1.0, width: float = 0.1, count: int = None, marker: str = SYNC_MARKER):
+    """
+    a pulse of width seconds every period seconds, count pulses (endless when None),
+    the rising edges carry the marker
+    """
+    if not 0 < width < period:
+        raise ValueError("width must be between 0 and period")
+    n = 0
+    while count is None or n < count:
+        yield Edge(n * period, 1, marker)
+        yield Edge(n * period + width, 0)
+        n += 1
+
+
+def coded(values, interval: float = 5.0, bits: int = 8, bit_time: float = 0.05, short: float = 0.01,
+          long: float = 0.03, start: float = 0.04, marker: str = SYNC_MARKER):
+    """
+    every interval seconds a start pulse followed by a value as bits (msb first, long pulse = 1),
+    so every pulse group can be identified in the recording, not just counted
+    :param values: iterable of integers, e.g. itertools.count() for an endless train
+    :param interval: seconds between the start of two pulse groups
+    """
+    if start + bits * bit_time > interval:
+        raise ValueError("{} bits of {} s don't fit in an interval of {} s".format(bits, bit_time, interval))
+    if not 0 < short < long < bit_time:
+        raise ValueError("need 0 < short < long < bit_time")
+    for n, value in enumerate(values):
+        if not 0 <= value < 2 ** bits:
+            raise ValueError("{} doesn't fit in {} bits".format(value, bits))
+        t = n * interval
+        yield Edge(t, 1, marker, value)
+        yield Edge(t + start / 2, 0)
+        for bit in range(bits):
+            begin = t + start + bit * bit_time
+            yield Edge(begin, 1)
+            yield Edge(begin + (long if value >> (bits - 1 - bit) & 1 else short), 0)
+
+
+def decode(edge_times, levels, bits: int = 8, bit_time: float = 0.05, short: float = 0.01,
+           long: float = 0.03, start: float = 0.04):
+    """
+    values of coded() pulse groups from emitted or detected edges
+    :return: list of (start time, value)
+    """
+    # (rise, width) of every complete pulse, a fall before the first rise is ignored
+    pulses = []
+    rise = None
+    for t, level in zip(edge_times, levels):
+        if level:
+            rise = t
+        elif rise is not None:
+            pulses.append((rise, t - rise))
+            rise = None
+    threshold = (short + long) / 2
+    # a start pulse is followed by a bit after start seconds and by bits pulses that end one group later,
+    # a bit is followed by the next one after bit_time, so both are off by bit_time - start for a bit
+    span = start + (bits - 1) * bit_time
+    tolerance = (bit_time - start) / 2
+    result = []
+    i = 0
+    while i + bits < len(pulses):
+        if (abs(pulses[i + 1][0] - pulses[i][0] - start) < tolerance
+                and abs(pulses[i + bits][0] - pulses[i][0] - span) < tolerance):
+            value = 0
+            for _, width in pulses[i + 1:i + 1 + bits]:
+                value = value << 1 | (width > threshold)
+            result.append((pulses[i][0], value))
+            i += bits + 1
+        else:
+            i += 1
+    return result
+
+
+class FakeBackend:
+    """records the written levels instead of driving a pin"""
+
+    def __init__(self, write_delay: float = 0.0):
+        self.write_delay = write_delay
+        self.edges = []  # (perf_counter_ns, level)
+        self.level = 0
+
+    def set(self, level: int):
+        if self.write_delay:
+            time.sleep(self.write_delay)
+        self.level = level
+        self.edges.append((time.perf_counter_ns(), level))
+
+    def close(self):
+        pass
+
+
+class FtdiBackend:
+    """one pin of an FTDI chip in asynchronous bitbang mode (what EEG/sync_signal.py used to do)"""
+
+    def __init__(self, device_index: int = 0, mask: int = 0x01):
+        """
+        :param device_index: index of the FTDI device, 0 is the first one
+        :param mask: bit mask of the output pin(s), 0x01 is D0
+        """
+        try:
+            import ftd2xx
+        except ImportError as e:
+            raise ImportError("the FTDI backend needs the ftd2xx package (pip install ftd2xx)") from e
+        self.mask = mask
+        self.device = ftd2xx.open(device_index)
+        logging.info("FTDI device: {}".format(self.device.getDeviceInfo()))
+        self.device.setBitMode(mask, 1)
+        self.set(0)
+
+    def set(self, level: int):
+        self.device.write(bytes([self.mask if level else 0]))
+
+    def close(self):
+        try:
+            self.set(0)
+        finally:
+            self.device.close()
+
+
+def _raise_priority() -> bool:
+    """best effort: time critical thread on windows, SCHED_FIFO on linux (needs privileges)"""
+    try:
+        if sys.platform == "win32":
+            import ctypes
+            kernel32 = ctypes.windll.kernel32
+            # THREAD_PRIORITY_TIME_CRITICAL
+            return bool(kernel32.SetThreadPriority(kernel32.GetCurrentThread(), 15))
+        os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(os.sched_get_priority_min(os.SCHED_FIFO)))
+        return True
+    except (OSError, AttributeError) as e:
+        logging.debug("sync pulse thread keeps its normal priority: {}".format(e))
+        return False
+
+
+class SyncPulseGenerator(threading.Thread):
+    """emits a pulse train on a backend and reports every edge to the sinks"""
+
+    def __init__(self, backend, train, sinks: list = None, spin_ms: float = 2.0, start_delay: float = 0.1):
+        """
+        :param backend: FtdiBackend, FakeBackend or anything with set(level) and close()
+        :param train: iterable of Edge, see periodic() and coded()
+        :param sinks: callables sink(edge: PulseEdge), e.g. BoardMarkerSink, SessionLogSink, PulseFile
+        :param spin_ms: busy wait the last milliseconds before an edge instead of sleeping
+        :param start_delay: seconds between start() and the first edge
+        """
+        super().__init__(name="SyncPulseGenerator", daemon=True)
+        self.backend = backend
+        self.train = train
+        self.sinks = list(sinks) if sinks is not None else []
+        self.spin_ns = int(spin_ms * 1e6)
+        self.start_delay = start_delay
+        self.edges = 0
+        self.late_max_us = 0.0
+        self._late_sum_us = 0.0
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+
+    def stop(self, timeout: float = 2.0):
+        self._stop_event.set()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join(timeout)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"edges": self.edges, "late_max_us": self.late_max_us,
+                    "late_mean_us": self._late_sum_us / self.edges if self.edges else None}
+
+    def _wait_until(self, target_ns: int) -> bool:
+        """False when stopped while waiting"""
+        while True:
+            remaining = target_ns - time.perf_counter_ns()
+            if remaining <= 0:
+                return True
+            if remaining > self.spin_ns:
+                if self._stop_event.wait((remaining - self.spin_ns) / 1e9):
+                    return False
+            elif self._stop_event.is_set():
+                return False
+
+    def _emit(self, index: int, edge: Edge, scheduled_ns: int) -> PulseEdge:
+        before = time.perf_counter_ns()
+        self.backend.set(edge.level)
+        emitted = time.perf_counter_ns()
+        pulse = PulseEdge(index, edge.level, edge.marker, scheduled_ns, emitted, emitted - before, stamp_now(),
+                          edge.value)
+        with self._lock:
+            self.edges += 1
+            self.late_max_us = max(self.late_max_us, pulse.late_us)
+            self._late_sum_us += pulse.late_us
+        for sink in self.sinks:
+            try:
+                sink(pulse)
+            except Exception as e:
+                logging.warning("sync pulse sink {} failed: {}".format(sink, e))
+        return pulse
+
+    def run(self):
+        _raise_priority()
+        start_ns = time.perf_counter_ns() + int(self.start_delay * 1e9)
+        logging.info("sync pulses started")
+        try:
+            for index, edge in enumerate(self.train):
+                scheduled = start_ns + int(edge.offset * 1e9)
+                if not self._wait_until(scheduled):
+                    break
+                self._emit(index, edge, scheduled)
+        finally:
+            try:
+                self.backend.set(0)
+            except Exception as e:
+                logging.warning("could not reset the sync pin: {}".format(e))
+            stats = self.stats()
+            logging.info("sync pulses stopped after {} edges, max {:.0f} µs late".format(
+                stats["edges"], stats["late_max_us"]))
+
+
+class BoardMarkerSink:
+    """inserts the marker of an edge in a BrainFlow stream, right after the edge went out"""
+
+    def __init__(self, board, convert=None):
+        """
+        :param board: object with insert_marker(float), e.g. EEG.brainflow_get_data.EEG
+        :param convert: marker name -> float (None to skip), e.g. LSL.MarkerRegistry.MarkerRegistry.encode
+        """
+        self.board = board
+        self.convert = convert if convert is not None else (lambda marker: 1.0)
+
+    def __call__(self, edge: PulseEdge):
+        if edge.marker is None:
+            return
+        code = self.convert(edge.marker)
+        if code is not None:
+            self.board.insert_marker(code)
+
+
+class SessionLogSink:
+    """adds every edge to the websocket session log as a syncPulse record"""
+
+    def __init__(self, writer, client: str = "sync"):
+        """:param writer: the session's websocket.SessionLogWriter.SessionLogWriter"""
+        self.writer = writer
+        self.client = client
+
+    def __call__(self, edge: PulseEdge):
+        message = json.dumps({"websocketMessage": "syncPulse", "edge": edge.index, "level": edge.level,
+                              "marker": edge.marker, "value": edge.value, "late_us": round(edge.late_us, 1),
+                              "write_us": round(edge.write_ns / 1e3, 1)})
+        self.writer.write(message, edge.stamp, self.client)
+
+
+class PulseFile:
+    """tab separated edge log: index, level, marker, monotonic_ns, wall_ns, lsl, late_us, value"""
+
+    def __init__(self, file):
+        self._f = open(file, "a+", encoding="utf-8")
+        if self._f.tell() == 0:
+            self._f.write("index\tlevel\tmarker\tmonotonic_ns\twall_ns\tlsl\tlate_us\tvalue\n")
+
+    def __call__(self, edge: PulseEdge):
+        s = edge.stamp
+        self._f.write("{}\t{}\t{}\t{}\t{}\t{}\t{:.1f}\t{}\n".format(
+            edge.index, edge.level, edge.marker or "", s.monotonic_ns, s.wall_ns,
+            "" if s.lsl is None else "{:.6f}".format(s.lsl), edge.late_us, "" if edge.value is None else edge.value))
+        self._f.flush()
+
+    def close(self):
+        self._f.close()
+
+
+def from_config(config: dict, sinks: list = None, backend=None) -> SyncPulseGenerator:
+    """
+    generator for the DATA_CAPTURE.SYNC_PULSE block of conf.yaml
+    :param backend: overrides the FTDI device, e.g. FakeBackend() for a dry run
+    """
+    conf = config["DATA_CAPTURE"].get("SYNC_PULSE", {})
+    if backend is None:
+        backend = FtdiBackend(conf.get("DEVICE", 0), conf.get("MASK", 0x01))
+    if conf.get("MODE", "periodic") == "coded":
+        # a counter of 8 bits that wraps around
+        values = (n % 256 for n in itertools.count())
+        train = coded(values, conf.get("PERIOD", 5.0), marker=conf.get("MARKER", SYNC_MARKER))
+    else:
+        train = periodic(conf.get("PERIOD", 1.0), conf.get("WIDTH", 0.1), marker=conf.get("MARKER", SYNC_MARKER))
+    return SyncPulseGenerator(backend, train, sinks)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="send sync pulses on an FTDI pin")
+    parser.add_argument("--period", type=float, default=1.0, help="seconds between pulses")
+    parser.add_argument("--width", type=float, default=0.1, help="pulse width in seconds")
+    parser.add_argument("--count", type=int, default=None, help="number of pulses, endless by default")
+    parser.add_argument("--device", type=int, default=0, help="FTDI device index")
+    parser.add_argument("--log", default=None, help="tab separated edge log")
+    parser.add_argument("--fake", action="store_true", help="don't open a device, only log")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    sinks = [PulseFile(args.log)] if args.log else []
+    generator = SyncPulseGenerator(FakeBackend() if args.fake else FtdiBackend(args.device),
+                                   periodic(args.period, args.width, args.count), sinks)
+    generator.start()
+    try:
+        while generator.is_alive():
+            generator.join(0.5)
+    except KeyboardInterrupt:
+        generator.stop()
+    generator.backend.close()
@@ -1,10 +1,18 @@
-import sys, ftd2xx as ftd
-import time
-d = ftd.open(0)    # Open first FTDI device
-print(d.getDeviceInfo())
+"""
+one 1 s pulse on D0 of the first FTDI device, the edges are logged to sync_signal.tsv
+see EEG/sync_pulse.py for pulse trains during a session
+"""
+import logging
 
-OP = 0x01            # Bit mask for output D0
-d.setBitMode(OP, 1)  # Set pin as output, and async bitbang mode
-d.write(str(OP))     # Set output high
-time.sleep(1)
-d.write(str(0))      # Set output low
\ No newline at end of file
+from EEG.sync_pulse import FtdiBackend, PulseFile, SyncPulseGenerator, periodic
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    backend = FtdiBackend(0, 0x01)
+    log = PulseFile("sync_signal.tsv")
+    generator = SyncPulseGenerator(backend, periodic(period=2.0, width=1.0, count=1), [log])
+    generator.start()
+    generator.join()
+    backend.close()
+    log.close()
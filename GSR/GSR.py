@@ -1,5 +1,6 @@
 import atexit
 import csv
+import threading
 import time
 
 import brainflow.exit_codes
@@ -9,34 +10,58 @@ from brainflow.board_shim import BoardShim, BrainFlowInputParams, BoardIds, Brai
 from pathlib import Path
 from pprint import pprint
 
+from EEG.ring_buffer import BoardPoller
+from utils.dsp import processor_for
+from utils.recording import BinaryRecorder, channel_names
 from utils.utils import load_config, create_folder_structure
 
 
 class GSR:
-    def __init__(self, config: yaml, root_data_path: Path, board_id: BoardIds = BoardIds.EMOTIBIT_BOARD):
+    def __init__(self, config: yaml, root_data_path: Path, board_id: BoardIds = BoardIds.EMOTIBIT_BOARD,
+                 ip: str = None, name: str = None):
+        """
+        :param ip: ip of the EmotiBit, None connects to the first one BrainFlow discovers
+        :param name: device name when several EmotiBits record, its files go to gsr/<name>/
+        """
         self.board = None
         self.board_id = board_id
         self.config = config
-        self.file_movement = Path(root_data_path / 'gsr' / config["DATA_CAPTURE"]["GSR"]["MOVEMENT"])
-        self.file_ppg = Path(root_data_path / 'gsr' / config["DATA_CAPTURE"]["GSR"]["PPG"])
-        self.file_eda = Path(root_data_path / 'gsr' / config["DATA_CAPTURE"]["GSR"]["EDA"])
+        self.ip = ip
+        self.name = name
+        folder = Path(root_data_path / 'gsr') if name is None else Path(root_data_path / 'gsr' / name)
+        folder.mkdir(parents=True, exist_ok=True)
+        self.file_movement = folder / config["DATA_CAPTURE"]["GSR"]["MOVEMENT"]
+        self.file_ppg = folder / config["DATA_CAPTURE"]["GSR"]["PPG"]
+        self.file_eda = folder / config["DATA_CAPTURE"]["GSR"]["EDA"]
+        # "binary": .bin + .json per preset (see utils.recording), "csv": BrainFlow's text file streamers
+        self.recording_format = config["DATA_CAPTURE"].get("RECORDING_FORMAT", "csv")
+        self.pollers = []
         BoardShim.enable_dev_board_logger()
 
         params = BrainFlowInputParams()
-        self.board = BoardShim(BoardIds.EMOTIBIT_BOARD, params)
+        if ip is not None:
+            params.ip_address = ip
+        self.board = BoardShim(self.board_id, params)
         self.board.prepare_session()
-        pprint(BoardShim.get_board_descr(board_id, preset=BrainFlowPresets.ANCILLARY_PRESET))
-        pprint(self.board.get_other_channels(board_id=self.board.board_id,
-                                             preset=BrainFlowPresets.ANCILLARY_PRESET))
+        try:
+            pprint(BoardShim.get_board_descr(board_id, preset=BrainFlowPresets.ANCILLARY_PRESET))
+            pprint(self.board.get_other_channels(board_id=self.board.board_id,
+                                                 preset=BrainFlowPresets.ANCILLARY_PRESET))
+        except Exception:
+            # nobody else has the board to release it
+            self.board.release_session()
+            raise
+
+    def preset_files(self):
+        """file per EmotiBit preset: movement (default), ppg (auxiliary) and eda (ancillary)"""
+        return [(BrainFlowPresets.DEFAULT_PRESET, self.file_movement),
+                (BrainFlowPresets.AUXILIARY_PRESET, self.file_ppg),
+                (BrainFlowPresets.ANCILLARY_PRESET, self.file_eda)]
 
     def prep_stream_file(self):
-        headers = [
-            ["package_num_channel", "acc_x", "acc_y", "acc_z", "gyr_x", "gyr_y", "gyr_z", "mag_x", "mag_y", "mag_z",
-             "timestamp_channel", "marker_channel"]
-            , ["package_num_channel", "PPG_1", "PPG_2", "PPG_3", "timestamp_channel", "marker_channel"],
-            ["package_num_channel", "eda_channels", "temperature_channels", "other_channels",
-             "timestamp_channel", "marker_channel"]]
-        file_list = [self.file_movement, self.file_ppg, self.file_eda]
+        # one name per row the board actually sends, taken from the board description
+        headers = [channel_names(self.board_id, preset) for preset, _ in self.preset_files()]
+        file_list = [file for _, file in self.preset_files()]
 
         comb = zip(headers, file_list)
         for header, file in comb:
@@ -58,21 +83,175 @@ class GSR:
         self.board.add_streamer(streamer_params="file://{}:a".format(self.file_ppg),
                                 preset=BrainFlowPresets.AUXILIARY_PRESET)
 
-    def launch_gsr(self):
-        self.prep_stream_file()
-        self.stream_to_file()
-        self.board.start_stream()
+    def preset_streams(self):
+        """DATA_CAPTURE.DSP stream name of every preset, next to preset_files()"""
+        return ["MOVEMENT", "PPG", "EDA"]
+
+    def processors(self) -> dict:
+        """preset -> utils.dsp.StreamProcessor for the presets with a DATA_CAPTURE.DSP chain"""
+        processors = {}
+        for (preset, file), stream in zip(self.preset_files(), self.preset_streams()):
+            processor = processor_for(self.config, stream, file, self.board_id, preset)
+            if processor is not None:
+                processors[preset] = processor
+        return processors
+
+    def record_binary(self):
+        """record every preset to .bin + .json files, polled from the board instead of the text streamers"""
+        processors = self.processors()
+        self.pollers = [BoardPoller(self.board, preset=preset,
+                                    listeners=[BinaryRecorder(file.with_suffix(""), self.board_id, preset)] +
+                                    ([processors[preset]] if preset in processors else []))
+                        for preset, file in self.preset_files()]
+        for poller in self.pollers:
+            poller.start()
+
+    def start_processing(self):
+        """poll the filtered presets next to the text streamers, those aren't affected by polling"""
+        self.pollers = [BoardPoller(self.board, preset=preset, listeners=[processor])
+                        for preset, processor in self.processors().items()]
+        for poller in self.pollers:
+            poller.start()
+
+    def stop_binary_recording(self):
+        for poller in self.pollers:
+            poller.stop()
+            for recorder in poller.listeners:
+                recorder.close()
+        self.pollers = []
+
+    def launch_gsr(self, append: bool = False):
+        """:param append: continue existing csv recordings (after a restart) instead of writing new headers"""
+        if self.recording_format == "binary":
+            self.board.start_stream()
+            self.record_binary()
+        else:
+            if not append:
+                self.prep_stream_file()
+            self.stream_to_file()
+            self.board.start_stream()
+            self.start_processing()
         print("GSR started")
 
+    def insert_marker(self, i: float):
+        self.board.insert_marker(i)
+
     # @atexit.register
     def stop_gsr(self):
         # make sure we clean the connection if the application is stopped
         print("finishing up GSR")
         # self.stop_sd_recording()
         self.board.stop_stream()
+        self.stop_binary_recording()
         self.board.release_session()
 
 
+def configured_devices(config: yaml) -> list:
+    """
+    (name, ip) of every EmotiBit in DATA_CAPTURE.GSR.DEVICES,
+    [(None, None)] (the first EmotiBit found, files directly in gsr/) when there's no list
+    """
+    devices = config["DATA_CAPTURE"]["GSR"].get("DEVICES") or []
+    if not devices:
+        return [(None, None)]
+    names = [device["NAME"] for device in devices]
+    if len(set(names)) != len(names):
+        raise ValueError("EmotiBit names in DATA_CAPTURE.GSR.DEVICES must be unique: {}".format(names))
+    return [(device["NAME"], device.get("IP")) for device in devices]
+
+
+class GSRDevices:
+    """one GSR board session per configured EmotiBit, each prepared, started and stopped on its own thread"""
+
+    def __init__(self, config: yaml, root_data_path: Path, board_id: BoardIds = BoardIds.EMOTIBIT_BOARD):
+        self.config = config
+        self.root_data_path = root_data_path
+        self.board_id = board_id
+        self.prepared = {}  # name -> GSR with a prepared session, not streaming yet
+        self.devices = {}  # name -> GSR
+        self.errors = {}  # name -> exception of a device whose last attempt to prepare or start failed
+        self._lock = threading.Lock()
+
+    def _prepare(self, name, ip):
+        try:
+            gsr = GSR(self.config, self.root_data_path, self.board_id, ip=ip, name=name)
+        except Exception as e:
+            print("EmotiBit {} ({}) couldn't be prepared: {!r}".format(name, ip or "discovery", e))
+            with self._lock:
+                self.errors[name] = e
+            return
+        with self._lock:
+            self.prepared[name] = gsr
+            # an earlier attempt may have failed
+            self.errors.pop(name, None)
+
+    def prepare(self) -> bool:
+        """connect all devices in parallel (discovery takes seconds per device), True when all are prepared"""
+        self._on_all(self._prepare, [(name, ip) for name, ip in configured_devices(self.config)
+                                     if name not in self.prepared and name not in self.devices])
+        return not self.errors
+
+    def _launch(self, name, gsr, append):
+        try:
+            gsr.launch_gsr(append)
+        except Exception as e:
+            print("EmotiBit {} didn't start: {!r}".format(name, e))
+            with self._lock:
+                self.errors[name] = e
+            try:
+                gsr.stop_binary_recording()
+                gsr.board.release_session()
+            except Exception as release_error:
+                print("releasing EmotiBit {} failed: {}".format(name, release_error))
+            return
+        with self._lock:
+            self.devices[name] = gsr
+            self.errors.pop(name, None)
+
+    def _on_all(self, target, items):
+        threads = [threading.Thread(target=target, args=item, name="GSR-{}".format(item[0]), daemon=True)
+                   for item in items]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def launch_gsr(self, append: bool = False) -> bool:
+        """start all devices in parallel, preparing the ones prepare() didn't, True when all started"""
+        self.prepare()
+        prepared, self.prepared = self.prepared, {}
+        self._on_all(self._launch, [(name, gsr, append) for name, gsr in prepared.items()])
+        return not self.errors
+
+    def release(self):
+        """release the sessions of devices that were prepared but never started"""
+        for name, gsr in list(self.prepared.items()):
+            try:
+                gsr.board.release_session()
+            except BrainFlowError as e:
+                print("releasing EmotiBit {} failed: {}".format(name, e))
+        self.prepared = {}
+
+    def insert_marker(self, i: float):
+        for gsr in list(self.devices.values()):
+            gsr.insert_marker(i)
+
+    def samples(self) -> int:
+        """samples polled so far over all devices and presets (binary recording only, else None)"""
+        pollers = [poller for gsr in list(self.devices.values()) for poller in gsr.pollers]
+        return sum(poller.buffer.count for poller in pollers) if pollers else None
+
+    def stop_gsr(self):
+        def stop(name, gsr):
+            try:
+                gsr.stop_gsr()
+            except BrainFlowError as e:
+                print("stopping EmotiBit {} failed: {}".format(name, e))
+
+        self._on_all(stop, list(self.devices.items()))
+        self.devices = {}
+
+
 if __name__ == '__main__':
     config = load_config(Path(Path.cwd().parent / "conf.yaml"))
 
@@ -1,31 +1,482 @@
+"""
+EmotiBit data as sent by the EmotiBit Oscilloscope over OSC
+
+every OSC address (one signal, e.g. /EmotiBit/0/EDA) goes into its own ChannelBuffer: two numpy columns,
+receive time (unix seconds, the clock of the BrainFlow timestamps) and value, that grow by doubling. A
+message can carry several samples, they all get the receive time of the message. OSCIngest writes what
+came in to disk every flush_interval seconds, one utils.recording file (timestamp, value) per signal,
+and keeps the last keep_seconds in memory for latest().
+
+EmotiBitRouter takes /EmotiBit/<n>/<channel> from several devices on one port and keeps every device apart.
+
+two ways to receive: GSR.create_dispatchers() blocks on python-osc's ThreadingOSCUDPServer (a thread per
+datagram), AsyncOSCServer / GSR.serve_async() runs on an asyncio loop, e.g. the one of the websocket
+server, and handles the datagrams of every batch_interval together (one append per signal per batch).
+"""
+import asyncio
+import logging
+import re
+import socket
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
 from pythonosc import dispatcher
+from pythonosc import osc_packet
 from pythonosc import osc_server
-import pandas as pd
+
+from utils.recording import BinaryRecorder
+
+# EmotiBit Oscilloscope channel -> signal name
+SIGNALS = {
+    "PPG:RED": "PPG_RED",
+    "PPG:IR": "PPG_IR",
+    "PPG:GRN": "PPG_GRN",
+    "EDA": "EDA",
+    "HUMIDITY": "HUM",
+    "ACC:X": "ACC_X",
+    "ACC:Y": "ACC_Y",
+    "ACC:Z": "ACC_Z",
+    "GYRO:X": "GYR_X",
+    "GYRO:Y": "GYR_Y",
+    "GYRO:Z": "GYR_Z",
+    "MAG:X": "MAG_X",
+    "MAG:Y": "MAG_Y",
+    "MAG:Z": "MAG_Z",
+    "THERM": "THERM",
+    "TEMP": "TEMP",
+}
+
+
+class ChannelBuffer:
+    """growable (receive time, value) columns of one OSC address"""
+
+    def __init__(self, name: str, capacity: int = 1024):
+        self.name = name
+        self.total = 0  # samples received since the start
+        self._times = np.empty(capacity, dtype=np.float64)
+        self._values = np.empty(capacity, dtype=np.float64)
+        self._count = 0  # samples in memory
+        self._flushed = 0  # samples in memory that are already on disk
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._count
+
+    def append(self, stamp, values):
+        """append values, stamp is one receive time for all of them or one per value"""
+        n = len(values)
+        with self._lock:
+            end = self._count + n
+            if end > len(self._times):
+                self._grow(end)
+            self._times[self._count:end] = stamp
+            self._values[self._count:end] = values
+            self._count = end
+            self.total += n
+
+    def _grow(self, needed: int):
+        capacity = max(needed, 2 * len(self._times))
+        for column in ("_times", "_values"):
+            grown = np.empty(capacity, dtype=np.float64)
+            grown[:self._count] = getattr(self, column)[:self._count]
+            setattr(self, column, grown)
+
+    def take_unflushed(self) -> np.ndarray:
+        """(2 x n) array of the samples that aren't on disk yet, marks them as flushed"""
+        with self._lock:
+            chunk = np.vstack((self._times[self._flushed:self._count], self._values[self._flushed:self._count]))
+            self._flushed = self._count
+        return chunk
+
+    def trim(self, keep_seconds: float):
+        """forget flushed samples older than keep_seconds before the newest one"""
+        with self._lock:
+            if self._count == 0:
+                return
+            first = int(np.searchsorted(self._times[:self._flushed], self._times[self._count - 1] - keep_seconds))
+            if first == 0:
+                return
+            kept = self._count - first
+            self._times[:kept] = self._times[first:self._count]
+            self._values[:kept] = self._values[first:self._count]
+            self._count = kept
+            self._flushed -= first
+
+    def latest(self, seconds: float = None):
+        """(times, values) copies of the last seconds (everything in memory when None)"""
+        with self._lock:
+            times = self._times[:self._count]
+            first = 0 if seconds is None or self._count == 0 \
+                else int(np.searchsorted(times, times[-1] - seconds, side="left"))
+            return times[first:].copy(), self._values[first:self._count].copy()
+
+
+def signal_type(name: str) -> str:
+    """sidecar channel type of a signal name, e.g. PPG_RED -> ppg, ACC_X -> accel"""
+    prefix = name.split("_")[0].lower()
+    return {"acc": "accel", "gyr": "gyro", "therm": "temperature", "temp": "temperature",
+            "hum": "humidity"}.get(prefix, prefix)
+
+
+def _dispatch(batch, resolve):
+    """
+    parse (datagram, receive time) pairs and append every message to the buffer resolve(address) returns,
+    grouped so every buffer gets one append per batch. A message with a non-numeric argument is skipped,
+    so it can't fail the append of the whole batch
+    :return: (datagrams and messages that didn't parse, messages without a buffer)
+    """
+    grouped = {}
+    errors = 0
+    unrouted = 0
+    for data, stamp in batch:
+        try:
+            messages = osc_packet.OscPacket(data).messages
+        except osc_packet.ParseError as e:
+            errors += 1
+            logging.debug("dropping an OSC datagram that doesn't parse: {}".format(e))
+            continue
+        for timed in messages:
+            buffer = resolve(timed.message.address)
+            if buffer is None:
+                unrouted += 1
+                continue
+            try:
+                params = [float(value) for value in timed.message.params]
+            except (TypeError, ValueError) as e:
+                errors += 1
+                logging.debug("dropping an OSC message to {} with a non-numeric value: {}".format(
+                    timed.message.address, e))
+                continue
+            stamps, values = grouped.setdefault(buffer, ([], []))
+            stamps.extend([stamp] * len(params))
+            values.extend(params)
+    for buffer, (stamps, values) in grouped.items():
+        buffer.append(np.array(stamps), values)
+    return errors, unrouted
+
+
+class OSCIngest:
+    """ChannelBuffers per signal, flushed to disk by a background thread"""
+
+    def __init__(self, out_dir=None, flush_interval: float = 1.0, keep_seconds: float = 60.0, prefix: str = "osc",
+                 routes: dict = None):
+        """
+        :param out_dir: folder for the recordings (<prefix>_<signal>.bin/.json), None keeps data in memory only
+        :param flush_interval: seconds between writes to disk
+        :param keep_seconds: how much data stays available in memory for latest()
+        :param prefix: file name prefix
+        :param routes: OSC address -> signal name, for handle_packet()
+        """
+        self.routes = dict(routes) if routes is not None else {}
+        self.unrouted = 0
+        self._resolved = {}
+        self.out_dir = Path(out_dir) if out_dir is not None else None
+        self.flush_interval = flush_interval
+        self.keep_seconds = keep_seconds
+        self.prefix = prefix
+        self.buffers = {}
+        self.recorders = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def buffer(self, name: str) -> ChannelBuffer:
+        buffer = self.buffers.get(name)
+        if buffer is None:
+            with self._lock:
+                buffer = self.buffers.setdefault(name, ChannelBuffer(name))
+        return buffer
+
+    def handle(self, address: str, args, *values):
+        """python-osc handler, map it with the signal name as argument: dispatch.map(address, handle, name)"""
+        self.buffer(args[0]).append(time.time(), values)
+
+    def resolve(self, address: str):
+        """ChannelBuffer for an OSC address, None if it isn't routed (looked up once per address)"""
+        try:
+            return self._resolved[address]
+        except KeyError:
+            name = self.routes.get(address)
+            buffer = self._resolved[address] = self.buffer(name) if name is not None else None
+            return buffer
+
+    def handle_packet(self, data: bytes, stamp: float):
+        """parse a datagram (message or bundle) and store every routed message with the receive time stamp"""
+        self.handle_batch([(data, stamp)])
+
+    def handle_batch(self, batch) -> int:
+        """
+        handle_packet() for a list of (datagram, receive time), with one append per signal
+        :return: number of datagrams and messages that didn't parse
+        """
+        errors, unrouted = _dispatch(batch, self.resolve)
+        self.unrouted += unrouted
+        return errors
+
+    def latest(self, name: str, seconds: float = None):
+        """(times, values) of the last seconds of a signal, empty arrays if nothing came in yet"""
+        buffer = self.buffers.get(name)
+        if buffer is None:
+            return np.empty(0), np.empty(0)
+        return buffer.latest(seconds)
+
+    def _recorder(self, name: str) -> BinaryRecorder:
+        recorder = self.recorders.get(name)
+        if recorder is None:
+            meta = {"source": "osc", "sampling_rate": None, "num_rows": 2,
+                    "channels": [{"row": 0, "name": "timestamp", "type": "timestamp"},
+                                 {"row": 1, "name": name, "type": signal_type(name)}]}
+            recorder = BinaryRecorder(self.out_dir / "{}_{}".format(self.prefix, name), meta=meta)
+            self.recorders[name] = recorder
+        return recorder
+
+    def flush(self):
+        """write everything new to disk and trim the memory to keep_seconds"""
+        for name, buffer in list(self.buffers.items()):
+            if self.out_dir is not None:
+                chunk = buffer.take_unflushed()
+                if chunk.shape[1]:
+                    self._recorder(name).write(chunk)
+            else:
+                buffer.take_unflushed()
+            buffer.trim(self.keep_seconds)
+        for recorder in self.recorders.values():
+            recorder.flush()
+
+    def _run(self):
+        while not self._stop_event.wait(self.flush_interval):
+            try:
+                self.flush()
+            except OSError as e:
+                logging.error("writing OSC data failed: {}".format(e))
+
+    def start(self):
+        if self.out_dir is not None:
+            self.out_dir.mkdir(parents=True, exist_ok=True)
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="OSCIngestFlush", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """stop the flush thread, write what's left and close the files"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+        for recorder in self.recorders.values():
+            recorder.close()
+        self.recorders.clear()
+
+
+class EmotiBitRouter:
+    """
+    several EmotiBits on one OSC port: /EmotiBit/<n>/<channel> goes to an OSCIngest per device, with its
+    own buffers, files (<out_dir>/<device name>/osc_<signal>.bin) and flush thread
+
+    an address is parsed the first time it's seen, after that it's one dict lookup, whatever the number of
+    devices. Use it wherever an OSCIngest is expected (AsyncOSCServer, GSR).
+    """
+
+    ADDRESS = re.compile(r"^/EmotiBit/(\d+)/(.+)$")
+
+    def __init__(self, out_dir=None, devices: dict = None, **ingest_options):
+        """
+        :param out_dir: session folder for the recordings, a sub folder per device
+        :param devices: OSC device number -> name, e.g. {0: "child", 1: "caregiver"}, other numbers are
+            ignored; None accepts every number as emotibit_<n>
+        :param ingest_options: passed on to every OSCIngest (flush_interval, keep_seconds, ...)
+        """
+        self.out_dir = Path(out_dir) if out_dir is not None else None
+        self.devices = {int(n): str(name) for n, name in devices.items()} if devices is not None else None
+        self.ingest_options = ingest_options
+        self.ingests = {}
+        self.unrouted = 0
+        self._resolved = {}
+        self._started = False
+        self._lock = threading.Lock()
+
+    def ingest(self, device: int) -> OSCIngest:
+        """the OSCIngest of a device number, created on first use"""
+        ingest = self.ingests.get(device)
+        if ingest is None:
+            with self._lock:
+                ingest = self.ingests.get(device)
+                if ingest is None:
+                    name = self.devices[device] if self.devices is not None else "emotibit_{}".format(device)
+                    out_dir = self.out_dir / name if self.out_dir is not None else None
+                    ingest = OSCIngest(out_dir, **self.ingest_options)
+                    if self._started:
+                        ingest.start()
+                    self.ingests[device] = ingest
+        return ingest
+
+    def _route(self, address: str):
+        match = self.ADDRESS.match(address)
+        if match is None:
+            return None
+        device = int(match.group(1))
+        if self.devices is not None and device not in self.devices:
+            return None
+        channel = match.group(2)
+        return self.ingest(device).buffer(SIGNALS.get(channel, channel.replace(":", "_").replace("/", "_")))
+
+    def resolve(self, address: str):
+        try:
+            return self._resolved[address]
+        except KeyError:
+            buffer = self._resolved[address] = self._route(address)
+            return buffer
+
+    def handle(self, address: str, *values):
+        """python-osc default handler: dispatch.set_default_handler(router.handle)"""
+        buffer = self.resolve(address)
+        if buffer is None:
+            self.unrouted += 1
+        else:
+            buffer.append(time.time(), values)
+
+    def handle_batch(self, batch) -> int:
+        errors, unrouted = _dispatch(batch, self.resolve)
+        self.unrouted += unrouted
+        return errors
+
+    def latest(self, device: int, name: str, seconds: float = None):
+        ingest = self.ingests.get(device)
+        if ingest is None:
+            return np.empty(0), np.empty(0)
+        return ingest.latest(name, seconds)
+
+    def start(self):
+        with self._lock:
+            self._started = True
+            for ingest in self.ingests.values():
+                ingest.start()
+
+    def flush(self):
+        for ingest in list(self.ingests.values()):
+            ingest.flush()
+
+    def close(self):
+        with self._lock:
+            self._started = False
+            ingests = list(self.ingests.values())
+        for ingest in ingests:
+            ingest.close()
+
+
+class _BatchedProtocol(asyncio.DatagramProtocol):
+    """stamps datagrams on arrival and hands them to the ingest in batches of batch_interval seconds"""
+
+    def __init__(self, ingest: OSCIngest, batch_interval: float):
+        self.ingest = ingest
+        self.batch_interval = batch_interval
+        self.transport = None
+        self.datagrams = 0
+        self.batches = 0
+        self.errors = 0
+        self._pending = []
+        self._scheduled = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if self._scheduled is None:
+            self._scheduled = asyncio.get_running_loop().call_later(self.batch_interval, self.process)
+        self._pending.append((data, time.time()))
+
+    def process(self):
+        if self._scheduled is not None:
+            self._scheduled.cancel()
+            self._scheduled = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        self.batches += 1
+        self.datagrams += len(batch)
+        self.errors += self.ingest.handle_batch(batch)
+
+    def error_received(self, exc):
+        logging.warning("OSC socket error: {}".format(exc))
+
+
+class AsyncOSCServer:
+    """OSC over UDP on the running asyncio loop, no threads"""
+
+    def __init__(self, ip: str, port: int, ingest: OSCIngest, batch_interval: float = 0.01,
+                 receive_buffer: int = 1 << 20):
+        """
+        :param ingest: where the messages go, an OSCIngest with its routes set or an EmotiBitRouter
+        :param batch_interval: seconds datagrams are collected before they're handled together
+        :param receive_buffer: socket receive buffer in bytes
+        """
+        self.ip = ip
+        self.port = port
+        self.ingest = ingest
+        self.batch_interval = batch_interval
+        self.receive_buffer = receive_buffer
+        self._protocol = None
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        transport, self._protocol = await loop.create_datagram_endpoint(
+            lambda: _BatchedProtocol(self.ingest, self.batch_interval), local_addr=(self.ip, self.port))
+        try:
+            # room for bursts while the loop is busy with a websocket message
+            transport.get_extra_info("socket").setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.receive_buffer)
+        except OSError as e:
+            logging.debug("could not enlarge the OSC receive buffer: {}".format(e))
+        self.ingest.start()
+        logging.info("OSC server listening on {}:{}".format(self.ip, self.port))
+
+    def stats(self) -> dict:
+        p = self._protocol
+        if p is None:
+            return {}
+        return {"datagrams": p.datagrams, "batches": p.batches, "parse_errors": p.errors,
+                "unrouted": self.ingest.unrouted}
+
+    async def stop(self):
+        """close the socket, handle what was already received and write it all to disk"""
+        if self._protocol is None:
+            return
+        self._protocol.transport.close()
+        self._protocol.process()
+        self._protocol = None
+        await asyncio.to_thread(self.ingest.close)
+        logging.info("OSC server stopped")
+
+    async def serve_forever(self):
+        """start and run until cancelled, then stop cleanly"""
+        await self.start()
+        try:
+            await asyncio.Future()
+        finally:
+            await self.stop()
 
 
 class GSR:
-    def __init__(self, ip, port):
-        self.GSR_Values = {
-            "/EmotiBit/0/PPG:RED": "PPG_RED",
-            "/EmotiBit/0/PPG:IR": "PPG_IR",
-            "/EmotiBit/0/PPG:GRN": "PPG_GRN",
-            "/EmotiBit/0/EDA": "EDA",
-            "/EmotiBit/0/HUMIDITY": "HUM",
-            "/EmotiBit/0/ACC:X": "ACC_X",
-            "/EmotiBit/0/ACC:Y": "ACC_Y",
-            "/EmotiBit/0/ACC:Z": "ACC_Z",
-            "/EmotiBit/0/GYRO:X": "GYR_X",
-            "/EmotiBit/0/GYRO:Y": "GYR_Y",
-            "/EmotiBit/0/GYRO:Z": "GYR_Z",
-            "/EmotiBit/0/MAG:X": "MAG_X",
-            "/EmotiBit/0/MAG:Y": "MAG_Y",
-            "/EmotiBit/0/MAG:Z": "MAG_Z",
-            "/EmotiBit/0/THERM": "THERM",
-            "/EmotiBit/0/TEMP": "TEMP"
-        }
-        self.df = pd.DataFrame()
+    def __init__(self, ip, port, out_dir=None, verbose: bool = False, devices: dict = None):
+        """
+        :param ip: ip to listen on, the one in EmotiBit's oscOutputSettings.xml
+        :param port: port to listen on
+        :param out_dir: folder for the recordings, None keeps the data in memory only
+        :param verbose: also print every message (what this script used to do)
+        :param devices: OSC device number -> name for several EmotiBits (see EmotiBitRouter),
+            None for a single EmotiBit on /EmotiBit/0
+        """
+        self.GSR_Values = {"/EmotiBit/0/{}".format(channel): name for channel, name in SIGNALS.items()}
+        if devices is None:
+            self.ingest = OSCIngest(out_dir, routes=self.GSR_Values)
+        else:
+            self.ingest = EmotiBitRouter(out_dir, devices)
         self.ip = ip
         self.port = port
+        self.verbose = verbose
+        self.server = None
 
     @staticmethod
     def print_volume_handler(unused_addr, args, volume):
@@ -37,14 +488,43 @@ class GSR:
         """
         print("[{0}] ~ {1}".format(args[0], volume))
 
-    def create_dispatchers(self):
+    def latest(self, name: str, seconds: float = None, device: int = 0):
+        """(times, values) of the last seconds of a signal, e.g. latest("EDA", 10)"""
+        if isinstance(self.ingest, EmotiBitRouter):
+            return self.ingest.latest(device, name, seconds)
+        return self.ingest.latest(name, seconds)
+
+    def make_dispatcher(self) -> dispatcher.Dispatcher:
         dispatch = dispatcher.Dispatcher()
+        if isinstance(self.ingest, EmotiBitRouter):
+            # one catch-all handler, the router looks addresses up in a dict instead of matching every pattern
+            dispatch.set_default_handler(self.ingest.handle)
+            return dispatch
         for osc_cmd, df_col in self.GSR_Values.items():
-            dispatch.map(osc_cmd, self.print_volume_handler, df_col)
-        server = osc_server.ThreadingOSCUDPServer(
-            (self.ip, self.port), dispatch)
-        print("Serving on {}".format(server.server_address))
-        server.serve_forever()
+            dispatch.map(osc_cmd, self.ingest.handle, df_col)
+            if self.verbose:
+                dispatch.map(osc_cmd, self.print_volume_handler, df_col)
+        return dispatch
+
+    def create_dispatchers(self):
+        """receive until stop() is called (from another thread) or ctrl-c"""
+        self.server = osc_server.ThreadingOSCUDPServer((self.ip, self.port), self.make_dispatcher())
+        print("Serving on {}".format(self.server.server_address))
+        self.ingest.start()
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            self.ingest.close()
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+
+    async def serve_async(self):
+        """receive on the running asyncio loop until the task is cancelled, alternative to create_dispatchers()"""
+        print("Serving on {}".format((self.ip, self.port)))
+        await AsyncOSCServer(self.ip, self.port, self.ingest).serve_forever()
 
 
 if __name__ == '__main__':
@@ -55,5 +535,8 @@ if __name__ == '__main__':
           "-emotibit-oscilloscope)")
     default_ip = "127.0.0.1"
     default_port = 12345
-    gsr = GSR(default_ip, default_port)
-    gsr.create_dispatchers()
+    gsr = GSR(default_ip, default_port, out_dir="osc")
+    try:
+        gsr.create_dispatchers()
+    except KeyboardInterrupt:
+        pass
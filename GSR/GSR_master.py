@@ -17,7 +17,10 @@ import sys
 from Player.PlayerSession import PlayerSession
 
 sys.path.append("../")
+from EEG.ring_buffer import BoardPoller
 from utils import get_com_port
+from utils.dsp import processor_for
+from utils.recording import BinaryRecorder
 from utils.utils import load_config
 
 
@@ -29,7 +32,13 @@ class GSR:
         self.board_id = board_id
         self.config = config
         self.ip = ip
-        self.file = Path(root_data_path / 'gsr' / config["DATA_CAPTURE"]["GSR"])
+        self.live = None
+        self.processor = None
+        self.recorder = None
+        # the default preset of the EmotiBit is the movement data
+        self.file = Path(root_data_path / 'gsr' / config["DATA_CAPTURE"]["GSR"]["MOVEMENT"])
+        # "binary": gsr_mov.bin + gsr_mov.json (see utils.recording), "csv": BrainFlow's text file streamer
+        self.recording_format = config["DATA_CAPTURE"].get("RECORDING_FORMAT", "csv")
         BoardShim.enable_dev_board_logger()
 
         params = BrainFlowInputParams()
@@ -54,11 +63,58 @@ class GSR:
         print(self.file)
         self.board.add_streamer(streamer_params="file://{}:a".format(self.file))
 
+    def record_binary(self):
+        """record to .bin + .json instead of the text file streamer, fed by the live buffer"""
+        self.recorder = BinaryRecorder(self.file.with_suffix(""), self.board_id)
+
     def insert_marker(self, i: float):
         print("inserting {}".format(i))
 
         self.board.insert_marker(i)
 
+    def start_live_buffer(self, seconds: float = 30.0, poll_interval: float = 0.05, buffer=None) -> BoardPoller:
+        """
+        keep the last seconds of the default preset in self.live.buffer (see EEG.start_live_buffer)
+        :param buffer: a SharedRingBuffer to fill instead, when the board runs in a worker process
+        """
+        listeners = [listener for listener in (self.recorder, self.processor) if listener is not None]
+        self.live = BoardPoller(self.board, seconds=seconds, poll_interval=poll_interval, listeners=listeners,
+                                buffer=buffer)
+        self.live.start()
+        return self.live
+
+    def launch_gsr(self, append: bool = False, live_buffer=None):
+        """
+        :param append: continue an existing csv recording (after a restart) instead of writing a new header,
+            binary recordings always append
+        :param live_buffer: SharedRingBuffer for the live data, see start_live_buffer()
+        """
+        if self.recording_format == "binary":
+            self.record_binary()
+        else:
+            if not append:
+                self.prep_stream_file()
+            self.stream_to_file()
+        # DATA_CAPTURE.DSP.MOVEMENT, see utils.dsp
+        self.processor = processor_for(self.config, "MOVEMENT", self.file, self.board_id)
+        self.board.start_stream()
+        self.start_live_buffer(buffer=live_buffer)
+        print("GSR started")
+
+    def stop_gsr(self):
+        print("finishing up GSR")
+        self.board.stop_stream()
+        if self.live is not None:
+            self.live.stop()
+            self.live = None
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+        if self.processor is not None:
+            self.processor.close()
+            self.processor = None
+        self.board.release_session()
+
 
 if __name__ == '__main__':
     # first we need to enter the device's IP in the config file
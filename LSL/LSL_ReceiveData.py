@@ -1,77 +1,119 @@
 """Example program to demonstrate how to read string-valued markers from LSL."""
 import logging
-import threading
 
-from pylsl import StreamInlet, resolve_stream
-
-from eeg.brainflow_get_data import EEG
+from EEG.brainflow_get_data import EEG
+from LSL.MarkerBridge import BrainflowSink, MarkerBridge
+from LSL.MarkerRegistry import MarkerRegistry
+from LSL.StreamResolver import StreamConnection
 
 
 class LSLReceptor:
-    def __init__(self, eeg: EEG = None, prop: str = 'type', value: str = 'Markers'):
+    def __init__(self, eeg: EEG = None, prop: str = 'type', value: str = 'Markers', config: dict = None,
+                 source_id: str = None, timeout: float = 5.0):
         """.
         function to capture LSL markers, we can convert these to float markers as described in data document
         :param prop: usually you don't touch this
         :param value: can be adjusted, we'll only be looking for data of this 'type'
+        :param config: loaded conf.yaml, its MARKERS section defines the marker names and codes
+        :param source_id: stick to the stream with this source_id (also after the outlet restarts)
+        :param timeout: how long (s) we wait for the stream before continuing without it, it keeps
+            being looked for in the background
         """
-        self.streams = resolve_stream(prop, value)
-        # create a new inlet to read from the stream
-        self.inlet = StreamInlet(self.streams[0])
-        self.Marker = {'game_start': 0, 'ball_release': 1, 'ball_good_hit': 2, 'ball_bad_hit': 3, 'score': 4, 'test': 5,
-                       'end_game': 6}
+        self.markers = MarkerRegistry.from_config(config)
         self.eeg = eeg
+        self.bridge = None
+        self.connection = StreamConnection(prop, value, source_id=source_id, timeout=timeout,
+                                           on_attach=self._on_attach)
+        if not self.connection.connect():
+            logging.warning("no LSL stream with {}={} found within {}s, waiting for it in the background".format(
+                prop, value, timeout))
+        self.connection.start()
+
+    @property
+    def inlet(self):
+        """the current inlet, None while the stream is (re)resolved"""
+        return self.connection.inlet
+
+    def _on_attach(self, inlet):
+        if self.bridge is not None:
+            self.bridge.set_inlet(inlet)
 
-    def is_running(self):
-        # print(self.inlet.info())
-        if self.inlet.channel_count >= 1:
-            return True
-        else:
-            return False
-        # todo return boolean value to check if running!
-
-    def start_receive_thread(self):
-        x = threading.Thread(target=self.receive_test)
-        print("starting LSL")
-        logging.info("Main    : before running thread")
-        x.start()
-        logging.info("Main    : wait for the thread to finish")
-        return x
+    def is_running(self) -> bool:
+        """True when the marker outlet is attached and answered a recent liveness probe"""
+        return self.connection.is_alive()
+
+    def start_receive_thread(self, sinks: list = None) -> MarkerBridge:
+        """
+        start forwarding markers on a background bridge thread, stop it with stop_receive_thread()
+        :param sinks: callables sink(markers, timestamps), defaults to inserting them in the EEG stream
+        """
+        if sinks is None:
+            sinks = [BrainflowSink(self.eeg, convert=self.markers.encode)] if self.eeg is not None else []
+        # the bridge first, then the inlet: an attach in between reaches the bridge through _on_attach
+        self.bridge = MarkerBridge(None, sinks, on_lost=self.connection.mark_lost)
+        self.connection.replay()
+        info = self.connection.info
+        logging.info("starting LSL marker bridge for {}".format(
+            "{} ({})".format(info.name(), info.source_id()) if info is not None else "a stream not found yet"))
+        self.bridge.start()
+        return self.bridge
+
+    def stop_receive_thread(self):
+        if self.bridge is not None:
+            self.bridge.stop()
+            logging.info("LSL marker bridge stats: {}".format(self.bridge.stats()))
+            self.bridge = None
+
+    def close(self):
+        """stop forwarding markers and stop watching the stream"""
+        self.stop_receive_thread()
+        self.connection.stop()
 
     def receive_test(self):
-        while True:
-            # get a new sample (you can also omit the timestamp part if you're not
-            # interested in it)
-            sample, timestamp = self.inlet.pull_sample()
-            print("got %s at time %s from name %s and source id %s" % (
-                sample[0], timestamp, self.streams[0].name(), self.streams[0].source_id()))
-            if self.eeg is not None:
-                self.eeg.insert_marker(round(sample[0], 1))
-            try:
-                print("converted: {}".format(list(self.Marker.keys())[list(self.Marker.values()).index(sample[0])]))
-            except Exception as e:
-                print(e)
-                pass
+        """print incoming markers (and forward them to the EEG) until interrupted"""
+        def log_sink(markers, timestamps):
+            for marker, timestamp in zip(markers, timestamps):
+                code = self.markers.encode(marker)
+                logging.info("got {} ({} -> {}) at time {}".format(
+                    marker, self.markers.decode(code) if code is not None else "dropped", code, timestamp))
+
+        sinks = [log_sink]
+        if self.eeg is not None:
+            sinks.append(BrainflowSink(self.eeg, convert=self.markers.encode))
+        bridge = self.start_receive_thread(sinks)
+        try:
+            while bridge.is_alive():
+                bridge.join(1.0)
+        except KeyboardInterrupt:
+            pass
+        self.close()
 
     def receive_when_sample_available(self):
+        inlet = self.inlet
+        if inlet is None:
+            return None, None
         # we set timeout to 0.0, so it doesn't block
-        sample, timestamp = self.inlet.pull_sample(timeout=0.0)
+        try:
+            sample, timestamp = inlet.pull_sample(timeout=0.0)
+        except Exception as e:
+            logging.warning("LSL inlet error: {}".format(e))
+            self.connection.mark_lost()
+            return None, None
         # print("got %s at time %s" % (sample[0], timestamp))
         if sample is not None:
-            sample = self.convert_marker_to_Brainflow(sample)
+            sample = self.convert_marker_to_Brainflow(sample[0])
         return sample, timestamp
 
-    @staticmethod
-    def convert_marker_to_Brainflow(stringsample: str):
-        print('todo')
-        float_sample = 1.0  # todo make the magic of conversion happen
-        return float_sample
+    def convert_marker_to_Brainflow(self, stringsample: str):
+        """marker name (or number) -> float code for BoardShim.insert_marker, None if it's dropped"""
+        return self.markers.encode(stringsample)
 
 
 def main():
     lsl = LSLReceptor(value="Markers")
     # lsl = LSLReceptor(prop="source_id", value="LSL2")
     # lsl = LSLReceptor(prop="Name", value="DataSyncMarker_emotibit")
-    print(lsl.inlet.value_type)
+    print("LSL stream running: {}".format(lsl.is_running()))
     # lsl.start_receive_thread()
     lsl.receive_test()
 
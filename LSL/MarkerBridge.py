@@ -0,0 +1,199 @@
+import json
+import logging
+import threading
+import time
+
+from pylsl import StreamInlet, local_clock
+
+from utils.clock import stamp_now
+
+
+class MarkerBridge(threading.Thread):
+    """
+    forwards LSL markers to any number of sinks, in batches, on its own thread
+
+    markers are pulled with pull_chunk and a timeout, so the thread wakes up regularly and can be
+    stopped with stop(). Every sink is a callable sink(markers: list, timestamps: list) that gets the
+    whole batch at once, a failing sink is logged and doesn't stop the others.
+    """
+
+    def __init__(self, inlet: StreamInlet, sinks: list = None, pull_timeout: float = 0.1,
+                 max_batch: int = 256, correction_interval: float = 10.0, on_lost=None):
+        """
+        :param inlet: an opened LSL marker inlet, may be None until set_inlet() is called
+        :param sinks: callables sink(markers, timestamps), see BrainflowSink, WebSocketLogSink, FileSink
+        :param pull_timeout: maximum time (s) pull_chunk waits for markers, also the stop latency
+        :param max_batch: maximum number of markers forwarded in one batch
+        :param correction_interval: seconds between refreshes of the LSL clock offset to the sender
+        :param on_lost: called when reading from the inlet fails, e.g. StreamConnection.mark_lost
+        """
+        super().__init__(name="LSLMarkerBridge", daemon=True)
+        self.inlet = inlet
+        self.sinks = list(sinks) if sinks is not None else []
+        self.pull_timeout = pull_timeout
+        self.max_batch = max_batch
+        self.correction_interval = correction_interval
+        self.on_lost = on_lost
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+        self._time_correction = 0.0
+        self._next_correction = 0.0
+        self._forwarded = 0
+        self._batches = 0
+        self._sink_errors = 0
+        self._last_latency = None
+        self._max_latency = 0.0
+        self._latency_sum = 0.0
+
+    def set_inlet(self, inlet: StreamInlet):
+        """swap the inlet (after a reconnect), None pauses the bridge"""
+        with self._lock:
+            self.inlet = inlet
+            self._next_correction = 0.0
+            self._time_correction = 0.0
+
+    def add_sink(self, sink):
+        with self._lock:
+            self.sinks.append(sink)
+
+    def stop(self, timeout: float = 2.0):
+        """ask the thread to stop and wait for it, pending markers in the inlet are still forwarded"""
+        self._stop_event.set()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join(timeout)
+
+    def stats(self) -> dict:
+        """
+        counters of the bridge:
+        - queue_depth: markers waiting in the LSL inlet buffer
+        - forwarded / batches / sink_errors: totals since start
+        - latency_last / latency_max / latency_mean: seconds between the marker's LSL timestamp (in our
+          clock) and the moment all sinks handled it
+        """
+        try:
+            queue_depth = self.inlet.samples_available() if self.inlet is not None else None
+        except Exception:
+            queue_depth = None
+        with self._lock:
+            return {
+                "queue_depth": queue_depth,
+                "forwarded": self._forwarded,
+                "batches": self._batches,
+                "sink_errors": self._sink_errors,
+                "latency_last": self._last_latency,
+                "latency_max": self._max_latency,
+                "latency_mean": self._latency_sum / self._batches if self._batches else None,
+            }
+
+    def _update_time_correction(self, inlet):
+        now = time.monotonic()
+        if now < self._next_correction:
+            return
+        self._next_correction = now + self.correction_interval
+        try:
+            self._time_correction = inlet.time_correction(timeout=0.5)
+        except Exception as e:
+            logging.debug("LSL time correction not available: {}".format(e))
+
+    def _forward(self, markers, timestamps):
+        timestamps = [t + self._time_correction for t in timestamps]
+        with self._lock:
+            sinks = list(self.sinks)
+        errors = 0
+        for sink in sinks:
+            try:
+                sink(markers, timestamps)
+            except Exception as e:
+                errors += 1
+                logging.warning("LSL marker sink {} failed: {}".format(sink, e))
+        latency = local_clock() - timestamps[0]
+        with self._lock:
+            self._forwarded += len(markers)
+            self._batches += 1
+            self._sink_errors += errors
+            self._last_latency = latency
+            self._max_latency = max(self._max_latency, latency)
+            self._latency_sum += latency
+
+    def run(self):
+        logging.info("LSL marker bridge started")
+        while True:
+            stopping = self._stop_event.is_set()
+            inlet = self.inlet
+            if inlet is None:
+                # waiting for a (re)connect
+                if stopping:
+                    break
+                self._stop_event.wait(self.pull_timeout)
+                continue
+            self._update_time_correction(inlet)
+            try:
+                # after stop() drain without waiting
+                samples, timestamps = inlet.pull_chunk(timeout=0.0 if stopping else self.pull_timeout,
+                                                       max_samples=self.max_batch)
+            except Exception as e:
+                logging.error("LSL marker bridge lost its inlet: {}".format(e))
+                with self._lock:
+                    if self.inlet is inlet:
+                        self.inlet = None
+                if self.on_lost is not None:
+                    self.on_lost()
+                continue
+            if samples:
+                # marker streams have a single channel
+                self._forward([s[0] for s in samples], timestamps)
+            elif stopping:
+                break
+        logging.info("LSL marker bridge stopped")
+
+
+class BrainflowSink:
+    """inserts every marker in the BrainFlow stream of an EEG (or GSR) board"""
+
+    def __init__(self, board, convert=None):
+        """
+        :param board: object with an insert_marker(float) method, e.g. EEG.brainflow_get_data.EEG
+        :param convert: marker -> float (or None to drop it), e.g. LSL.MarkerRegistry.MarkerRegistry.encode,
+            defaults to the numeric value rounded to 0.1
+        """
+        self.board = board
+        self.convert = convert if convert is not None else (lambda marker: round(float(marker), 1))
+
+    def __call__(self, markers, timestamps):
+        for marker in markers:
+            code = self.convert(marker)
+            if code is not None:
+                self.board.insert_marker(code)
+
+
+class WebSocketLogSink:
+    """adds the markers to the websocket session log, next to the Unity messages"""
+
+    def __init__(self, writer, client: str = "lsl"):
+        """
+        :param writer: the session's websocket.SessionLogWriter.SessionLogWriter
+        :param client: value of the client column for these records
+        """
+        self.writer = writer
+        self.client = client
+
+    def __call__(self, markers, timestamps):
+        stamp = stamp_now()
+        for marker, timestamp in zip(markers, timestamps):
+            message = json.dumps({"websocketMessage": "lslMarker", "marker": marker, "lsl_timestamp": timestamp})
+            self.writer.write(message, stamp, self.client)
+
+
+class FileSink:
+    """appends "<lsl timestamp>\t<marker>" lines to a file, one write per batch"""
+
+    def __init__(self, file):
+        self.file = file
+        self._f = open(file, 'a+', encoding='utf-8')
+
+    def __call__(self, markers, timestamps):
+        self._f.write("".join("{:.6f}\t{}\n".format(t, m) for m, t in zip(markers, timestamps)))
+        self._f.flush()
+
+    def close(self):
+        self._f.close()
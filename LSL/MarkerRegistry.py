@@ -0,0 +1,128 @@
+"""
+two-way mapping between marker names (as sent by Unity over LSL) and the float codes BrainFlow stores in
+its marker channel. BrainFlow uses 0.0 for "no marker", so 0 can never be a code.
+
+configured in conf.yaml:
+    MARKERS:
+      UNKNOWN: "assign"     # what to do with names that aren't listed: assign / skip / error
+      FIRST_FREE_CODE: 100  # first code handed out to unknown names with UNKNOWN: "assign"
+      CODES:
+        game_start: 1
+        ...
+"""
+import logging
+import threading
+
+DEFAULT_CODES = {'game_start': 1, 'ball_release': 2, 'ball_good_hit': 3, 'ball_bad_hit': 4, 'score': 5, 'test': 6,
+                 'end_game': 7}
+UNKNOWN_POLICIES = ("assign", "skip", "error")
+
+
+class MarkerRegistry:
+    def __init__(self, codes: dict = None, unknown: str = "assign", first_free_code: float = 100.0):
+        """
+        :param codes: marker name -> code, codes must be unique and non-zero
+        :param unknown: policy for names that aren't registered:
+            "assign" gives them the next free code (and logs it), "skip" drops them, "error" raises KeyError
+        :param first_free_code: first code used by the "assign" policy
+        """
+        if unknown not in UNKNOWN_POLICIES:
+            raise ValueError("unknown marker policy {}, use one of {}".format(unknown, UNKNOWN_POLICIES))
+        self.unknown = unknown
+        self._lock = threading.Lock()
+        self._name_to_code = {}
+        self._folded_to_code = {}
+        self._code_to_name = {}
+        self._assigned = {}
+        self._next_code = float(first_free_code)
+        for name, code in (codes if codes is not None else DEFAULT_CODES).items():
+            self.register(name, code)
+
+    @classmethod
+    def from_config(cls, config: dict):
+        """build the registry from the DATA_CAPTURE/MARKERS section of conf.yaml, defaults if it's missing"""
+        config = config or {}
+        markers = config.get("DATA_CAPTURE", config).get("MARKERS") or {}
+        return cls(codes=markers.get("CODES"), unknown=markers.get("UNKNOWN", "assign"),
+                   first_free_code=markers.get("FIRST_FREE_CODE", 100.0))
+
+    def register(self, name: str, code: float) -> float:
+        """add a name, raises ValueError on a 0 code or when the name or code is already taken"""
+        with self._lock:
+            return self._add(name, code)
+
+    def _add(self, name: str, code: float) -> float:
+        # caller holds self._lock
+        code = float(code)
+        if code == 0.0:
+            raise ValueError("marker {}: 0 is reserved by BrainFlow for 'no marker'".format(name))
+        if code in self._code_to_name and self._code_to_name[code] != name:
+            raise ValueError("marker code {} of {} is already used by {}".format(
+                code, name, self._code_to_name[code]))
+        if name in self._name_to_code and self._name_to_code[name] != code:
+            raise ValueError("marker {} is already registered with code {}".format(
+                name, self._name_to_code[name]))
+        folded = name.casefold()
+        if folded in self._folded_to_code and self._folded_to_code[folded] != code:
+            raise ValueError("marker {} only differs in case from an already registered marker".format(name))
+        self._name_to_code[name] = code
+        self._folded_to_code[folded] = code
+        self._code_to_name[code] = name
+        if code >= self._next_code:
+            self._next_code = code + 1.0
+        return code
+
+    def encode(self, marker):
+        """
+        marker as sent over LSL -> float for BoardShim.insert_marker
+        :param marker: a marker name, or a number (float stream, or a numeric string)
+        :return: the code, None if the marker is dropped (0, or unknown with the "skip" policy)
+        """
+        if isinstance(marker, str):
+            code = self._name_to_code.get(marker)
+            if code is not None:
+                return code
+            code = self._folded_to_code.get(marker.casefold())
+            if code is not None:
+                return code
+            try:
+                value = float(marker)
+            except ValueError:
+                return self._unknown(marker)
+        else:
+            value = float(marker)
+        # numeric markers go straight to BrainFlow, 0 would be read back as "no marker"
+        value = round(value, 1)
+        return value if value != 0.0 else None
+
+    def decode(self, code: float):
+        """code from the BrainFlow marker channel -> marker name, None if unknown"""
+        return self._code_to_name.get(float(code))
+
+    def assigned(self) -> dict:
+        """codes handed out at runtime to unknown names, store these with the session"""
+        with self._lock:
+            return dict(self._assigned)
+
+    def mapping(self) -> dict:
+        """all names and their codes"""
+        with self._lock:
+            return dict(self._name_to_code)
+
+    def _unknown(self, name: str):
+        if self.unknown == "skip":
+            return None
+        if self.unknown == "error":
+            raise KeyError("unknown marker {}".format(name))
+        with self._lock:
+            # another thread may have assigned it in the meantime
+            code = self._name_to_code.get(name)
+            if code is not None:
+                return code
+            code = self._next_code
+            while code in self._code_to_name:
+                code += 1.0
+            self._add(name, code)
+            self._assigned[name] = code
+        logging.info("new marker {} got code {}".format(name, code))
+        return code
@@ -0,0 +1,188 @@
+"""
+LSL stream discovery that never hangs: every lookup has a timeout, resolved streams are cached by
+source_id so reconnecting to a known stream skips the broadcast for 'type', and StreamConnection keeps
+an inlet attached in the background, re-resolving it when the outlet restarts.
+"""
+import asyncio
+import logging
+import threading
+import time
+
+from pylsl import StreamInlet, resolve_byprop
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def cached(source_id: str):
+    """the last StreamInfo resolved for a source_id, None if we haven't seen it"""
+    with _cache_lock:
+        return _cache.get(source_id)
+
+
+def forget(source_id: str):
+    with _cache_lock:
+        _cache.pop(source_id, None)
+
+
+def resolve(prop: str = 'type', value: str = 'Markers', source_id: str = None, timeout: float = 5.0):
+    """
+    look up one LSL stream, with a timeout
+    :param prop: stream property to match (type, name, source_id, ...)
+    :param value: value of that property
+    :param source_id: preferred stream when several match, and the key for the cache
+    :param timeout: maximum time (s) to wait for the stream
+    :return: StreamInfo or None when nothing was found in time
+    """
+    if source_id is not None:
+        info = cached(source_id)
+        if info is not None:
+            return info
+        # the source_id is a narrower query than e.g. type=Markers
+        streams = resolve_byprop('source_id', source_id, minimum=1, timeout=timeout)
+        streams = [s for s in streams if s.source_id() == source_id]
+    else:
+        streams = resolve_byprop(prop, value, minimum=1, timeout=timeout)
+        streams = [s for s in streams if prop != 'source_id' or s.source_id() == value]
+    if not streams:
+        return None
+    if len(streams) > 1:
+        logging.warning("{} LSL streams match {}={}, using the most recent one".format(len(streams), prop, value))
+    info = max(streams, key=lambda s: s.created_at())
+    if info.source_id():
+        with _cache_lock:
+            _cache[info.source_id()] = info
+    return info
+
+
+async def resolve_async(prop: str = 'type', value: str = 'Markers', source_id: str = None,
+                        timeout: float = 5.0):
+    """resolve() without blocking the event loop"""
+    return await asyncio.to_thread(resolve, prop, value, source_id, timeout)
+
+
+class StreamConnection:
+    """
+    keeps an inlet attached to an LSL stream
+
+    a background thread probes the outlet every check_interval seconds with a clock round trip (marker
+    streams can be silent for minutes, so "no data" says nothing). When the probe fails the inlet is
+    dropped and the stream is resolved again, through the cache by source_id first (the cached entry is only
+    forgotten when the inlet opened from it doesn't answer), and on_attach is called with the new inlet.
+    """
+
+    def __init__(self, prop: str = 'type', value: str = 'Markers', source_id: str = None, timeout: float = 5.0,
+                 check_interval: float = 2.0, on_attach=None):
+        """
+        :param prop: stream property to look for
+        :param value: value of that property
+        :param source_id: stick to this stream, also after a restart of the outlet
+        :param timeout: timeout (s) of a single resolve / probe
+        :param check_interval: seconds between liveness probes
+        :param on_attach: callable(inlet) called whenever a (new) inlet is attached, inlet is None when lost.
+            It's called with the connection's lock held, so it must not call back into the connection
+        """
+        self.prop = prop
+        self.value = value
+        self.source_id = source_id
+        self.timeout = timeout
+        self.check_interval = check_interval
+        self.on_attach = on_attach
+        self.info = None
+        self.inlet = None
+        self._last_alive = None
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def connect(self, timeout: float = None) -> bool:
+        """try to attach once, returns False when the stream wasn't found within the timeout"""
+        timeout = self.timeout if timeout is None else timeout
+        from_cache = self.source_id is not None and cached(self.source_id) is not None
+        info = resolve(self.prop, self.value, self.source_id, timeout)
+        if info is None:
+            return False
+        # recover=False: a dead outlet raises instead of silently waiting, the watchdog re-resolves
+        inlet = StreamInlet(info, recover=False)
+        if from_cache and not self._probe(inlet):
+            # the outlet restarted elsewhere (new address), look it up on the network again
+            forget(self.source_id)
+            info = resolve(self.prop, self.value, self.source_id, timeout)
+            if info is None:
+                return False
+            inlet = StreamInlet(info, recover=False)
+        with self._lock:
+            self.info = info
+            self.inlet = inlet
+            self.source_id = self.source_id or info.source_id() or None
+            self._last_alive = time.monotonic()
+            self._notify(inlet)
+        logging.info("LSL stream {} ({}) attached".format(info.name(), info.source_id()))
+        return True
+
+    def replay(self):
+        """call on_attach with the current inlet, e.g. for a reader created after the first attach"""
+        with self._lock:
+            self._notify(self.inlet)
+
+    def start(self):
+        """start the background watchdog, also attaches the stream if connect() didn't find it"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._watch, name="LSLStreamWatchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(self.timeout + self.check_interval)
+            self._thread = None
+
+    def is_alive(self) -> bool:
+        """True when an inlet is attached and the outlet answered a recent probe"""
+        with self._lock:
+            if self.inlet is None or self._last_alive is None:
+                return False
+            return time.monotonic() - self._last_alive < 2 * self.check_interval + self.timeout
+
+    def mark_lost(self):
+        """drop the inlet, e.g. when a reader got an error from it, the watchdog will re-attach"""
+        with self._lock:
+            if self.inlet is None:
+                return
+            self.inlet = None
+            self._last_alive = None
+            self._notify(None)
+        logging.warning("LSL stream {}={} lost, re-resolving".format(self.prop, self.value))
+
+    def _notify(self, inlet):
+        if self.on_attach is not None:
+            try:
+                self.on_attach(inlet)
+            except Exception as e:
+                logging.warning("LSL on_attach callback failed: {}".format(e))
+
+    def _probe(self, inlet) -> bool:
+        try:
+            inlet.time_correction(timeout=self.timeout)
+            return True
+        except Exception:
+            return False
+
+    def _watch(self):
+        while not self._stop_event.is_set():
+            with self._lock:
+                inlet = self.inlet
+            if inlet is None:
+                try:
+                    self.connect()
+                except Exception as e:
+                    logging.warning("LSL resolve failed: {}".format(e))
+            elif self._probe(inlet):
+                with self._lock:
+                    self._last_alive = time.monotonic()
+            else:
+                self.mark_lost()
+                continue
+            self._stop_event.wait(self.check_interval)
@@ -10,11 +10,9 @@ In this file, we'll:
 
 We'll try to make an executable of this project using PyInstaller
 """
-import asyncio
 import logging
-import os
+import multiprocessing
 import sys
-import threading
 from datetime import datetime
 from tkinter import Tk, simpledialog
 
@@ -23,9 +21,10 @@ from tkinter import Tk, simpledialog
 # from eeg.brainflow_get_data import EEG
 # from lsl.LSL_ReceiveData import LSLReceptor
 from Player.PlayerSession import PlayerSession
+from utils.dashboard import connect as connect_dashboard
 from utils.GUI_improved import ImprovedGUI
+from utils.orchestrator import Orchestrator
 from utils.utils import *
-from websocket.WebSocketServer import start_ws_server
 import atexit
 
 # eeg = False
@@ -38,6 +37,9 @@ ws = True
 
 
 if __name__ == '__main__':
+    # board workers are processes, the frozen executable needs this before anything else
+    multiprocessing.freeze_support()
+
     # Configure logging first
     logging.basicConfig(
         level=logging.INFO,
@@ -140,33 +142,64 @@ if __name__ == '__main__':
     logging.info(f"   Listening on {config['DATA_CAPTURE']['WS']['IP']}:{config['DATA_CAPTURE']['WS']['PORT']}")
     logging.info("   Waiting for Unity to connect...")
 
-    # Run WebSocket server in a separate thread so GUI stays responsive
-    def run_websocket_server():
-        """Run the websocket server in its own event loop"""
-        try:
-            asyncio.run(start_ws_server(params=websocket_data,
-                                        output_file=os.path.join(root_data_path, "websocket", "websocket.csv"),
-                                        ip=config["DATA_CAPTURE"]["WS"]["IP"],
-                                        port=config["DATA_CAPTURE"]["WS"]["PORT"]))
-        except asyncio.CancelledError:
-            logging.warning("⚠ WebSocket server cancelled")
-        except KeyboardInterrupt:
-            logging.info("⚠ Stopped by user (Ctrl+C)")
-        except Exception as e:
-            logging.error(f"❌ Error: {e}")
-    
-    # Start WebSocket server in background thread
-    ws_thread = threading.Thread(target=run_websocket_server, daemon=True)
-    ws_thread.start()
+    # Every enabled modality (conf.yaml DATA_CAPTURE.MODALITIES) runs in its own worker, so the GUI stays
+    # responsive and a failing device doesn't take the others down. Starting and stopping them can take
+    # seconds (LSL stream lookup, boards that don't stop), so that happens off the Tk thread
+    dashboard = gui.add_dashboard()
+    session = {"orchestrator": None, "starting": True, "closing": False}
+
+    def start_orchestrator():
+        orchestrator = Orchestrator(config, root_data_path, ws_params=websocket_data)
+        orchestrator.start()
+        return orchestrator
+
+    def on_started(orchestrator, error):
+        """runs on the Tk thread once the workers are started"""
+        session["starting"] = False
+        if error is not None:
+            logging.error(f"❌ Could not start the session: {error}")
+            gui.update_status("Session failed to start", color='red')
+            if session["closing"]:
+                on_stopped(None, None)
+            return
+        session["orchestrator"] = orchestrator
+        if session["closing"]:
+            # the window was closed while starting
+            gui.run_in_background(orchestrator.stop, on_stopped)
+            return
+        gui.update_status("Session running")
+        # live traces of the buffers and the Unity message rate
+        connect_dashboard(dashboard, orchestrator)
+        dashboard.start()
+        # dropped / spilled session log messages in the status bar
+        gui.watch_log_queues(orchestrator.log_writers)
+
+    def on_stopped(result, error):
+        """runs on the Tk thread once every worker stopped"""
+        if error is not None:
+            logging.error(f"❌ Stopping the session failed: {error}")
+        logging.info("✓ Session completed")
+        logging.info("═══════════════════════════════════════════")
+        gui.destroy()
+
+    gui.update_status("Starting the session...")
+    gui.run_in_background(start_orchestrator, on_started)
     
     # Add protocol handler for window close
     def on_closing():
         """Handle window close event"""
+        if session["closing"]:
+            return
+        session["closing"] = True
         logging.info("─────────────────────────────────────────────")
         logging.info("⚠ Window closing...")
-        logging.info("✓ Session completed")
-        logging.info("═══════════════════════════════════════════")
-        gui.destroy()
+        gui.update_status("Stopping the session...", color='orange')
+        dashboard.stop()
+        if session["orchestrator"] is not None:
+            gui.run_in_background(session["orchestrator"].stop, on_stopped)
+        elif not session["starting"]:
+            on_stopped(None, None)
+        # else on_started() stops the workers as soon as they are started
     
     gui.protocol("WM_DELETE_WINDOW", on_closing)
     
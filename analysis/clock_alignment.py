@@ -0,0 +1,305 @@
+"""
+putting EEG, EmotiBit and Unity on one clock
+
+every stream has its own clock: the BrainFlow timestamp row (host clock of the EEG / EmotiBit board
+session), EmotiBit package numbers (device sample counter), Unity "_time" (seconds since scene load) and
+the websocket server receive time. Two clocks are related by t_reference = slope * t_local + offset, the
+slope is the drift (a few ppm for crystals, but 30 min at 50 ppm is already 90 ms).
+
+    1. get the same events seen by two clocks: marker codes (insert_marker / LSL markers, see
+       match_markers), sync pulse edges in an EEG channel (pulse_edges) or the Unity time / receive time
+       of every websocket message (unity_pairs, per Unity run: "_time" restarts at a reconnect or scene load)
+    2. fit_clock(): robust line through those pairs, Theil-Sen start, then least squares on the inliers,
+       so missed markers, double presses and network delay spikes don't bend the fit
+    3. align(): map every stream onto the reference clock and interpolate all of them onto one regular grid
+
+everything is numpy on whole arrays, the per-code loop in match_markers is the only python loop.
+"""
+import logging
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+
+from analysis.session_analytics import RUN, unity_runs
+
+MAX_PAIRS = 200_000
+
+
+class ClockFit(NamedTuple):
+    """t_reference = slope * t_local + offset"""
+    slope: float
+    offset: float
+    residual_std: float  # seconds, of the inliers
+    inliers: int
+    pairs: int
+
+    @property
+    def drift_ppm(self) -> float:
+        return (self.slope - 1.0) * 1e6
+
+    def to_reference(self, t):
+        return self.slope * np.asarray(t, dtype=np.float64) + self.offset
+
+    def to_local(self, t):
+        return (np.asarray(t, dtype=np.float64) - self.offset) / self.slope
+
+    def then(self, other: "ClockFit") -> "ClockFit":
+        """chain two fits: local -(self)-> middle -(other)-> reference"""
+        return ClockFit(other.slope * self.slope, other.slope * self.offset + other.offset,
+                        float(np.hypot(other.slope * self.residual_std, other.residual_std)),
+                        min(self.inliers, other.inliers), min(self.pairs, other.pairs))
+
+
+IDENTITY = ClockFit(1.0, 0.0, 0.0, 0, 0)
+
+
+def _theil_sen(x: np.ndarray, y: np.ndarray, rng: np.random.Generator):
+    n = len(x)
+    if n * (n - 1) // 2 <= MAX_PAIRS:
+        i, j = np.triu_indices(n, k=1)
+    else:
+        # too many points for all pairs, a random sample of pairs gives the same median
+        i = rng.integers(0, n, MAX_PAIRS)
+        j = rng.integers(0, n, MAX_PAIRS)
+    dx = x[j] - x[i]
+    keep = dx != 0
+    slope = float(np.median((y[j] - y[i])[keep] / dx[keep]))
+    return slope, float(np.median(y - slope * x))
+
+
+def fit_clock(local, reference, threshold: float = None, iterations: int = 3, seed: int = 0) -> ClockFit:
+    """
+    robust offset and drift between two clocks from pairs of times of the same events
+    :param local: event times on the clock that has to be mapped
+    :param reference: times of the same events on the reference clock
+    :param threshold: residual (s) above which a pair is an outlier, defaults to 4 x the robust std (MAD)
+        of the residuals with a floor of 1 ms
+    :param iterations: least squares refits on the inliers
+    :return: ClockFit, with a single pair only the offset is estimated (slope 1)
+    """
+    x = np.asarray(local, dtype=np.float64)
+    y = np.asarray(reference, dtype=np.float64)
+    valid = np.isfinite(x) & np.isfinite(y)
+    x, y = x[valid], y[valid]
+    if len(x) == 0:
+        raise ValueError("no pairs to fit a clock on")
+    if len(x) == 1 or np.ptp(x) == 0:
+        offset = float(np.median(y - x))
+        return ClockFit(1.0, offset, float(np.std(y - x - offset)), len(x), len(x))
+
+    # center x: unix timestamps squared lose all precision
+    x0 = float(np.median(x))
+    xc = x - x0
+    slope, intercept = _theil_sen(xc, y, np.random.default_rng(seed))
+    inliers = np.ones(len(x), dtype=bool)
+    for _ in range(iterations):
+        residuals = y - (slope * xc + intercept)
+        limit = threshold
+        if limit is None:
+            mad = np.median(np.abs(residuals - np.median(residuals)))
+            limit = max(4 * 1.4826 * mad, 1e-3)
+        inliers = np.abs(residuals) <= limit
+        if inliers.sum() < 2:
+            break
+        slope, intercept = np.polyfit(xc[inliers], y[inliers], 1)
+    residuals = y - (slope * xc + intercept)
+    std = float(np.std(residuals[inliers])) if inliers.any() else float("nan")
+    return ClockFit(float(slope), float(intercept - slope * x0), std, int(inliers.sum()), len(x))
+
+
+def match_markers(local_times, local_codes, reference_times, reference_codes, tolerance: float = 0.5,
+                  offset: float = None):
+    """
+    pair occurrences of the same marker code in two streams
+    :param local_times, local_codes: markers on the local clock, e.g. the BrainFlow marker row
+    :param reference_times, reference_codes: markers on the reference clock, e.g. LSL markers
+    :param tolerance: maximum distance (s) between a pair after removing the offset
+    :param offset: rough reference - local offset, estimated from the codes when None
+    :return: (local, reference) arrays of paired times, ready for fit_clock()
+    """
+    lt, lc = np.asarray(local_times, dtype=np.float64), np.asarray(local_codes)
+    rt, rc = np.asarray(reference_times, dtype=np.float64), np.asarray(reference_codes)
+    codes = np.intersect1d(lc, rc)
+    if offset is None:
+        # median over codes of the first occurrence difference, good enough to pair within tolerance
+        firsts = [rt[rc == code].min() - lt[lc == code].min() for code in codes]
+        if not firsts:
+            return np.empty(0), np.empty(0)
+        offset = float(np.median(firsts))
+    local, reference = [], []
+    for code in codes:
+        a = np.sort(lt[lc == code])
+        b = np.sort(rt[rc == code])
+        shifted = a + offset
+        # nearest reference marker of the same code for every local marker
+        i = np.clip(np.searchsorted(b, shifted), 1, len(b) - 1) if len(b) > 1 else np.zeros(len(a), dtype=int)
+        if len(b) > 1:
+            i = np.where(np.abs(b[i - 1] - shifted) <= np.abs(b[i] - shifted), i - 1, i)
+        distance = np.abs(b[i] - shifted)
+        # one reference marker can only be paired once, keep the closest local one
+        closest = np.flatnonzero(distance <= tolerance)
+        closest = closest[np.argsort(distance[closest], kind="stable")]
+        _, first = np.unique(i[closest], return_index=True)
+        chosen = np.sort(closest[first])
+        local.append(a[chosen])
+        reference.append(b[i[chosen]])
+    if not local:
+        return np.empty(0), np.empty(0)
+    return np.concatenate(local), np.concatenate(reference)
+
+
+def marker_events(data: np.ndarray, timestamp_row: int, marker_row: int):
+    """
+    (times, codes) of the non-zero entries of a BrainFlow marker row
+    :param data: (samples x rows) as from analysis.session_reader.Recording.data
+    """
+    markers = np.asarray(data[:, marker_row])
+    hits = np.flatnonzero(markers)
+    return np.asarray(data[hits, timestamp_row]), markers[hits]
+
+
+def pulse_edges(signal, times, threshold: float = None, min_interval: float = 0.0, falling: bool = False):
+    """
+    times of the edges of a sync pulse (EEG/sync_signal.py) recorded in a channel
+    :param signal: the channel with the pulse, e.g. a Cyton analog input
+    :param times: timestamp of every sample
+    :param threshold: level of an edge, defaults to halfway between the 1st and 99th percentile
+    :param min_interval: ignore edges closer than this (s) to the previous one (contact bounce)
+    :param falling: detect falling instead of rising edges
+    :return: edge times, linearly interpolated between the two samples around the crossing
+    """
+    signal = np.asarray(signal, dtype=np.float64)
+    times = np.asarray(times, dtype=np.float64)
+    if threshold is None:
+        low, high = np.nanpercentile(signal, [1, 99])
+        threshold = (low + high) / 2
+    above = signal >= threshold
+    edges = np.flatnonzero(above[1:] & ~above[:-1]) if not falling else np.flatnonzero(~above[1:] & above[:-1])
+    before, after = signal[edges], signal[edges + 1]
+    fraction = np.clip((threshold - before) / np.where(after != before, after - before, 1.0), 0.0, 1.0)
+    edge_times = times[edges] + fraction * (times[edges + 1] - times[edges])
+    if min_interval > 0 and len(edge_times) > 1:
+        keep = np.concatenate(([True], np.diff(edge_times) >= min_interval))
+        edge_times = edge_times[keep]
+    return edge_times
+
+
+def unity_pairs(events: pd.DataFrame, run: int = None):
+    """
+    (unity_time, receive time in unix seconds) of every websocket message of one Unity run that has both,
+    for a Unity -> server clock fit. Network delay only makes messages late, so the fit runs slightly late
+    by the typical delay (a few ms on a local network).
+    :param events: one session from websocket.SessionFormat.read_session
+    :param run: run number as in analysis.session_analytics.unity_runs, defaults to the last run with pairs.
+        "_time" restarts with every run, so a fit over several runs is meaningless, see unity_fits()
+    """
+    runs = events[RUN] if RUN in events.columns else unity_runs(events)
+    both = events["unity_time"].notna() & events["recv_wall_ns"].notna()
+    if run is None:
+        run = runs[both].max() if both.any() else None
+    both &= runs == run
+    return (events.loc[both, "unity_time"].to_numpy(dtype=np.float64),
+            events.loc[both, "recv_wall_ns"].to_numpy(dtype=np.float64) / 1e9)
+
+
+def unity_fits(events: pd.DataFrame, **kwargs) -> dict:
+    """
+    Unity -> server clock of every Unity run of a session, see unity_pairs()
+    :param kwargs: passed on to fit_clock()
+    :return: run number -> ClockFit
+    """
+    runs = unity_runs(events)
+    both = events["unity_time"].notna() & events["recv_wall_ns"].notna()
+    return {int(run): fit_clock(*unity_pairs(events.assign(**{RUN: runs}), run), **kwargs)
+            for run in pd.unique(runs[both])}
+
+
+def sample_clock(counter, times, rate: float, wrap: int = None) -> ClockFit:
+    """
+    clock of a device that numbers its samples (EmotiBit package numbers, the Cyton sample counter):
+    fit host timestamp against sample number / rate, which removes the jitter of the host timestamps
+    :param counter: package / sample number row
+    :param times: host timestamps of the same samples (BrainFlow timestamp row)
+    :param rate: nominal sampling rate
+    :param wrap: counter range when it wraps around (e.g. 256 for the Cyton), None if it doesn't
+    """
+    counter = np.asarray(counter, dtype=np.float64)
+    if wrap is not None:
+        steps = np.diff(counter)
+        counter = counter[0] + np.concatenate(([0.0], np.cumsum(np.where(steps < 0, steps + wrap, steps))))
+    return fit_clock(counter / rate, times)
+
+
+def resample(times, values, grid, method: str = "linear") -> np.ndarray:
+    """
+    interpolate (samples x channels) values onto a time grid, all channels at once
+    :param times: increasing sample times (already on the grid's clock)
+    :param values: (samples,) or (samples x channels)
+    :param grid: times to interpolate at
+    :param method: "linear", or "previous" for state-like data (markers, trial numbers)
+    :return: (len(grid) x channels), NaN outside the recorded range
+    """
+    times = np.asarray(times, dtype=np.float64)
+    grid = np.asarray(grid, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    flat = values.ndim == 1
+    if flat:
+        values = values[:, None]
+    out = np.full((len(grid), values.shape[1]), np.nan)
+    if len(times) == 0:
+        return out[:, 0] if flat else out
+    inside = (grid >= times[0]) & (grid <= times[-1])
+    g = grid[inside]
+    right = np.clip(np.searchsorted(times, g, side="right"), 1, len(times) - 1) if len(times) > 1 \
+        else np.zeros(len(g), dtype=int)
+    if method == "previous" or len(times) == 1:
+        left = np.searchsorted(times, g, side="right") - 1
+        out[inside] = values[np.clip(left, 0, len(times) - 1)]
+    elif method == "linear":
+        left = right - 1
+        span = times[right] - times[left]
+        w = np.where(span > 0, (g - times[left]) / np.where(span > 0, span, 1.0), 0.0)[:, None]
+        out[inside] = values[left] * (1.0 - w) + values[right] * w
+    else:
+        raise ValueError("unknown method {}, use linear or previous".format(method))
+    return out[:, 0] if flat else out
+
+
+def align(streams: dict, rate: float, start: float = None, end: float = None) -> pd.DataFrame:
+    """
+    resample several streams onto one regular timeline on the reference clock
+    :param streams: name -> dict(times=..., values=(samples x channels), columns=[...],
+        fit=ClockFit (default: already on the reference clock), method="linear"|"previous")
+    :param rate: samples per second of the common timeline
+    :param start, end: range of the timeline, defaults to the overlap of all streams
+    :return: DataFrame with a "time" column and "<name>.<column>" for every channel
+    """
+    mapped = {}
+    for name, stream in streams.items():
+        fit = stream.get("fit") or IDENTITY
+        times = fit.to_reference(stream["times"])
+        order = np.argsort(times, kind="stable")
+        mapped[name] = (times[order], np.asarray(stream["values"])[order])
+    firsts = [t[0] for t, _ in mapped.values() if len(t)]
+    lasts = [t[-1] for t, _ in mapped.values() if len(t)]
+    # streams without samples don't limit the range
+    if start is None and firsts:
+        start = max(firsts)
+    if end is None and lasts:
+        end = min(lasts)
+    if start is None or end is None or end <= start:
+        logging.warning("streams don't overlap, the timeline is empty")
+        grid = np.empty(0)
+    else:
+        grid = start + np.arange(int(np.floor((end - start) * rate)) + 1) / rate
+    columns = {"time": grid}
+    for name, (times, values) in mapped.items():
+        stream = streams[name]
+        data = resample(times, values, grid, stream.get("method", "linear"))
+        if data.ndim == 1:
+            data = data[:, None]
+        names = stream.get("columns") or [str(i) for i in range(data.shape[1])]
+        for i, column in enumerate(names):
+            columns["{}.{}".format(name, column)] = data[:, i]
+    return pd.DataFrame(columns)
@@ -0,0 +1,205 @@
+"""
+gaze episodes and ball scores from websocket session logs
+
+everything works on the tables produced by websocket.SessionFormat.read_session() (one row per Unity
+message), optionally concatenated over many sessions with a "session" column. All steps are pandas /
+numpy column operations, there are no per-row python loops, so thousands of sessions can go through
+in one call.
+
+Unity restarts "_time" and trialNumber when it reconnects or loads a scene, so every session is split
+into runs at those points (see unity_runs()) and trials, episodes and scores are kept per (session, run).
+
+Unity sends
+    gaze:            {"trialNumber", "targetName", "gazeStart": true/false, "_time"}
+    PlayerBallScore: {"trialNumber", "player", "realPlayer", "hit", "_time"}
+"""
+import logging
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from websocket.SessionFormat import CONNECT, read_session
+
+SESSION = "session"
+RUN = "run"
+SCENE_SWITCH = "switch scene to"
+GAZE = "gaze"
+BALL_SCORE = "PlayerBallScore"
+MISSING_START = "missing_start"
+MISSING_STOP = "missing_stop"
+
+
+def load_sessions(files, session_names=None) -> pd.DataFrame:
+    """
+    read many NDJSON session logs into one table with a "session" column
+    :param files: paths to websocket.jsonl files (live or converted with websocket.LegacyLogConverter)
+    :param session_names: name per file, defaults to the <playtime> folder (two levels above the log)
+    """
+    files = [Path(f) for f in files]
+    if session_names is None:
+        session_names = [f.parent.parent.name if f.parent.name != "converted" else f.parent.parent.parent.name
+                         for f in files]
+    frames = []
+    for file, name in zip(files, session_names):
+        try:
+            frames.append(read_session(file).assign(**{SESSION: name}))
+        except ValueError as e:
+            logging.warning("skipping {}: {}".format(file, e))
+    if not frames:
+        return pd.DataFrame(columns=[SESSION, "websocketMessage", "trialNumber"])
+    return pd.concat(frames, ignore_index=True)
+
+
+def _with_session(events: pd.DataFrame) -> pd.DataFrame:
+    if SESSION in events.columns:
+        return events
+    return events.assign(**{SESSION: ""})
+
+
+def unity_runs(events: pd.DataFrame) -> pd.Series:
+    """
+    number of the Unity run of every event within its session, in log order: a run ends at a connect or
+    scene switch message, or where unity_time goes back (a restart without either message)
+    """
+    events = _with_session(events)
+    restart = pd.Series(False, index=events.index)
+    if "websocketMessage" in events.columns:
+        restart |= events["websocketMessage"].isin([CONNECT, SCENE_SWITCH]).to_numpy(dtype=bool)
+    if "unity_time" in events.columns:
+        times = events["unity_time"]
+        previous = times.groupby(events[SESSION], sort=False).ffill().groupby(events[SESSION], sort=False).shift()
+        restart |= (times < previous).to_numpy(dtype=bool)
+    return restart.groupby(events[SESSION], sort=False).cumsum().rename(RUN)
+
+
+def _with_runs(events: pd.DataFrame) -> pd.DataFrame:
+    events = _with_session(events)
+    if RUN in events.columns:
+        return events
+    return events.assign(**{RUN: unity_runs(events)})
+
+
+def trial_bounds(events: pd.DataFrame, time_col: str = "unity_time") -> pd.DataFrame:
+    """first and last event time of every (session, run, trial)"""
+    events = _with_runs(events)
+    in_trial = events[events["trialNumber"].notna() & events[time_col].notna()]
+    return (in_trial.groupby([SESSION, RUN, "trialNumber"], sort=False)[time_col]
+            .agg(trial_start="min", trial_end="max")
+            .reset_index())
+
+
+def gaze_episodes(events: pd.DataFrame, time_col: str = "unity_time", close_open: bool = False) -> pd.DataFrame:
+    """
+    pair gazeStart true/false events per (session, run, targetName) into episodes
+
+    events are paired in log order, unity_time restarts with every run. A start followed by a stop on the
+    same target is an episode. A start that isn't followed by a stop
+    (next event is another start, or the log ends) is kept with edge=missing_stop, a stop without a
+    preceding start with edge=missing_start.
+    :param events: session table(s), see load_sessions()
+    :param time_col: time column to use, unity_time or recv_monotonic_ns
+    :param close_open: clip unmatched edges to the first/last event of their trial instead of leaving NaN
+    :return: one row per episode: session, run, trialNumber, targetName, start, end, dwell, edge
+    """
+    events = _with_runs(events)
+    columns = [SESSION, RUN, "trialNumber", "targetName", "start", "end", "dwell", "edge"]
+    if "gazeStart" not in events.columns:
+        return pd.DataFrame(columns=columns)
+
+    gaze = events.loc[events["websocketMessage"] == GAZE, [SESSION, RUN, "trialNumber", "targetName",
+                                                           "gazeStart", time_col]]
+    gaze = gaze[gaze["gazeStart"].notna() & gaze[time_col].notna()]
+    # stable sort, so the events of a target stay in log order
+    gaze = gaze.sort_values([SESSION, RUN, "targetName"], kind="stable")
+    is_start = gaze["gazeStart"].to_numpy(dtype=bool)
+    times = gaze[time_col].to_numpy(dtype=np.float64)
+    group = gaze.groupby([SESSION, RUN, "targetName"], sort=False).ngroup().to_numpy()
+
+    same_as_next = np.zeros(len(gaze), dtype=bool)
+    same_as_next[:-1] = group[1:] == group[:-1]
+    next_is_stop = np.zeros(len(gaze), dtype=bool)
+    next_is_stop[:-1] = ~is_start[1:]
+    prev_is_start = np.zeros(len(gaze), dtype=bool)
+    prev_is_start[1:] = is_start[:-1] & (group[1:] == group[:-1])
+
+    matched = is_start & same_as_next & next_is_stop
+    open_start = is_start & ~matched
+    orphan_stop = ~is_start & ~prev_is_start
+
+    next_time = np.full(len(gaze), np.nan)
+    next_time[:-1] = times[1:]
+
+    keys = gaze[[SESSION, RUN, "trialNumber", "targetName"]]
+    pieces = [
+        keys[matched].assign(start=times[matched], end=next_time[matched], edge=None),
+        keys[open_start].assign(start=times[open_start], end=np.nan, edge=MISSING_STOP),
+        keys[orphan_stop].assign(start=np.nan, end=times[orphan_stop], edge=MISSING_START),
+    ]
+    pieces = [p for p in pieces if len(p)]
+    if not pieces:
+        return pd.DataFrame(columns=columns)
+    episodes = pd.concat(pieces, ignore_index=True)
+
+    if close_open and len(episodes):
+        bounds = trial_bounds(events, time_col)
+        episodes = episodes.merge(bounds, on=[SESSION, RUN, "trialNumber"], how="left")
+        episodes["start"] = episodes["start"].fillna(episodes["trial_start"])
+        episodes["end"] = episodes["end"].fillna(episodes["trial_end"])
+        episodes = episodes.drop(columns=["trial_start", "trial_end"])
+
+    episodes["dwell"] = episodes["end"] - episodes["start"]
+    return (episodes.sort_values([SESSION, RUN, "start", "end"], kind="stable", na_position="last")
+            .reset_index(drop=True)[columns])
+
+
+def gaze_per_trial(episodes: pd.DataFrame) -> pd.DataFrame:
+    """gaze count, dwell total/mean/max and number of unmatched edges per (session, run, trial, target)"""
+    return (episodes.assign(unmatched=episodes["edge"].notna())
+            .groupby([SESSION, RUN, "trialNumber", "targetName"], sort=True, dropna=False)
+            .agg(gaze_count=("dwell", "size"),
+                 dwell_total=("dwell", "sum"),
+                 dwell_mean=("dwell", "mean"),
+                 dwell_max=("dwell", "max"),
+                 unmatched=("unmatched", "sum"))
+            .reset_index())
+
+
+def ball_scores_per_trial(events: pd.DataFrame) -> pd.DataFrame:
+    """throws, hits and hit rate per (session, run, trial, player)"""
+    events = _with_runs(events)
+    columns = [SESSION, RUN, "trialNumber", "player", "realPlayer", "throws", "hits", "hit_rate"]
+    if "hit" not in events.columns:
+        return pd.DataFrame(columns=columns)
+    scores = events.loc[(events["websocketMessage"] == BALL_SCORE) & events["hit"].notna(),
+                        [SESSION, RUN, "trialNumber", "player", "realPlayer", "hit"]]
+    result = (scores.assign(hit=scores["hit"].astype("int64"))
+              .groupby([SESSION, RUN, "trialNumber", "player", "realPlayer"], sort=True, dropna=False)
+              .agg(throws=("hit", "size"), hits=("hit", "sum"))
+              .reset_index())
+    result["hit_rate"] = result["hits"] / result["throws"]
+    return result[columns]
+
+
+def trial_summary(events: pd.DataFrame, time_col: str = "unity_time") -> pd.DataFrame:
+    """
+    one row per (session, run, trial): gaze count and dwell per target, hit rate of the real and the virtual
+    player, e.g. columns gaze_count_caregiver, dwell_total_tegenspeler, hit_rate_real, hit_rate_virtual
+    """
+    events = _with_runs(events)
+    index = [SESSION, RUN, "trialNumber"]
+    gaze = gaze_per_trial(gaze_episodes(events, time_col))
+    gaze_wide = gaze.pivot_table(index=index, columns="targetName", values=["gaze_count", "dwell_total"],
+                                 aggfunc="sum", fill_value=0)
+    gaze_wide.columns = ["{}_{}".format(value, target) for value, target in gaze_wide.columns]
+
+    scores = ball_scores_per_trial(events)
+    scores = scores.assign(role=np.where(scores["realPlayer"].astype(bool), "real", "virtual"))
+    scores_wide = scores.pivot_table(index=index, columns="role", values=["throws", "hits"], aggfunc="sum",
+                                     fill_value=0)
+    scores_wide.columns = ["{}_{}".format(value, role) for value, role in scores_wide.columns]
+    for role in ("real", "virtual"):
+        if "throws_" + role in scores_wide.columns:
+            scores_wide["hit_rate_" + role] = scores_wide["hits_" + role] / scores_wide["throws_" + role]
+
+    return gaze_wide.join(scores_wide, how="outer").reset_index()
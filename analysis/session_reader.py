@@ -0,0 +1,256 @@
+"""
+lazy, memory-mapped access to a recorded session folder as created by addattachment.py:
+
+    data/<playtime>/eeg/eeg.bin|csv
+    data/<playtime>/gsr/gsr_eda.bin|csv, gsr_ppg.bin|csv, gsr_mov.bin|csv
+    data/<playtime>/gsr/<NAME>/gsr_eda.bin|csv, ...      per EmotiBit in DATA_CAPTURE.GSR.DEVICES
+    data/<playtime>/websocket/websocket.jsonl
+
+binary recordings (utils.recording) are memory-mapped as they are. Text recordings are converted once to a
+<name>_cache.bin/.json pair next to them, after that they open as fast as binary ones. Nothing is read
+before a modality is used, and a time range is found through a sparse timestamp index (every
+INDEX_STEP-th timestamp), so pulling a 30 s epoch out of a 2 h recording only touches that epoch.
+"""
+import json
+import logging
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from utils.recording import BIN_SUFFIX, DTYPE, META_SUFFIX, open_recording
+
+INDEX_STEP = 1024
+CACHE_SUFFIX = "_cache"
+# modality -> (folder, conf.yaml lookup, default file name)
+MODALITIES = {
+    "eeg": ("eeg", ("EEG",), "eeg.csv"),
+    "eda": ("gsr", ("GSR", "EDA"), "gsr_eda.csv"),
+    "ppg": ("gsr", ("GSR", "PPG"), "gsr_ppg.csv"),
+    "movement": ("gsr", ("GSR", "MOVEMENT"), "gsr_mov.csv"),
+}
+
+
+def _csv_to_cache(csv_file: Path, cache: Path, chunk_rows: int = 200_000):
+    """stream a BrainFlow text recording into a binary cache (same layout as utils.recording)"""
+    with open(csv_file, "r") as f:
+        header = f.readline().rstrip("\n").split("\t")
+        first = f.readline().rstrip("\n").split("\t")
+    num_rows = len(first)
+    # old recordings have hand-written headers that don't match the column count, only trust them if they do
+    names = header if len(header) == num_rows else ["col_{}".format(i) for i in range(num_rows)]
+
+    timestamps = None
+    with open(cache.with_suffix(BIN_SUFFIX), "wb") as out:
+        for chunk in pd.read_csv(csv_file, sep="\t", header=None, skiprows=1, chunksize=chunk_rows,
+                                 dtype=np.float64, usecols=range(num_rows)):
+            values = chunk.to_numpy(dtype=DTYPE)
+            out.write(np.ascontiguousarray(values).tobytes())
+            if timestamps is None:
+                timestamps = values[:min(len(values), 1000)]
+
+    channels = [{"row": i, "name": name, "type": "other"} for i, name in enumerate(names)]
+    timestamp_row = _guess_timestamp_row(names, timestamps)
+    if timestamp_row is not None:
+        channels[timestamp_row].update(name="timestamp", type="timestamp")
+    meta = {
+        "num_rows": num_rows,
+        "dtype": DTYPE.str,
+        "layout": "samples x rows",
+        "source": str(csv_file),
+        "sampling_rate": _estimate_rate(timestamps, timestamp_row),
+        "channels": channels,
+    }
+    with open(cache.with_suffix(META_SUFFIX), "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+
+
+def _guess_timestamp_row(names: list, sample: np.ndarray):
+    for i, name in enumerate(names):
+        if name.startswith("timestamp"):
+            return i
+    if sample is None or len(sample) == 0:
+        return None
+    # BrainFlow timestamps are unix seconds, take the last column that looks like one
+    medians = np.median(sample, axis=0)
+    candidates = np.flatnonzero((medians > 1e9) & (medians < 1e10))
+    return int(candidates[-1]) if len(candidates) else None
+
+
+def _estimate_rate(sample: np.ndarray, timestamp_row):
+    if sample is None or timestamp_row is None or len(sample) < 2:
+        return None
+    duration = sample[-1, timestamp_row] - sample[0, timestamp_row]
+    return round((len(sample) - 1) / duration, 3) if duration > 0 else None
+
+
+class Recording:
+    """one memory-mapped recording, data is (samples x rows)"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.data, self.meta = open_recording(path)
+        self.names = [c["name"] for c in self.meta["channels"]]
+        self.sampling_rate = self.meta.get("sampling_rate")
+        rows = [c["row"] for c in self.meta["channels"] if c["type"] == "timestamp"]
+        self.timestamp_row = rows[0] if rows else None
+        self._index = None
+
+    def __len__(self):
+        return self.data.shape[0]
+
+    def rows(self, channels) -> list:
+        """row numbers of channels given by name (e.g. "Fp1", "timestamp") or row number"""
+        if channels is None:
+            return list(range(self.data.shape[1]))
+        result = []
+        for channel in channels:
+            if isinstance(channel, (int, np.integer)):
+                result.append(int(channel))
+            elif channel in self.names:
+                result.append(self.names.index(channel))
+            else:
+                raise KeyError("no channel {} in {}, available: {}".format(channel, self.path, self.names))
+        return result
+
+    def channels_of_type(self, kind: str) -> list:
+        """names of all channels of a type, e.g. "eeg", "ppg", "eda" """
+        return [c["name"] for c in self.meta["channels"] if c["type"] == kind]
+
+    @property
+    def index(self) -> np.ndarray:
+        """every INDEX_STEP-th timestamp, built on first use"""
+        if self._index is None:
+            if self.timestamp_row is None:
+                raise ValueError("{} has no timestamp channel".format(self.path))
+            self._index = np.array(self.data[::INDEX_STEP, self.timestamp_row])
+        return self._index
+
+    def _position(self, timestamp: float) -> int:
+        # sparse index narrows it down to one block, only that block is read from disk
+        block = max(0, int(np.searchsorted(self.index, timestamp, side="left")) - 1)
+        start = block * INDEX_STEP
+        stop = min(len(self), start + 2 * INDEX_STEP)
+        return start + int(np.searchsorted(self.data[start:stop, self.timestamp_row], timestamp, side="left"))
+
+    def time_slice(self, start: float = None, end: float = None) -> slice:
+        """sample range with start <= timestamp < end (absolute BrainFlow timestamps)"""
+        first = 0 if start is None else self._position(start)
+        last = len(self) if end is None else self._position(end)
+        return slice(first, max(first, last))
+
+    def select(self, channels=None, start: float = None, end: float = None) -> np.ndarray:
+        """
+        (samples x channels) array for a time range, only that range of the file is read
+        :param channels: channel names or row numbers, None for all rows
+        :param start: first timestamp (inclusive), None from the beginning
+        :param end: last timestamp (exclusive), None until the end
+        """
+        window = self.data[self.time_slice(start, end)]
+        if channels is None:
+            return np.asarray(window)
+        return np.asarray(window[:, self.rows(channels)])
+
+    def epoch(self, offset: float, duration: float, channels=None) -> np.ndarray:
+        """select() with a time relative to the first sample, in seconds"""
+        first = float(self.data[0, self.timestamp_row]) if len(self) else 0.0
+        return self.select(channels, first + offset, first + offset + duration)
+
+
+class SessionReader:
+    """
+    all recordings of one session folder, each opened on first access:
+
+        session = SessionReader("data/2024_05_01__10_00")
+        fp = session["eeg"].select(["Fp1", "Fp2", "timestamp"], start=t0, end=t0 + 30)
+        eda = session["eda", "LEFT"]  # the EmotiBit named LEFT, when several recorded
+    """
+
+    def __init__(self, session_dir, config: dict = None):
+        """
+        :param session_dir: a data/<playtime> folder
+        :param config: loaded conf.yaml, for the file names (defaults are used without it)
+        """
+        self.session_dir = Path(session_dir)
+        self.config = config
+        self._open = {}
+
+    def _base(self, modality: str, device: str = None) -> Path:
+        folder, keys, default = MODALITIES[modality]
+        name = default
+        if self.config is not None:
+            value = self.config.get("DATA_CAPTURE", {})
+            for key in keys:
+                value = value.get(key, {}) if isinstance(value, dict) else {}
+            if isinstance(value, str):
+                name = value
+        folder = self.session_dir / folder if device is None else self.session_dir / folder / device
+        return (folder / name).with_suffix("")
+
+    def _recorded(self, modality: str, device: str = None) -> bool:
+        return any(self._base(modality, device).with_suffix(s).exists() for s in (BIN_SUFFIX, ".csv"))
+
+    @property
+    def devices(self) -> list:
+        """names of the EmotiBits that recorded into a gsr/<NAME>/ folder of their own"""
+        gsr = self.session_dir / "gsr"
+        if not gsr.is_dir():
+            return []
+        return sorted(d.name for d in gsr.iterdir()
+                      if d.is_dir() and any(self._recorded(m, d.name) for m, spec in MODALITIES.items()
+                                            if spec[0] == "gsr"))
+
+    def path(self, modality: str, device: str = None):
+        """
+        binary recording path (without suffix) for a modality, None if it wasn't recorded
+        :param device: EmotiBit name for the recordings in gsr/<device>/, see devices
+        """
+        base = self._base(modality, device)
+        if base.with_suffix(BIN_SUFFIX).exists() and base.with_suffix(META_SUFFIX).exists():
+            return base
+        csv_file = base.with_suffix(".csv")
+        if not csv_file.exists():
+            return None
+        cache = base.with_name(base.name + CACHE_SUFFIX)
+        cache_bin = cache.with_suffix(BIN_SUFFIX)
+        if not cache_bin.exists() or cache_bin.stat().st_mtime < csv_file.stat().st_mtime:
+            logging.info("converting {} to a binary cache, this happens only once".format(csv_file))
+            _csv_to_cache(csv_file, cache)
+        return cache
+
+    @property
+    def modalities(self) -> list:
+        """
+        keys of the recordings in this session (doesn't open them): the modality, or (modality, device) for
+        the recordings of an EmotiBit in gsr/<device>/
+        """
+        keys = [m for m in MODALITIES if self._recorded(m)]
+        keys += [(m, device) for device in self.devices for m in MODALITIES if self._recorded(m, device)]
+        return keys
+
+    def __getitem__(self, key) -> Recording:
+        """
+        :param key: modality, or (modality, device) for one of several EmotiBits. A modality alone also finds
+            the recording of the only EmotiBit that recorded it into a folder of its own
+        """
+        modality, device = key if isinstance(key, tuple) else (key, None)
+        if modality not in MODALITIES:
+            raise KeyError("unknown modality {}, use one of {}".format(modality, list(MODALITIES)))
+        if device is None and not self._recorded(modality):
+            devices = [d for d in self.devices if self._recorded(modality, d)]
+            if len(devices) > 1:
+                raise KeyError("{} was recorded by several EmotiBits {}, use session[{!r}, <device>]".format(
+                    modality, devices, modality))
+            device = devices[0] if devices else None
+        if (modality, device) not in self._open:
+            path = self.path(modality, device)
+            if path is None:
+                raise KeyError("no {} recording{} in {}".format(
+                    modality, "" if device is None else " of " + device, self.session_dir))
+            self._open[modality, device] = Recording(path)
+        return self._open[modality, device]
+
+    def events(self) -> pd.DataFrame:
+        """the Unity events of the session, see websocket.SessionFormat.read_session"""
+        from websocket.SessionFormat import read_session
+        return read_session(self.session_dir / "websocket" / "websocket.jsonl")
@@ -0,0 +1,29 @@
+from EEG.sync_pulse import coded, decode
+
+VALUES = [200, 77, 3]
+EDGES_PER_GROUP = 2 + 8 * 2
+
+
+def _edges(interval=5.0):
+    edges = list(coded(VALUES, interval=interval))
+    return [edge.offset for edge in edges], [edge.level for edge in edges]
+
+
+def test_decode_all_groups():
+    times, levels = _edges()
+    assert decode(times, levels) == [(0.0, 200), (5.0, 77), (10.0, 3)]
+
+
+def test_decode_from_mid_group_offset():
+    # starting inside the first group (on a rise or a fall) skips it and finds the next start pulses
+    times, levels = _edges()
+    for offset in range(1, EDGES_PER_GROUP):
+        assert decode(times[offset:], levels[offset:]) == [(5.0, 77), (10.0, 3)], offset
+
+
+def test_decode_back_to_back_groups():
+    # no gap between the groups, only the start pulse tells them apart
+    times, levels = _edges(interval=0.04 + 8 * 0.05)
+    for offset in range(len(times)):
+        expected = VALUES[(offset + EDGES_PER_GROUP - 1) // EDGES_PER_GROUP:]
+        assert [value for _, value in decode(times[offset:], levels[offset:])] == expected, offset
@@ -1,18 +1,44 @@
 import logging
+import queue
+import threading
 from tkinter import ttk
 from tkinter.messagebox import showinfo
 import tkinter as tk
 from tkinter.scrolledtext import ScrolledText
 from datetime import datetime
 
+from utils.dashboard import Dashboard
+
 
 class TextHandler(logging.Handler):
-    """Custom logging handler that writes to a Tkinter Text widget"""
-    
-    def __init__(self, text_widget):
+    """
+    Logging handler that writes to a Tkinter Text widget
+
+    emit() only queues the record (it's called from any thread), the widget is updated on the Tk thread
+    every refresh_ms with at most max_batch records at once. Repeats of the same message are shown once
+    with a count, and the widget keeps at most max_lines lines, so a busy session (a log line per Unity
+    message) doesn't flood the event loop or grow the widget for hours.
+    """
+
+    LEVELS = ["INFO", "WARNING", "ERROR", "DEBUG"]
+
+    def __init__(self, text_widget, max_lines=2000, refresh_ms=100, max_batch=500, queue_size=10000):
+        """
+        :param max_lines: oldest lines are trimmed beyond this
+        :param refresh_ms: milliseconds between widget updates
+        :param max_batch: records shown per update, the rest waits for the next one
+        :param queue_size: records waiting at most, more are counted and dropped
+        """
         logging.Handler.__init__(self)
         self.text_widget = text_widget
-        
+        self.max_lines = max_lines
+        self.refresh_ms = refresh_ms
+        self.max_batch = max_batch
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self._last = None  # (tag, message) of the last line
+        self._repeat = 0
+
         # Set up color tags
         self.text_widget.tag_config("INFO", foreground="black")
         self.text_widget.tag_config("WARNING", foreground="orange")
@@ -20,29 +46,76 @@ class TextHandler(logging.Handler):
         self.text_widget.tag_config("SUCCESS", foreground="green")
         self.text_widget.tag_config("DEBUG", foreground="gray")
 
+        self.text_widget.after(self.refresh_ms, self.refresh)
+
     def emit(self, record):
-        msg = self.format(record)
-        
-        def append():
-            self.text_widget.configure(state='normal')
-            
-            # Add timestamp
-            timestamp = datetime.now().strftime("%H:%M:%S")
-            self.text_widget.insert(tk.END, f"[{timestamp}] ", "INFO")
-            
-            # Add message with color based on level
-            tag = record.levelname
-            if tag not in ["INFO", "WARNING", "ERROR", "DEBUG"]:
-                tag = "INFO"
-            
-            self.text_widget.insert(tk.END, f"{msg}\n", tag)
-            self.text_widget.configure(state='disabled')
-            
-            # Auto-scroll to bottom
-            self.text_widget.yview(tk.END)
-        
-        # Schedule on main thread
-        self.text_widget.after(0, append)
+        try:
+            tag = record.levelname if record.levelname in self.LEVELS else "INFO"
+            self.queue.put_nowait((record.created, tag, self.format(record)))
+        except queue.Full:
+            self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+    def _batch(self):
+        """up to max_batch queued records, consecutive repeats merged into (time, tag, message, count)"""
+        lines = []
+        for _ in range(self.max_batch):
+            try:
+                created, tag, msg = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if lines and lines[-1][1] == tag and lines[-1][2] == msg:
+                lines[-1][0] = created
+                lines[-1][3] += 1
+            else:
+                lines.append([created, tag, msg, 1])
+        return lines
+
+    def _insert(self, created, tag, msg, count):
+        timestamp = datetime.fromtimestamp(created).strftime("%H:%M:%S")
+        if (tag, msg) == self._last:
+            # same message as the last line: replace that line, with the total count
+            self._repeat += count
+            self.text_widget.delete("last_line", "end-1c")
+        else:
+            self._last = (tag, msg)
+            self._repeat = count
+            self.text_widget.mark_set("last_line", "end-1c")
+            self.text_widget.mark_gravity("last_line", tk.LEFT)
+        self.text_widget.insert(tk.END, f"[{timestamp}] ", "INFO")
+        suffix = f" (×{self._repeat})" if self._repeat > 1 else ""
+        self.text_widget.insert(tk.END, f"{msg}{suffix}\n", tag)
+
+    def refresh(self):
+        """show the queued records, runs on the Tk thread every refresh_ms"""
+        try:
+            lines = self._batch()
+            dropped, self.dropped = self.dropped, 0
+            if lines or dropped:
+                # only follow the end when the user hasn't scrolled up
+                at_end = self.text_widget.yview()[1] >= 0.999
+                self.text_widget.configure(state='normal')
+                if dropped:
+                    self._insert(datetime.now().timestamp(), "WARNING",
+                                 f"... {dropped} log messages dropped", 1)
+                for created, tag, msg, count in lines:
+                    self._insert(created, tag, msg, count)
+                excess = int(self.text_widget.index("end-1c").split(".")[0]) - 1 - self.max_lines
+                if excess > 0:
+                    self.text_widget.delete("1.0", f"{excess + 1}.0")
+                self.text_widget.configure(state='disabled')
+                if at_end:
+                    self.text_widget.yview(tk.END)
+            self.text_widget.after(self.refresh_ms, self.refresh)
+        except tk.TclError:
+            # the widget is gone, stop refreshing
+            pass
+
+    def clear(self):
+        """forget the last line, after the widget was cleared"""
+        self._last = None
+        self._repeat = 0
 
 
 class ImprovedGUI(tk.Tk):
@@ -55,7 +128,10 @@ class ImprovedGUI(tk.Tk):
         self.input_frame = None
         self.log_frame = None
         self.log_text = None
+        self.notebook = None
+        self.dashboard = None
         self.status_label = None
+        self.queue_label = None
         self.form_completed = False  # Flag to indicate form is complete
         
         # Player data variables
@@ -117,8 +193,10 @@ class ImprovedGUI(tk.Tk):
         main_frame.columnconfigure(1, weight=1)
         main_frame.rowconfigure(1, weight=1)
         
-        # === LEFT SIDE: Input Form ===
-        self.create_input_form(main_frame)
+        # === LEFT SIDE: Input Form, later also the Dashboard ===
+        self.notebook = ttk.Notebook(main_frame)
+        self.notebook.grid(row=0, column=0, rowspan=2, sticky=(tk.W, tk.E, tk.N, tk.S), padx=(0, 5))
+        self.create_input_form(self.notebook)
         
         # === RIGHT SIDE: Live Log ===
         self.create_log_panel(main_frame)
@@ -131,7 +209,7 @@ class ImprovedGUI(tk.Tk):
         
         # Input frame with border
         input_container = ttk.LabelFrame(parent, text="Participant Information", padding="15")
-        input_container.grid(row=0, column=0, rowspan=2, sticky=(tk.W, tk.E, tk.N, tk.S), padx=(0, 5))
+        parent.add(input_container, text="Participant")
         
         self.input_frame = ttk.Frame(input_container)
         self.input_frame.pack(fill='both', expand=True)
@@ -321,6 +399,16 @@ class ImprovedGUI(tk.Tk):
                                  command=self.clear_log)
         clear_button.grid(row=1, column=0, pady=(5, 0), sticky=tk.E)
     
+    def add_dashboard(self, **kwargs) -> Dashboard:
+        """
+        Add the live Dashboard tab next to the form and show it
+        :param kwargs: Dashboard options (seconds, fps, frame_budget_ms)
+        """
+        self.dashboard = Dashboard(self.notebook, **kwargs)
+        self.notebook.add(self.dashboard, text="Dashboard")
+        self.notebook.select(self.dashboard)
+        return self.dashboard
+    
     def create_status_bar(self, parent):
         """Create status bar at the bottom"""
         
@@ -330,17 +418,21 @@ class ImprovedGUI(tk.Tk):
         self.status_label = ttk.Label(status_frame, text="Ready | Fill in participant information to continue", 
                                      font=('Arial', 9))
         self.status_label.pack(side=tk.LEFT, padx=5, pady=2)
+        
+        # queue counters of the session logs, see watch_log_queues()
+        self.queue_label = ttk.Label(status_frame, text="", font=('Arial', 9))
+        self.queue_label.pack(side=tk.RIGHT, padx=5, pady=2)
     
     def setup_logging(self):
         """Setup logging to the text widget"""
         
         # Create text handler
-        text_handler = TextHandler(self.log_text)
-        text_handler.setFormatter(logging.Formatter('%(message)s'))
+        self.text_handler = TextHandler(self.log_text)
+        self.text_handler.setFormatter(logging.Formatter('%(message)s'))
         
         # Add handler to root logger
         logger = logging.getLogger()
-        logger.addHandler(text_handler)
+        logger.addHandler(self.text_handler)
         logger.setLevel(logging.INFO)
     
     def clear_log(self):
@@ -348,12 +440,61 @@ class ImprovedGUI(tk.Tk):
         self.log_text.configure(state='normal')
         self.log_text.delete(1.0, tk.END)
         self.log_text.configure(state='disabled')
+        self.text_handler.clear()
         logging.info("Log cleared")
     
     def update_status(self, message, color='black'):
         """Update the status bar message"""
         self.status_label.config(text=message, foreground=color)
     
+    def watch_log_queues(self, get_logs, interval_ms=1000):
+        """
+        Show the queue counters of the session logs in the status bar, every interval_ms
+        :param get_logs: returns name -> SessionLogWriter, e.g. Orchestrator.log_writers
+        """
+        try:
+            logs = get_logs()
+            queued = sum(log.queued for log in logs.values())
+            problems = ["{}: {}".format(name, ", ".join("{} {}".format(getattr(log, counter), counter)
+                                                       for counter in ("dropped", "spilled")
+                                                       if getattr(log, counter)))
+                        for name, log in logs.items() if log.dropped or log.spilled]
+            text = "Logs: {} queued".format(queued)
+            if problems:
+                text += " | ⚠ " + " | ".join(problems)
+            dropped = any(log.dropped for log in logs.values())
+            self.queue_label.config(text=text, foreground='red' if dropped else 'orange' if problems else 'black')
+        except tk.TclError:
+            # the window is gone
+            return
+        except Exception as e:
+            logging.debug(f"log queue status failed: {e}")
+        self.after(interval_ms, self.watch_log_queues, get_logs, interval_ms)
+    
+    def run_in_background(self, work, done, poll_ms=100):
+        """
+        Run work() on a worker thread, so the window stays responsive, and done(result, error) on the Tk
+        thread once it returned (error is the exception work() raised, or None)
+        """
+        results = queue.Queue(maxsize=1)
+
+        def run():
+            try:
+                results.put((work(), None))
+            except Exception as e:
+                results.put((None, e))
+
+        def poll():
+            try:
+                result, error = results.get_nowait()
+            except queue.Empty:
+                self.after(poll_ms, poll)
+                return
+            done(result, error)
+
+        threading.Thread(target=run, name="GUI-background", daemon=True).start()
+        self.after(poll_ms, poll)
+    
     def validate_age(self, value):
         """Validate age input (9-13)"""
         if value == "":
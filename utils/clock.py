@@ -0,0 +1,39 @@
+"""
+clock helpers, so every capture module stamps its data the same way
+"""
+import time
+from datetime import datetime, timezone
+from typing import NamedTuple, Optional
+
+try:
+    from pylsl import local_clock
+except (ImportError, RuntimeError):
+    # pylsl or the liblsl binary is missing, LSL timestamps will be left empty
+    local_clock = None
+
+
+class ReceiveStamp(NamedTuple):
+    """
+    the moment a message arrived, read from three clocks at once:
+    - monotonic_ns: time.monotonic_ns(), never jumps, use it for intervals within a session
+    - wall_ns: time.time_ns(), UTC wall clock, use it to relate sessions to the calendar
+    - lsl: pylsl.local_clock() in seconds, the clock LSL (and the EEG/EmotiBit marker streams) use
+    """
+    monotonic_ns: int
+    wall_ns: int
+    lsl: Optional[float]
+
+    @property
+    def utc(self) -> str:
+        return datetime.fromtimestamp(self.wall_ns / 1e9, tz=timezone.utc).isoformat(timespec="microseconds")
+
+    @property
+    def unix_time(self) -> int:
+        return self.wall_ns // 1_000_000_000
+
+
+def stamp_now() -> ReceiveStamp:
+    monotonic_ns = time.monotonic_ns()
+    lsl = local_clock() if local_clock is not None else None
+    wall_ns = time.time_ns()
+    return ReceiveStamp(monotonic_ns, wall_ns, lsl)
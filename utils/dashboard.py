@@ -0,0 +1,246 @@
+"""
+live traces of the acquisition buffers in a Tkinter canvas (the Dashboard tab of the GUI)
+
+drawing 16 EEG channels of 10 s at 250 Hz point by point would be 40000 canvas points per frame. Instead
+every trace is decimated to the width of the canvas: per pixel column the minimum and maximum of the
+samples that fall in it, drawn as one vertical zigzag line, which looks the same as the full trace
+(spikes included). Each trace is one canvas item created once, a frame only moves its points
+(canvas.coords), nothing is deleted or created.
+
+frames come every 1/fps seconds on the Tk thread. A frame draws traces (round robin) until frame_budget_ms
+is used, the rest is drawn in the next frame, so the GUI never holds the GIL for long and the websocket
+and OSC threads keep getting their share.
+
+sources, added before start():
+    add_board(name, fetch, lanes, sampling_rate)   fetch(seconds) -> (rows x n) array or None, lanes are
+                                                    (row, label), e.g. BoardProcess.latest_seconds
+    add_series(label, fetch)                        fetch(seconds) -> (times, values) with unix times,
+                                                    e.g. the OSC buffers of GSR.GSR_OSC
+    add_rate(label, count)                          count() -> total so far, shown as a rate per second
+"""
+import logging
+import time
+import tkinter as tk
+from tkinter import ttk
+
+import numpy as np
+
+LABEL_WIDTH = 80
+HEADER_HEIGHT = 22
+TRACE_COLOR = "#1f4e79"
+
+
+def minmax_decimate(values: np.ndarray, width: int, positions: np.ndarray = None):
+    """
+    min and max of values per pixel column
+    :param positions: column of every value (sorted, in [0, width)), evenly spread over the width if None
+    :return: (columns, mins, maxs) for the columns that have values
+    """
+    values = np.asarray(values, dtype=np.float64)
+    n = len(values)
+    if n == 0 or width <= 0:
+        return np.empty(0, dtype=int), np.empty(0), np.empty(0)
+    if positions is None:
+        positions = np.arange(n) * width // n
+    starts = np.flatnonzero(np.r_[True, np.diff(positions) > 0])
+    return positions[starts], np.minimum.reduceat(values, starts), np.maximum.reduceat(values, starts)
+
+
+class _Lane:
+    """one trace on the canvas"""
+
+    def __init__(self, label: str, group: str = None, row: int = None, fetch=None, unit: str = ""):
+        self.label = label
+        self.group = group  # board name, None for a series
+        self.row = row
+        self.fetch = fetch  # series only
+        self.unit = unit
+        self.low = None
+        self.high = None
+        self.line = None
+        self.text = None
+        self.scale_text = None
+        self.top = 0
+        self.height = 0
+
+
+class Dashboard(ttk.Frame):
+    """canvas with a lane per trace and the event rates on top, see the module docstring"""
+
+    def __init__(self, parent, seconds: float = 10.0, fps: float = 10.0, frame_budget_ms: float = 25.0):
+        """
+        :param seconds: time shown
+        :param fps: frames per second
+        :param frame_budget_ms: drawing time per frame, lanes that don't fit wait for the next frame
+        """
+        super().__init__(parent)
+        self.seconds = seconds
+        self.interval_ms = int(1000 / fps)
+        self.frame_budget = frame_budget_ms / 1000.0
+        self.canvas = tk.Canvas(self, bg="white", highlightthickness=0)
+        self.canvas.pack(fill="both", expand=True)
+        self.boards = {}  # name -> (fetch, sampling_rate)
+        self.lanes = []
+        self.rates = []  # {"label", "count", "last", "time", "text"}
+        self.rate_text = None
+        self._next = 0
+        self._job = None
+        self._width = 0
+        self.canvas.bind("<Configure>", self._layout)
+
+    def add_board(self, name: str, fetch, lanes: list, sampling_rate: float, unit: str = "µV"):
+        self.boards[name] = (fetch, sampling_rate)
+        for row, label in lanes:
+            self.lanes.append(_Lane(label, group=name, row=row, unit=unit))
+
+    def add_series(self, label: str, fetch, unit: str = ""):
+        self.lanes.append(_Lane(label, fetch=fetch, unit=unit))
+
+    def add_rate(self, label: str, count):
+        self.rates.append({"label": label, "count": count, "last": None, "time": None, "text": "..."})
+
+    def _layout(self, event=None):
+        """(re)place the lanes after a resize, the traces get their points in the next frames"""
+        width = self.canvas.winfo_width()
+        height = self.canvas.winfo_height()
+        self._width = max(0, width - LABEL_WIDTH - 10)
+        if self.rate_text is None:
+            self.rate_text = self.canvas.create_text(5, 4, anchor="nw", font=("Consolas", 9), text="")
+        lane_height = (height - HEADER_HEIGHT) / max(1, len(self.lanes))
+        for i, lane in enumerate(self.lanes):
+            lane.top = HEADER_HEIGHT + i * lane_height
+            lane.height = lane_height
+            middle = lane.top + lane_height / 2
+            if lane.line is None:
+                lane.line = self.canvas.create_line(0, 0, 0, 0, fill=TRACE_COLOR)
+                lane.text = self.canvas.create_text(5, middle, anchor="w", font=("Arial", 8, "bold"),
+                                                    text=lane.label)
+                lane.scale_text = self.canvas.create_text(width - 5, lane.top + 1, anchor="ne",
+                                                          font=("Arial", 7), fill="gray", text="")
+            else:
+                self.canvas.coords(lane.text, 5, middle)
+                self.canvas.coords(lane.scale_text, width - 5, lane.top + 1)
+            self.canvas.coords(lane.line, LABEL_WIDTH, middle, LABEL_WIDTH + 1, middle)
+
+    def start(self):
+        if self._job is None:
+            self._job = self.after(self.interval_ms, self._frame)
+
+    def stop(self):
+        if self._job is not None:
+            self.after_cancel(self._job)
+            self._job = None
+
+    def _frame(self):
+        started = time.perf_counter()
+        try:
+            if self._width > 1 and self.lanes:
+                boards = {}
+                for _ in range(len(self.lanes)):
+                    lane = self.lanes[self._next % len(self.lanes)]
+                    self._next += 1
+                    self._draw(lane, boards)
+                    if time.perf_counter() - started > self.frame_budget:
+                        break
+            self._draw_rates()
+        except tk.TclError:
+            # the window is gone
+            self._job = None
+            return
+        except Exception as e:
+            logging.warning("dashboard frame failed: {}".format(e))
+        spent_ms = (time.perf_counter() - started) * 1000
+        self._job = self.after(max(1, int(self.interval_ms - spent_ms)), self._frame)
+
+    def _board_data(self, name: str, boards: dict):
+        """the window of a board, fetched once per frame for all its lanes"""
+        if name not in boards:
+            fetch, _ = self.boards[name]
+            boards[name] = fetch(self.seconds)
+        return boards[name]
+
+    def _draw(self, lane: _Lane, boards: dict):
+        width = self._width
+        if lane.group is not None:
+            data = self._board_data(lane.group, boards)
+            if data is None or data.shape[1] < 2:
+                return
+            values = data[lane.row]
+            # the newest sample at the right edge, an incomplete window starts further right
+            _, sampling_rate = self.boards[lane.group]
+            span = max(len(values), int(self.seconds * sampling_rate))
+            positions = (np.arange(span - len(values), span) * width) // span
+        else:
+            result = lane.fetch(self.seconds)
+            if result is None or len(result[0]) < 2:
+                return
+            times, values = result
+            start = time.time() - self.seconds
+            keep = times >= start
+            times, values = times[keep], values[keep]
+            if len(values) < 2:
+                return
+            positions = np.clip(((times - start) / self.seconds * width).astype(int), 0, width - 1)
+        columns, mins, maxs = minmax_decimate(values, width, positions)
+        if len(columns) < 2:
+            return
+        low, high = float(mins.min()), float(maxs.max())
+        # follow the range smoothly, a single frame with a spike doesn't squash the trace
+        if lane.low is None or low < lane.low or high > lane.high:
+            lane.low, lane.high = low, high
+        else:
+            lane.low += 0.1 * (low - lane.low)
+            lane.high += 0.1 * (high - lane.high)
+        span = max(lane.high - lane.low, 1e-9)
+        scale = (lane.height - 4) / span
+        bottom = lane.top + lane.height - 2
+        points = np.empty((len(columns), 4))
+        points[:, 0] = points[:, 2] = LABEL_WIDTH + columns
+        points[:, 1] = bottom - (mins - lane.low) * scale
+        points[:, 3] = bottom - (maxs - lane.low) * scale
+        self.canvas.coords(lane.line, *points.ravel().tolist())
+        self.canvas.itemconfigure(lane.scale_text, text="{:.4g} {}".format(span, lane.unit).strip())
+
+    def _draw_rates(self):
+        """messages per second of every counter, averaged over at least a second"""
+        if self.rate_text is None or not self.rates:
+            return
+        now = time.monotonic()
+        for rate in self.rates:
+            try:
+                total = rate["count"]()
+            except Exception:
+                total = None
+            if total is None:
+                rate["text"] = "-"
+            elif rate["last"] is None:
+                rate["last"], rate["time"] = total, now
+            elif now - rate["time"] >= 1.0:
+                rate["text"] = "{:.1f}/s".format((total - rate["last"]) / (now - rate["time"]))
+                rate["last"], rate["time"] = total, now
+        self.canvas.itemconfigure(self.rate_text,
+                                  text="   ".join("{}: {}".format(r["label"], r["text"]) for r in self.rates))
+
+
+def connect(dashboard: Dashboard, orchestrator):
+    """the traces and rates of a utils.orchestrator.Orchestrator session"""
+    from brainflow.board_shim import BoardIds, BoardShim
+    from utils.recording import channel_map
+
+    for kind, board_id, types, unit in (("EEG", BoardIds.CYTON_BOARD, ("eeg",), "µV"),
+                                        ("GSR_MASTER", BoardIds.EMOTIBIT_BOARD, ("accel",), "g")):
+        board = orchestrator.board(kind)
+        if board is None or not board.live_seconds:
+            continue
+        lanes = [(row["row"], "{} {}".format(kind.split("_")[0], row["name"]))
+                 for row in channel_map(board_id) if row["type"] in types]
+        dashboard.add_board(kind, board.latest_seconds, lanes, BoardShim.get_sampling_rate(board_id), unit)
+    if orchestrator.config["DATA_CAPTURE"].get("OSC", {}).get("ENABLED", False):
+        for name in ("EDA", "PPG_IR"):
+            # looked up every frame: the OSC receiver is (re)created on the worker's loop
+            dashboard.add_series(name, lambda seconds, name=name: orchestrator.osc.latest(name, seconds)
+                                 if orchestrator.osc is not None else None)
+    if orchestrator.ws_log is not None:
+        dashboard.add_rate("Unity", lambda: orchestrator.ws_log.received)
+    if orchestrator.marker_log is not None:
+        dashboard.add_rate("markers", lambda: orchestrator.marker_log.received)
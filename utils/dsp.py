@@ -0,0 +1,283 @@
+"""
+streaming filters applied to board data while it is recorded, so recordings don't have to be filtered
+offline afterwards
+
+BrainFlow's DataFilter works on whole arrays and starts from zero every call, applied to 50 ms chunks that
+gives a transient at every chunk edge. The filters here are second order sections (biquads, transposed
+direct form II) that keep their state between chunks, so filtering chunk by chunk gives exactly the same
+result as filtering the whole recording at once (causally, i.e. with the phase delay of a real time filter).
+
+    detrend    one pole high pass (DC blocker) with a time constant of seconds, removes offset and drift
+    notch      mains notch at frequency with quality q
+    highpass / lowpass / bandpass   Butterworth of order
+    decimate   Butterworth anti alias low pass, then every factor-th sample
+
+a FilterChain runs stages over the signal rows of a chunk; the other rows (package number, timestamps,
+markers) are passed through, decimated along with the signal. Markers that fall on a dropped sample move
+to the next kept sample that has none. A StreamProcessor is a BoardPoller listener that writes the chain's output to
+<name>_filtered.bin + .json next to the raw recording, with the chain in the sidecar.
+"""
+import logging
+import math
+from pathlib import Path
+
+import numpy as np
+from brainflow.board_shim import BoardShim, BrainFlowPresets
+
+from utils.recording import BinaryRecorder, channel_map
+
+# row types of utils.recording.channel_map that hold a signal, the others are passed through unfiltered
+SIGNAL_TYPES = ("eeg", "emg", "ecg", "eog", "exg", "eda", "ppg", "accel", "gyro", "magnetometer",
+                "temperature")
+FILTERED_SUFFIX = "_filtered"
+
+
+def _pole_q(order: int) -> list:
+    """Q of the second order sections of a Butterworth filter, None for the first order one of odd orders"""
+    qs = [1.0 / (2.0 * math.sin(math.pi * (2 * k + 1) / (2.0 * order))) for k in range(order // 2)]
+    return qs + ([None] if order % 2 else [])
+
+
+def butter_sos(kind: str, cutoff: float, sampling_rate: float, order: int = 4) -> np.ndarray:
+    """
+    Butterworth low or high pass as second order sections (bilinear transform with prewarping)
+    :return: (sections x 5) array of b0, b1, b2, a1, a2 (a0 = 1)
+    """
+    if kind not in ("lowpass", "highpass"):
+        raise ValueError("unknown filter kind {}".format(kind))
+    if not 0 < cutoff < sampling_rate / 2:
+        raise ValueError("cutoff {} Hz must be between 0 and {} Hz".format(cutoff, sampling_rate / 2))
+    w = 2 * math.pi * cutoff / sampling_rate
+    cos_w, sin_w = math.cos(w), math.sin(w)
+    sections = []
+    for q in _pole_q(order):
+        if q is None:
+            # first order section
+            k = math.tan(w / 2)
+            a0 = 1 + k
+            if kind == "lowpass":
+                b = [k / a0, k / a0, 0.0]
+            else:
+                b = [1 / a0, -1 / a0, 0.0]
+            sections.append(b + [(k - 1) / a0, 0.0])
+            continue
+        alpha = sin_w / (2 * q)
+        a0 = 1 + alpha
+        if kind == "lowpass":
+            b = [(1 - cos_w) / 2, 1 - cos_w, (1 - cos_w) / 2]
+        else:
+            b = [(1 + cos_w) / 2, -(1 + cos_w), (1 + cos_w) / 2]
+        sections.append([b[0] / a0, b[1] / a0, b[2] / a0, -2 * cos_w / a0, (1 - alpha) / a0])
+    return np.array(sections, dtype=np.float64)
+
+
+def notch_sos(frequency: float, sampling_rate: float, q: float = 30.0) -> np.ndarray:
+    """notch (band stop) at frequency, q = frequency / bandwidth"""
+    if not 0 < frequency < sampling_rate / 2:
+        raise ValueError("notch {} Hz must be between 0 and {} Hz".format(frequency, sampling_rate / 2))
+    w = 2 * math.pi * frequency / sampling_rate
+    alpha = math.sin(w) / (2 * q)
+    a0 = 1 + alpha
+    return np.array([[1 / a0, -2 * math.cos(w) / a0, 1 / a0, -2 * math.cos(w) / a0, (1 - alpha) / a0]])
+
+
+def dc_block_sos(seconds: float, sampling_rate: float) -> np.ndarray:
+    """one pole high pass y[n] = x[n] - x[n-1] + r * y[n-1] with a time constant of seconds"""
+    r = math.exp(-1.0 / (seconds * sampling_rate))
+    return np.array([[1.0, -1.0, 0.0, -r, 0.0]])
+
+
+class SosFilter:
+    """second order sections over (channels x n) chunks, the state is kept between chunks"""
+
+    def __init__(self, sos: np.ndarray, channels: int):
+        self.sos = np.atleast_2d(np.asarray(sos, dtype=np.float64))
+        self.channels = channels
+        self._z = None  # (sections, 2, channels)
+
+    def _steady_state(self, first: np.ndarray):
+        """state as if the first sample had been on the input forever, so a DC offset doesn't ring"""
+        self._z = np.zeros((len(self.sos), 2, self.channels))
+        x = first
+        for i, (b0, b1, b2, a1, a2) in enumerate(self.sos):
+            denominator = 1 + a1 + a2
+            gain = (b0 + b1 + b2) / denominator if abs(denominator) > 1e-12 else 0.0
+            y = gain * x
+            self._z[i, 1] = b2 * x - a2 * y
+            self._z[i, 0] = b1 * x - a1 * y + self._z[i, 1]
+            x = y
+
+    def reset(self):
+        self._z = None
+
+    def process(self, x: np.ndarray) -> np.ndarray:
+        x = np.array(x, dtype=np.float64)
+        if x.shape[1] == 0:
+            return x
+        if self._z is None:
+            self._steady_state(x[:, 0])
+        for i, (b0, b1, b2, a1, a2) in enumerate(self.sos):
+            z0, z1 = self._z[i]
+            # transposed direct form II, sample by sample but vectorised over the channels
+            for n in range(x.shape[1]):
+                sample = x[:, n]
+                y = b0 * sample + z0
+                z0 = b1 * sample - a1 * y + z1
+                z1 = b2 * sample - a2 * y
+                x[:, n] = y
+            self._z[i, 0], self._z[i, 1] = z0, z1
+        return x
+
+
+class Decimator:
+    """anti alias low pass, then every factor-th sample, the phase is kept between chunks"""
+
+    def __init__(self, factor: int, sampling_rate: float, channels: int, order: int = 8):
+        if factor < 1:
+            raise ValueError("decimation factor must be at least 1")
+        self.factor = factor
+        # cut off at 80 % of the new Nyquist frequency
+        self.filter = SosFilter(butter_sos("lowpass", 0.4 * sampling_rate / factor, sampling_rate, order),
+                                channels) if factor > 1 else None
+        self._phase = 0  # samples to skip before the next kept one
+
+    def keep(self, n: int) -> np.ndarray:
+        """indices of the kept samples of the next n samples"""
+        kept = np.arange(self._phase, n, self.factor)
+        self._phase = (self._phase - n) % self.factor
+        return kept
+
+
+class FilterChain:
+    """the stages of one stream, applied to the signal rows of (rows x n) board chunks"""
+
+    def __init__(self, stages: list, sampling_rate: float, num_rows: int, rows: list, marker_row: int = None):
+        """
+        :param stages: stage configs, e.g. [{"TYPE": "notch", "FREQUENCY": 50}, {"TYPE": "decimate", "FACTOR": 2}]
+        :param num_rows: rows of a chunk
+        :param rows: the rows to filter
+        :param marker_row: row whose markers are kept when samples are dropped
+        """
+        self.input_rate = sampling_rate
+        self.num_rows = num_rows
+        self.rows = list(rows)
+        self.marker_row = marker_row
+        self.stages = []
+        self.config = [dict(stage) for stage in stages]
+        rate = sampling_rate
+        channels = len(self.rows)
+        for stage in self.config:
+            kind = stage["TYPE"].lower()
+            if kind == "detrend":
+                self.stages.append(SosFilter(dc_block_sos(stage.get("SECONDS", 2.0), rate), channels))
+            elif kind == "notch":
+                self.stages.append(SosFilter(notch_sos(stage.get("FREQUENCY", 50.0), rate, stage.get("Q", 30.0)),
+                                             channels))
+            elif kind in ("lowpass", "highpass"):
+                self.stages.append(SosFilter(butter_sos(kind, stage["CUTOFF"], rate, stage.get("ORDER", 4)),
+                                             channels))
+            elif kind == "bandpass":
+                order = stage.get("ORDER", 4)
+                sos = np.vstack([butter_sos("highpass", stage["LOW"], rate, order),
+                                 butter_sos("lowpass", stage["HIGH"], rate, order)])
+                self.stages.append(SosFilter(sos, channels))
+            elif kind == "decimate":
+                decimator = Decimator(int(stage["FACTOR"]), rate, channels, stage.get("ORDER", 8))
+                self.stages.append(decimator)
+                rate = rate / decimator.factor
+            else:
+                raise ValueError("unknown filter stage {}".format(stage["TYPE"]))
+        self.sampling_rate = rate
+        self._pending_markers = []
+
+    def process(self, chunk: np.ndarray) -> np.ndarray:
+        """filter a (rows x n) chunk, returns (rows x m) with m < n when decimating"""
+        if chunk.shape[0] != self.num_rows:
+            raise ValueError("expected {} rows, got {}".format(self.num_rows, chunk.shape[0]))
+        out = np.array(chunk, dtype=np.float64)
+        signal = out[self.rows]
+        for stage in self.stages:
+            if isinstance(stage, SosFilter):
+                signal = stage.process(signal)
+                continue
+            if stage.filter is not None:
+                signal = stage.filter.process(signal)
+            kept = stage.keep(signal.shape[1])
+            if self.marker_row is not None:
+                self._carry_markers(out[self.marker_row], kept)
+            signal = signal[:, kept]
+            out = out[:, kept]
+        out[self.rows] = signal
+        return out
+
+    def _carry_markers(self, markers: np.ndarray, kept: np.ndarray):
+        """
+        move markers of dropped samples to the next kept sample without a marker (in place, across chunks),
+        none get lost and their order stays the same
+        """
+        kept_mask = np.zeros(len(markers), dtype=bool)
+        kept_mask[kept] = True
+        pending = self._pending_markers
+        for n in np.flatnonzero((markers != 0) | kept_mask):
+            if markers[n] != 0:
+                pending.append(markers[n])
+            if kept_mask[n]:
+                markers[n] = pending.pop(0) if pending else 0.0
+
+    def describe(self) -> dict:
+        return {"stages": self.config, "input_rate": self.input_rate, "sampling_rate": self.sampling_rate,
+                "rows": self.rows}
+
+
+def board_chain(stream_config: dict, board_id: int, preset: BrainFlowPresets = BrainFlowPresets.DEFAULT_PRESET,
+                types=None) -> FilterChain:
+    """
+    the FilterChain of a DATA_CAPTURE.DSP entry for a board preset, None when it has no stages
+    :param stream_config: {"STAGES": [...], "TYPES": [...]}, TYPES defaults to types or SIGNAL_TYPES
+    """
+    if not stream_config or not stream_config.get("STAGES"):
+        return None
+    channels = channel_map(board_id, preset)
+    wanted = stream_config.get("TYPES") or types or SIGNAL_TYPES
+    rows = [row["row"] for row in channels if row["type"] in wanted]
+    marker_rows = [row["row"] for row in channels if row["type"] == "marker"]
+    return FilterChain(stream_config["STAGES"], BoardShim.get_sampling_rate(board_id, preset),
+                       BoardShim.get_num_rows(board_id, preset), rows,
+                       marker_rows[0] if marker_rows else None)
+
+
+class StreamProcessor:
+    """BoardPoller listener: runs a FilterChain over every chunk and records the result"""
+
+    def __init__(self, chain: FilterChain, path, board_id: int,
+                 preset: BrainFlowPresets = BrainFlowPresets.DEFAULT_PRESET):
+        """
+        :param path: the raw recording path (suffix is ignored), the output is <name>_filtered.bin + .json
+        """
+        path = Path(path)
+        path = path.with_name(path.stem + FILTERED_SUFFIX)
+        self.chain = chain
+        self.recorder = BinaryRecorder(path, meta={
+            "board_id": int(board_id),
+            "preset": int(preset),
+            "sampling_rate": chain.sampling_rate,
+            "num_rows": chain.num_rows,
+            "channels": channel_map(board_id, preset),
+            "filters": chain.describe(),
+        })
+        logging.info("filtering {} row(s) to {}".format(len(chain.rows), self.recorder.bin_file))
+
+    def __call__(self, chunk: np.ndarray):
+        self.recorder.write(self.chain.process(chunk))
+
+    def close(self):
+        self.recorder.close()
+
+
+def processor_for(config: dict, stream: str, path, board_id: int,
+                  preset: BrainFlowPresets = BrainFlowPresets.DEFAULT_PRESET, types=None) -> StreamProcessor:
+    """the StreamProcessor of DATA_CAPTURE.DSP.<stream>, None when that stream isn't filtered"""
+    chain = board_chain(config["DATA_CAPTURE"].get("DSP", {}).get(stream), board_id, preset, types)
+    if chain is None:
+        return None
+    return StreamProcessor(chain, path, board_id, preset)
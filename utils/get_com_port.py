@@ -14,7 +14,7 @@ def return_com_port(mfr_name: str, debug: bool = None) -> str:
             print("mfr name: {}".format(port.manufacturer))
             print("com name: {}".format(port.name))
 
-    res = [p.name for p in ports if (str.lower(p.manufacturer) == str.lower(mfr_name))]
+    res = [p.name for p in ports if (p.manufacturer or "").lower() == mfr_name.lower()]
     if len(res) == 0:
         print("No port found for mfr name {}".format(mfr_name))
         return ""
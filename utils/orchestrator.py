@@ -0,0 +1,827 @@
+"""
+runs the modalities of a session that are enabled in conf.yaml (DATA_CAPTURE.MODALITIES), each in its
+own worker, and keeps them running
+
+    EEG, GSR,  BoardProcess: a process per BrainFlow board session, commands (start, stop, markers) go
+    GSR_MASTER over a pipe, the process answers with heartbeats carrying its sample count. EEG and
+               GSR_MASTER publish their live data in a SharedRingBuffer the main process reads without
+               pickling (BoardProcess.live), the boards are prepared first and started together
+    LSL        ThreadWorker: the LSL marker bridge, markers are forwarded to the board processes
+    SYNC_PULSE ThreadWorker: the sync pulse generator
+    EEG_QC     ThreadWorker: live signal quality of the EEG ring buffer (EEG.signal_quality)
+    WS, OSC    AsyncWorker: the websocket server and the EmotiBit OSC receiver on one asyncio loop, each
+               coroutine restarted on its own when it fails
+
+a supervisor thread checks every worker each second. A worker that died, didn't start in time, stopped
+sending heartbeats or stopped getting new samples is stopped and started again (at most max_restarts
+times) on a thread of its own, the other workers don't wait for it.
+
+the session clock is one utils.clock stamp taken when the orchestrator is created. Start, restart and stop
+of every worker are stamped as well and written to <session>/session.json; monotonic_ns is system wide,
+so the stamps of the board processes are on the same clock.
+"""
+import asyncio
+import json
+import logging
+import multiprocessing
+import threading
+import time
+from pathlib import Path
+
+from utils.clock import ReceiveStamp, stamp_now
+
+START = "start"
+STOP = "stop"
+MARKER = "marker"
+PREPARED = "prepared"
+STARTED = "started"
+BEAT = "beat"
+STOPPED = "stopped"
+ERROR = "error"
+
+
+def _stamp_dict(stamp: ReceiveStamp) -> dict:
+    return {"monotonic_ns": stamp.monotonic_ns, "wall_ns": stamp.wall_ns, "lsl": stamp.lsl, "utc": stamp.utc}
+
+
+def _ring_for(kind: str, seconds: float):
+    """the SharedRingBuffer a board kind publishes its live data in, None for kinds that don't"""
+    from brainflow.board_shim import BoardIds
+    from EEG.ring_buffer import shared_ring
+    board_ids = {"EEG": BoardIds.CYTON_BOARD, "GSR_MASTER": BoardIds.EMOTIBIT_BOARD}
+    if kind not in board_ids:
+        return None
+    return shared_ring(board_ids[kind].value, seconds)
+
+
+def _open_board(kind: str, config: dict, root_data_path: Path):
+    """create (and connect) the device of a board kind, imported here so the main process doesn't load it"""
+    if kind == "EEG":
+        from EEG.brainflow_get_data import EEG
+        return EEG(config, root_data_path)
+    if kind == "GSR":
+        from GSR.GSR import GSRDevices
+        devices = GSRDevices(config, root_data_path)
+        # prepared here, so a hung EmotiBit holds up its own process and not the coordinated start
+        if not devices.prepare() and not devices.prepared:
+            raise RuntimeError("no EmotiBit prepared: {}".format(devices.errors))
+        return devices
+    if kind == "GSR_MASTER":
+        from GSR.GSR_master import GSR
+        return GSR(config, root_data_path)
+    raise ValueError("unknown board kind {}".format(kind))
+
+
+def _launch_board(kind: str, device, append: bool, live_buffer):
+    """start streaming, returns (stop, samples)"""
+    if kind == "EEG":
+        device.launch_eeg(append, live_buffer=live_buffer)
+        return device.stop_eeg, lambda: device.live.buffer.count if device.live is not None else None
+    if kind == "GSR":
+        if not device.launch_gsr(append) and not device.devices:
+            raise RuntimeError("no EmotiBit started: {}".format(device.errors))
+        return device.stop_gsr, device.samples
+    device.launch_gsr(append, live_buffer=live_buffer)
+    return device.stop_gsr, lambda: device.live.buffer.count if device.live is not None else None
+
+
+def _release_board(device):
+    """release a board that was prepared but never started"""
+    if hasattr(device, "release"):
+        device.release()
+        return
+    boards = [device.board] if getattr(device, "board", None) is not None else []
+    for board in boards:
+        try:
+            board.release_session()
+        except Exception as e:
+            logging.warning("releasing the board failed: {}".format(e))
+
+
+def _board_main(kind: str, config: dict, root_data_path: Path, conn, session_start: ReceiveStamp,
+                append: bool, beat_interval: float, ring: dict = None, hold: bool = False):
+    """
+    entry point of a board process: prepare the board, launch it, then serve commands and send heartbeats
+    :param ring: SharedRingBuffer.descriptor() to publish the live data in
+    :param hold: wait for a START command after preparing, so several boards start together
+    """
+    logging.basicConfig(level=logging.INFO, format='[{}] %(message)s'.format(kind))
+    from EEG.ring_buffer import SharedRingBuffer
+    live_buffer = SharedRingBuffer.attach(ring) if ring is not None else None
+    stop = None
+    try:
+        try:
+            device = _open_board(kind, config, root_data_path)
+        except Exception as e:
+            conn.send((ERROR, repr(e)))
+            return
+        conn.send((PREPARED, stamp_now()))
+        try:
+            while hold:
+                if not conn.poll(beat_interval):
+                    conn.send((BEAT, stamp_now(), None))
+                    continue
+                command = conn.recv()
+                if command[0] == START:
+                    break
+                if command[0] == STOP:
+                    _release_board(device)
+                    conn.send((STOPPED, stamp_now()))
+                    return
+            stop, samples = _launch_board(kind, device, append, live_buffer)
+        except (EOFError, OSError):
+            # the main process is gone
+            _release_board(device)
+            return
+        except Exception as e:
+            _release_board(device)
+            conn.send((ERROR, repr(e)))
+            return
+        started = stamp_now()
+        logging.info("started {:.3f} s into the session".format(
+            (started.monotonic_ns - session_start.monotonic_ns) / 1e9))
+        conn.send((STARTED, started))
+        next_beat = 0.0
+        while True:
+            now = time.monotonic()
+            if now >= next_beat:
+                conn.send((BEAT, stamp_now(), samples()))
+                next_beat = now + beat_interval
+            if not conn.poll(max(0.0, next_beat - now)):
+                continue
+            command = conn.recv()
+            if command[0] == STOP:
+                break
+            if command[0] == MARKER:
+                device.insert_marker(command[1])
+    except (EOFError, OSError):
+        # the main process is gone
+        pass
+    finally:
+        try:
+            if stop is not None:
+                stop()
+        finally:
+            if live_buffer is not None:
+                live_buffer.close()
+            if stop is not None:
+                try:
+                    conn.send((STOPPED, stamp_now()))
+                except (EOFError, OSError):
+                    pass
+
+
+class Worker:
+    """one modality, started, checked and stopped by the Orchestrator"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.restarts = 0
+        self.history = []  # (event, stamp)
+
+    def start(self, restart: bool = False):
+        raise NotImplementedError
+
+    def stop(self, timeout: float = 10.0):
+        raise NotImplementedError
+
+    def check(self):
+        """None when healthy, otherwise the reason it isn't"""
+        raise NotImplementedError
+
+    def insert_marker(self, code: float):
+        pass
+
+    def close(self):
+        """free what outlives a restart, after the final stop"""
+        pass
+
+    def _event(self, event: str, stamp: ReceiveStamp = None):
+        self.history.append((event, stamp or stamp_now()))
+
+
+class BoardProcess(Worker):
+    """a BrainFlow board session (EEG, GSR, GSR_MASTER) in its own process"""
+
+    def __init__(self, kind: str, config: dict, root_data_path: Path, session_start: ReceiveStamp,
+                 beat_interval: float = 1.0, start_timeout: float = 60.0, stall_timeout: float = 10.0,
+                 live_seconds: float = 30.0, hold: bool = False):
+        """
+        :param kind: EEG, GSR or GSR_MASTER
+        :param start_timeout: seconds the board may take to connect (prepare_session can hang)
+        :param stall_timeout: seconds without heartbeat or without new samples before it counts as stalled
+        :param live_seconds: seconds of live data in the shared ring buffer, 0 for none
+        :param hold: only prepare the board on the first start and wait for release(), restarts don't wait
+        """
+        super().__init__(kind)
+        self.config = config
+        self.root_data_path = root_data_path
+        self.session_start = session_start
+        self.beat_interval = beat_interval
+        self.start_timeout = start_timeout
+        self.stall_timeout = stall_timeout
+        self.process = None
+        self.state = "idle"
+        self.error = None
+        self._conn = None
+        self._lock = threading.Lock()
+        self._since = 0.0
+        self._last_beat = 0.0
+        self._samples = None
+        self._last_progress = 0.0
+        self.live_seconds = live_seconds
+        self.hold = hold
+        self.ring = None
+
+    def live(self):
+        """the SharedRingBuffer the board process writes its live data in, None before start or for GSR"""
+        return self.ring
+
+    def latest_seconds(self, seconds: float):
+        """a copy of the last seconds of live data (rows x n), None without a ring buffer"""
+        if self.ring is None:
+            return None
+        rate = self.ring.capacity / self.live_seconds
+        return self.ring.latest(int(seconds * rate))
+
+    def start(self, restart: bool = False):
+        if self.ring is None and self.live_seconds > 0:
+            # created here and kept across restarts, readers keep their ring when the board restarts
+            self.ring = _ring_for(self.name, self.live_seconds)
+        # spawn: the same on windows and linux, and the child doesn't inherit the GUI or the asyncio loop
+        context = multiprocessing.get_context("spawn")
+        parent, child = context.Pipe()
+        ring = self.ring.descriptor() if self.ring is not None else None
+        self.process = context.Process(target=_board_main, name="board-{}".format(self.name), daemon=True,
+                                       args=(self.name, self.config, self.root_data_path, child,
+                                             self.session_start, restart, self.beat_interval, ring,
+                                             self.hold and not restart))
+        with self._lock:
+            self._conn = parent
+            self.state = "starting"
+            self.error = None
+            self._samples = None
+            self._since = self._last_beat = self._last_progress = time.monotonic()
+        self.process.start()
+        child.close()
+        self._event("restart" if restart else "start")
+
+    def _drain(self):
+        with self._lock:
+            conn = self._conn
+            try:
+                while conn is not None and conn.poll():
+                    message = conn.recv()
+                    now = time.monotonic()
+                    if message[0] == PREPARED:
+                        self.state = "prepared"
+                        self._last_beat = now
+                        self._event("prepared", message[1])
+                    elif message[0] == STARTED:
+                        self.state = "running"
+                        self._last_beat = self._last_progress = now
+                        self._event("started", message[1])
+                    elif message[0] == BEAT:
+                        self._last_beat = now
+                        if message[2] != self._samples:
+                            self._samples = message[2]
+                            self._last_progress = now
+                    elif message[0] == ERROR:
+                        self.state = "failed"
+                        self.error = message[1]
+                    elif message[0] == STOPPED:
+                        self.state = "stopped"
+                        self._event("stopped", message[1])
+            except (EOFError, OSError):
+                self._conn = None
+
+    def check(self):
+        self._drain()
+        now = time.monotonic()
+        if self.state == "failed":
+            return "failed: {}".format(self.error)
+        if self.process is None or not self.process.is_alive():
+            return "process exited (code {})".format(self.process.exitcode if self.process else None)
+        if self.state in ("starting", "prepared") and now - self._since > self.start_timeout:
+            return "didn't start within {} s".format(self.start_timeout)
+        if self.state == "running" and now - self._last_beat > self.stall_timeout:
+            return "no heartbeat for {:.0f} s".format(now - self._last_beat)
+        if self.state == "running" and self._samples is not None and now - self._last_progress > self.stall_timeout:
+            return "no new samples for {:.0f} s".format(now - self._last_progress)
+        return None
+
+    def _send(self, message) -> bool:
+        with self._lock:
+            if self._conn is None:
+                return False
+            try:
+                self._conn.send(message)
+                return True
+            except (EOFError, OSError):
+                self._conn = None
+                return False
+
+    def release(self) -> bool:
+        """start streaming a board that was started with hold and is prepared"""
+        self._drain()
+        return self.state == "prepared" and self._send((START,))
+
+    def insert_marker(self, code: float):
+        if self.state == "running":
+            self._send((MARKER, code))
+
+    def stop(self, timeout: float = 10.0):
+        if self.process is None:
+            return
+        if self.process.is_alive() and self._send((STOP,)):
+            deadline = time.monotonic() + timeout
+            while self.process.is_alive() and time.monotonic() < deadline and self.state != "stopped":
+                self._drain()
+                time.sleep(0.05)
+            self.process.join(max(0.0, deadline - time.monotonic()))
+        if self.process.is_alive():
+            logging.warning("{} didn't stop in time, terminating it".format(self.name))
+            self.process.terminate()
+            self.process.join(2.0)
+            if self.process.is_alive():
+                self.process.kill()
+                self.process.join()
+        self._drain()
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+        if self.state != "stopped":
+            self.state = "stopped"
+            self._event("stopped")
+
+    def close(self):
+        if self.ring is not None:
+            self.ring.close()
+            self.ring.unlink()
+            self.ring = None
+
+
+class ThreadWorker(Worker):
+    """something that runs on threads of its own (LSL bridge, sync pulses), given as start / stop / alive"""
+
+    def __init__(self, name: str, start, stop, alive):
+        """
+        :param start: start(restart: bool), returns when running
+        :param stop: stop(timeout)
+        :param alive: alive() -> bool
+        """
+        super().__init__(name)
+        self._start = start
+        self._stop = stop
+        self._alive = alive
+        self.running = False
+        self.error = None  # why the last start failed, reported by check() so the supervisor tries again
+
+    def start(self, restart: bool = False):
+        try:
+            self._start(restart)
+        except Exception as e:
+            self.error = e
+            raise
+        self.error = None
+        self.running = True
+        self._event("restart" if restart else "start")
+
+    def stop(self, timeout: float = 10.0):
+        if self.running:
+            self.running = False
+            self._stop(timeout)
+            self._event("stopped")
+
+    def check(self):
+        if self.error is not None:
+            return "didn't start: {}".format(self.error)
+        if self.running and not self._alive():
+            return "thread stopped"
+        return None
+
+
+class AsyncWorker(Worker):
+    """coroutines on one asyncio loop in its own thread, a coroutine that fails is restarted on its own"""
+
+    def __init__(self, name: str, coroutines: dict, stall_timeout: float = 10.0, max_backoff: float = 30.0):
+        """
+        :param coroutines: name -> factory returning a new coroutine, e.g. lambda: start_ws_server(...)
+        :param stall_timeout: seconds the loop may be blocked before it counts as stalled
+        """
+        super().__init__(name)
+        self.coroutines = coroutines
+        self.stall_timeout = stall_timeout
+        self.max_backoff = max_backoff
+        self.failures = {name: 0 for name in coroutines}
+        self._loop = None
+        self._thread = None
+        self._tick = 0.0
+        self._ready = threading.Event()
+
+    async def _keep_running(self, name, factory):
+        backoff = 1.0
+        while True:
+            started = time.monotonic()
+            try:
+                await factory()
+                logging.warning("{} returned, starting it again in {:.0f} s".format(name, backoff))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error("{} failed: {}, starting it again in {:.0f} s".format(name, e, backoff))
+            self.failures[name] += 1
+            # a coroutine that ran for a while starts over with a short backoff
+            backoff = 1.0 if time.monotonic() - started > self.max_backoff else min(2 * backoff, self.max_backoff)
+            await asyncio.sleep(backoff)
+
+    async def _heartbeat(self):
+        while True:
+            self._tick = time.monotonic()
+            await asyncio.sleep(0.5)
+
+    async def _main(self):
+        self._loop = asyncio.get_running_loop()
+        tasks = [asyncio.create_task(self._keep_running(name, factory), name=name)
+                 for name, factory in self.coroutines.items()]
+        tasks.append(asyncio.create_task(self._heartbeat()))
+        self._ready.set()
+        try:
+            await asyncio.gather(*tasks)
+        except asyncio.CancelledError:
+            for task in tasks:
+                task.cancel()
+            # let every coroutine run its clean up (writers, OSC files)
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _run(self):
+        try:
+            asyncio.run(self._main())
+        except Exception as e:
+            logging.error("{} loop failed: {}".format(self.name, e))
+
+    def start(self, restart: bool = False):
+        self._ready.clear()
+        self._tick = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+        self._ready.wait(5.0)
+        self._event("restart" if restart else "start")
+
+    def check(self):
+        if self._thread is None or not self._thread.is_alive():
+            return "loop stopped"
+        if time.monotonic() - self._tick > self.stall_timeout:
+            return "loop blocked for {:.0f} s".format(time.monotonic() - self._tick)
+        return None
+
+    def stop(self, timeout: float = 10.0):
+        if self._thread is None:
+            return
+        loop = self._loop
+        if loop is not None and self._thread.is_alive():
+            def cancel():
+                for task in asyncio.all_tasks(loop):
+                    if task.get_coro().__name__ == "_main":
+                        task.cancel()
+            loop.call_soon_threadsafe(cancel)
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logging.warning("{} didn't stop within {} s".format(self.name, timeout))
+        self._thread = None
+        self._event("stopped")
+
+
+class Orchestrator:
+    """starts, watches and stops the workers of one session"""
+
+    def __init__(self, config: dict, root_data_path: Path, ws_params: list = None, check_interval: float = 1.0,
+                 max_restarts: int = None):
+        """
+        :param config: loaded conf.yaml
+        :param root_data_path: the session folder (data/<playtime>)
+        :param ws_params: messages sent to Unity when it connects
+        :param check_interval: seconds between health checks
+        :param max_restarts: restarts per worker before giving up, defaults to DATA_CAPTURE.SUPERVISOR.MAX_RESTARTS
+        """
+        self.config = config
+        self.root_data_path = Path(root_data_path)
+        self.ws_params = ws_params
+        self.check_interval = check_interval
+        supervisor = config["DATA_CAPTURE"].get("SUPERVISOR", {})
+        self.max_restarts = supervisor.get("MAX_RESTARTS", 3) if max_restarts is None else max_restarts
+        self.stall_timeout = supervisor.get("STALL_TIMEOUT", 10.0)
+        self.session_start = stamp_now()
+        self.marker_log = None
+        self.ws_log = None
+        self.ws_hub = None
+        self.osc = None
+        self.workers = []
+        self.given_up = set()
+        self._restarting = set()
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._build()
+
+    def enabled(self, modality: str) -> bool:
+        return bool(self.config["DATA_CAPTURE"].get("MODALITIES", {}).get(modality, modality == "WS"))
+
+    def _build(self):
+        capture = self.config["DATA_CAPTURE"]
+        for kind in ("EEG", "GSR", "GSR_MASTER"):
+            if self.enabled(kind):
+                # prepared in parallel, started together by _release_boards
+                self.workers.append(BoardProcess(kind, self.config, self.root_data_path, self.session_start,
+                                                 stall_timeout=self.stall_timeout, hold=True))
+        if self.enabled("LSL") or capture.get("SYNC_PULSE", {}).get("ENABLED", False):
+            from websocket.SessionLogWriter import SessionLogWriter
+            from websocket.SessionFormat import format_record_line
+            # markers and sync pulses get their own log next to the Unity one
+            self.marker_log = SessionLogWriter(self.root_data_path / "websocket" / "markers.jsonl",
+                                               formatter=format_record_line, **self._log_options())
+        if self.enabled("LSL"):
+            self.workers.append(self._lsl_worker())
+        if capture.get("SYNC_PULSE", {}).get("ENABLED", False):
+            self.workers.append(self._sync_worker())
+        if self.enabled("EEG") and capture.get("QC", {}).get("ENABLED", False):
+            self.workers.append(self._qc_worker())
+        coroutines = {}
+        if self.enabled("WS"):
+            from websocket.SessionFormat import LOG_FORMATS
+            from websocket.SessionLogWriter import SessionLogWriter
+            from websocket.WebSocketHub import WebSocketHub
+            from websocket.WebSocketServer import settings_from_config, start_ws_server
+            # one writer for the whole session, its message count feeds the dashboard
+            self.ws_log = SessionLogWriter(self.root_data_path / "websocket" / "websocket.jsonl",
+                                           formatter=LOG_FORMATS["ndjson"], **self._log_options())
+            # the clients outlive a restart of the server, so a reconnect is recognised
+            self.ws_hub = WebSocketHub(self.ws_params, self.ws_log, out_dir=self.root_data_path / "websocket",
+                                       split=capture["WS"].get("SPLIT_CLIENTS", False),
+                                       send_queue=capture["WS"].get("SEND_QUEUE", 100),
+                                       log_options=self._log_options())
+            # read here, so a typo in conf.yaml stops the session before anything starts
+            ws_settings = settings_from_config(capture["WS"])
+            coroutines["websocket"] = lambda: start_ws_server(params=self.ws_params, ip=capture["WS"]["IP"],
+                                                              port=capture["WS"]["PORT"], writer=self.ws_log,
+                                                              hub=self.ws_hub,
+                                                              settings=ws_settings)
+        osc = capture.get("OSC", {})
+        if osc.get("ENABLED", False):
+            from GSR.GSR_OSC import GSR as GSR_OSC
+
+            def serve_osc():
+                # kept, so the dashboard can read its buffers
+                self.osc = GSR_OSC(osc["IP"], osc["PORT"], out_dir=self.root_data_path / "gsr",
+                                   devices=osc.get("DEVICES") or None)
+                return self.osc.serve_async()
+
+            coroutines["osc"] = serve_osc
+        if coroutines:
+            self.workers.append(AsyncWorker("io", coroutines, stall_timeout=self.stall_timeout))
+
+    def _log_options(self) -> dict:
+        """queue size and overflow policy of the session logs, DATA_CAPTURE.WS.LOG_QUEUE / LOG_OVERFLOW"""
+        ws = self.config["DATA_CAPTURE"].get("WS", {})
+        return {"max_queue": ws.get("LOG_QUEUE", 10000), "overflow": ws.get("LOG_OVERFLOW", "spill")}
+
+    def log_writers(self) -> dict:
+        """name -> SessionLogWriter of every session log, e.g. for their queue counters"""
+        logs = {"Unity": self.ws_log, "markers": self.marker_log}
+        if self.ws_hub is not None:
+            logs.update(self.ws_hub.client_logs)
+        return {name: log for name, log in logs.items() if log is not None}
+
+    def _lsl_worker(self) -> ThreadWorker:
+        state = {}
+
+        def start(restart):
+            # imported here: LSL_ReceiveData pulls in the EEG module
+            from LSL.LSL_ReceiveData import LSLReceptor
+            from LSL.MarkerBridge import BrainflowSink, WebSocketLogSink
+            receptor = LSLReceptor(eeg=None, config=self.config)
+            receptor.start_receive_thread([BrainflowSink(self, receptor.markers.encode),
+                                           WebSocketLogSink(self.marker_log)])
+            state["receptor"] = receptor
+
+        def stop(timeout):
+            receptor = state.pop("receptor", None)
+            if receptor is not None:
+                receptor.close()
+
+        def alive():
+            receptor = state.get("receptor")
+            return receptor is not None and receptor.bridge is not None and receptor.bridge.is_alive()
+
+        return ThreadWorker("LSL", start, stop, alive)
+
+    def _sync_worker(self) -> ThreadWorker:
+        state = {}
+
+        def start(restart):
+            from EEG.sync_pulse import BoardMarkerSink, PulseFile, SessionLogSink, from_config
+            from LSL.MarkerRegistry import MarkerRegistry
+            registry = MarkerRegistry.from_config(self.config)
+            pulse_file = PulseFile(self.root_data_path / "eeg" / "sync_pulses.tsv")
+            generator = from_config(self.config, [BoardMarkerSink(self, registry.encode),
+                                                  SessionLogSink(self.marker_log), pulse_file])
+            generator.start()
+            state.update(generator=generator, pulse_file=pulse_file)
+
+        def stop(timeout):
+            generator = state.pop("generator", None)
+            if generator is not None:
+                generator.stop(timeout)
+                generator.backend.close()
+                state.pop("pulse_file").close()
+
+        def alive():
+            generator = state.get("generator")
+            return generator is not None and generator.is_alive()
+
+        return ThreadWorker("SYNC_PULSE", start, stop, alive)
+
+    def board(self, kind: str):
+        """the BoardProcess of a kind, e.g. orchestrator.board("EEG").latest_seconds(2) for live data"""
+        for worker in self.workers:
+            if isinstance(worker, BoardProcess) and worker.name == kind:
+                return worker
+        return None
+
+    def send_control(self, message, clients: list = None, roles: list = None):
+        """
+        send a control message (new trial, support figure, ...) to the websocket clients, from any thread
+        :param clients: client names, roles: client roles (see websocket.WebSocketHub), everyone if both None
+        """
+        if self.ws_hub is None:
+            logging.warning("websocket server isn't enabled, control message not sent")
+            return
+        self.ws_hub.send_threadsafe(message, clients, roles)
+
+    def _qc_worker(self) -> ThreadWorker:
+        state = {}
+
+        def start(restart):
+            from EEG.signal_quality import SignalQualityMonitor
+            qc = self.config["DATA_CAPTURE"]["QC"]
+            # reads the shared ring of the EEG process, which stays the same when that process restarts
+            monitor = SignalQualityMonitor.for_board(
+                self.board("EEG").latest_seconds, out_file=self.root_data_path / "eeg" / "qc.json",
+                window=qc.get("WINDOW", 2.0), interval=qc.get("INTERVAL", 0.5),
+                line_frequency=qc.get("LINE_FREQUENCY", 50.0), thresholds=qc.get("THRESHOLDS") or None)
+            monitor.start()
+            state["monitor"] = monitor
+
+        def stop(timeout):
+            monitor = state.pop("monitor", None)
+            if monitor is not None:
+                monitor.stop(timeout)
+
+        def alive():
+            monitor = state.get("monitor")
+            return monitor is not None and monitor.is_alive()
+
+        return ThreadWorker("EEG_QC", start, stop, alive)
+
+    def insert_marker(self, code: float):
+        """marker in every board stream (EEG and GSR), so LSL markers and sync pulses reach all of them"""
+        for worker in self.workers:
+            worker.insert_marker(code)
+
+    def start(self):
+        """start every worker and the supervisor, board processes connect in the background"""
+        logging.info("session clock started at {}".format(self.session_start.utc))
+        for worker in self.workers:
+            try:
+                worker.start()
+                logging.info("✓ {} started".format(worker.name))
+            except Exception as e:
+                # the supervisor will try again
+                logging.error("❌ {} didn't start: {}".format(worker.name, e))
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._supervise, name="Supervisor", daemon=True)
+        self._thread.start()
+        threading.Thread(target=self._release_boards, name="ReleaseBoards", daemon=True).start()
+        self.write_session_file()
+
+    def _release_boards(self):
+        """start streaming once every board is prepared (or failed, or timed out), so they start together"""
+        boards = [w for w in self.workers if isinstance(w, BoardProcess) and w.hold]
+        deadline = time.monotonic() + max((w.start_timeout for w in boards), default=0.0)
+        while not self._stop_event.is_set() and time.monotonic() < deadline:
+            for worker in boards:
+                worker._drain()
+            if not any(w.state == "starting" for w in boards):
+                break
+            time.sleep(0.05)
+        for worker in boards:
+            if worker.release():
+                logging.info("✓ {} streaming".format(worker.name))
+
+    def wait_started(self, timeout: float = 60.0) -> dict:
+        """wait until the board processes reported back, returns name -> state"""
+        deadline = time.monotonic() + timeout
+        boards = [w for w in self.workers if isinstance(w, BoardProcess)]
+        while time.monotonic() < deadline and any(w.state in ("starting", "prepared") for w in boards):
+            time.sleep(0.1)
+        return self.status()
+
+    def status(self) -> dict:
+        result = {}
+        for worker in self.workers:
+            state = getattr(worker, "state", None) or ("running" if worker.check() is None else "failing")
+            if worker.name in self.given_up:
+                state = "given up"
+            result[worker.name] = {"state": state, "restarts": worker.restarts}
+        return result
+
+    def _restart(self, worker: Worker, reason: str):
+        try:
+            logging.warning("⚠ {}: {}, restarting ({}/{})".format(worker.name, reason, worker.restarts + 1,
+                                                                  self.max_restarts))
+            try:
+                worker.stop(timeout=5.0)
+            except Exception as e:
+                logging.error("stopping {} failed: {}".format(worker.name, e))
+            worker.restarts += 1
+            if not self._stop_event.is_set():
+                worker.start(restart=True)
+            self.write_session_file()
+        except Exception as e:
+            logging.error("❌ restarting {} failed: {}".format(worker.name, e))
+        finally:
+            with self._lock:
+                self._restarting.discard(worker.name)
+
+    def _supervise(self):
+        while not self._stop_event.wait(self.check_interval):
+            for worker in self.workers:
+                with self._lock:
+                    if worker.name in self._restarting or worker.name in self.given_up:
+                        continue
+                try:
+                    reason = worker.check()
+                except Exception as e:
+                    reason = "check failed: {}".format(e)
+                if reason is None:
+                    continue
+                if worker.restarts >= self.max_restarts:
+                    logging.error("❌ {}: {}, giving up after {} restarts".format(worker.name, reason,
+                                                                                 worker.restarts))
+                    with self._lock:
+                        self.given_up.add(worker.name)
+                    continue
+                with self._lock:
+                    self._restarting.add(worker.name)
+                # on its own thread: stopping a hung board can take seconds, the others are checked meanwhile
+                threading.Thread(target=self._restart, args=(worker, reason), name="restart-{}".format(worker.name),
+                                 daemon=True).start()
+
+    def stop(self, timeout: float = 10.0):
+        """stop the supervisor, then all workers at the same time (I/O first, boards last)"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        order = sorted(self.workers, key=lambda w: isinstance(w, BoardProcess))
+        io_workers = [w for w in order if not isinstance(w, BoardProcess)]
+        boards = [w for w in order if isinstance(w, BoardProcess)]
+        for group in (io_workers, boards):
+            threads = [threading.Thread(target=self._stop_worker, args=(w, timeout), daemon=True) for w in group]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(timeout + 5.0)
+        for worker in self.workers:
+            worker.close()
+        if self.ws_hub is not None:
+            self.ws_hub.close()
+        for log in (self.marker_log, self.ws_log):
+            if log is not None:
+                log.close()
+        self.write_session_file()
+        logging.info("✓ all workers stopped")
+
+    @staticmethod
+    def _stop_worker(worker: Worker, timeout: float):
+        try:
+            worker.stop(timeout)
+        except Exception as e:
+            logging.error("stopping {} failed: {}".format(worker.name, e))
+
+    def write_session_file(self):
+        """session clock and the start / stop stamps of every worker in <session>/session.json"""
+        session = {
+            "session_start": _stamp_dict(self.session_start),
+            "workers": {w.name: {"restarts": w.restarts,
+                                 "events": [dict(_stamp_dict(stamp), event=event) for event, stamp in list(w.history)]}
+                        for w in self.workers},
+        }
+        if self.ws_hub is not None:
+            session["websocket_clients"] = self.ws_hub.stats()
+        try:
+            with open(self.root_data_path / "session.json", "w", encoding="utf-8") as f:
+                json.dump(session, f, indent=2)
+        except OSError as e:
+            logging.warning("could not write session.json: {}".format(e))
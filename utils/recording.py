@@ -0,0 +1,196 @@
+"""
+binary recording format for BrainFlow boards (Cyton EEG, EmotiBit GSR)
+
+a recording is two files next to each other:
+    <name>.bin   raw little-endian float64 samples, one sample (all board rows) after the other, so the
+                 file only ever grows and np.memmap(...).reshape(-1, num_rows) reads it without parsing
+    <name>.json  sidecar: board, preset, sampling rate, dtype and the channel map (name and type of every
+                 row) taken from BoardShim.get_board_descr
+
+the sample count isn't stored anywhere, it follows from the file size. After a crash only the last,
+partially written sample can be damaged, recover() (called automatically when a recording is reopened)
+cuts it off. to_csv() writes the tab separated layout the BrainFlow file streamer used to produce.
+"""
+import argparse
+import json
+import logging
+import os
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+from brainflow.board_shim import BoardShim, BrainFlowPresets
+
+DTYPE = np.dtype("<f8")
+BIN_SUFFIX = ".bin"
+META_SUFFIX = ".json"
+
+
+def channel_map(board_id: int, preset: BrainFlowPresets = BrainFlowPresets.DEFAULT_PRESET) -> list:
+    """
+    name and type of every row a board delivers, e.g. {"row": 1, "name": "Fp1", "type": "eeg"}
+    rows that belong to several types (Cyton's exg rows are eeg, emg, ecg, ...) are typed eeg, other
+    shared rows get the first type found
+    """
+    descr = BoardShim.get_board_descr(board_id, preset)
+    rows = [{"row": i, "name": None, "type": None} for i in range(descr["num_rows"])]
+    eeg_names = descr.get("eeg_names", "").split(",") if descr.get("eeg_names") else []
+    for key, value in descr.items():
+        if key.endswith("_channel") and isinstance(value, int):
+            kind = key[:-len("_channel")]
+            rows[value]["type"] = rows[value]["type"] or kind
+            rows[value]["name"] = rows[value]["name"] or kind
+        elif key.endswith("_channels") and isinstance(value, list):
+            kind = key[:-len("_channels")]
+            for n, row in enumerate(value):
+                if rows[row]["type"] is None:
+                    rows[row]["type"] = kind
+                    rows[row]["name"] = "{}_{}".format(kind, n + 1)
+    for n, row in enumerate(descr.get("eeg_channels", [])):
+        rows[row]["type"] = "eeg"
+        rows[row]["name"] = eeg_names[n] if n < len(eeg_names) else "eeg_{}".format(n + 1)
+    for row in rows:
+        row["type"] = row["type"] or "other"
+        row["name"] = row["name"] or "row_{}".format(row["row"])
+    return rows
+
+
+def channel_names(board_id: int, preset: BrainFlowPresets = BrainFlowPresets.DEFAULT_PRESET) -> list:
+    """one header name per board row, in row order"""
+    return [row["name"] for row in channel_map(board_id, preset)]
+
+
+def _paths(path):
+    path = Path(path)
+    if path.suffix in (BIN_SUFFIX, META_SUFFIX):
+        path = path.with_suffix("")
+    return path.with_suffix(BIN_SUFFIX), path.with_suffix(META_SUFFIX)
+
+
+def recover(path) -> int:
+    """
+    cut off a partially written trailing sample (left behind by a crash)
+    :return: number of complete samples in the recording
+    """
+    bin_file, meta_file = _paths(path)
+    with open(meta_file, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    sample_size = meta["num_rows"] * DTYPE.itemsize
+    size = bin_file.stat().st_size if bin_file.exists() else 0
+    if size % sample_size:
+        logging.warning("{}: cutting off {} bytes of an incomplete sample".format(bin_file, size % sample_size))
+        with open(bin_file, "r+b") as f:
+            f.truncate(size - size % sample_size)
+    return size // sample_size
+
+
+class BinaryRecorder:
+    """append-only writer of a binary recording, feed it (rows x n) chunks from get_board_data"""
+
+    def __init__(self, path, board_id: int = None, preset: BrainFlowPresets = BrainFlowPresets.DEFAULT_PRESET,
+                 fsync_interval: int = 0, meta: dict = None):
+        """
+        :param path: recording path without suffix, e.g. data/<playtime>/eeg/eeg
+        :param board_id: BrainFlow board id, used for the channel map
+        :param preset: BrainFlow preset this recording holds
+        :param fsync_interval: force the data to disk every n chunks (0: leave it to the OS)
+        :param meta: sidecar for data that doesn't come from a board (e.g. OSC), instead of board_id,
+            needs at least num_rows and channels
+        """
+        self.bin_file, self.meta_file = _paths(path)
+        self.fsync_interval = fsync_interval
+        self._chunks = 0
+        if self.meta_file.exists() and self.bin_file.exists():
+            # reopening an existing recording (e.g. after a crash): keep appending
+            with open(self.meta_file, "r", encoding="utf-8") as f:
+                self.meta = json.load(f)
+            self.samples = recover(self.bin_file)
+        elif meta is not None:
+            self.meta = dict(meta, dtype=DTYPE.str, layout="samples x rows", created=datetime.now().isoformat())
+            self._write_meta()
+            self.samples = 0
+        else:
+            self.meta = {
+                "board_id": int(board_id),
+                "preset": int(preset),
+                "sampling_rate": BoardShim.get_sampling_rate(board_id, preset),
+                "num_rows": BoardShim.get_num_rows(board_id, preset),
+                "dtype": DTYPE.str,
+                "layout": "samples x rows",
+                "created": datetime.now().isoformat(),
+                "channels": channel_map(board_id, preset),
+            }
+            self._write_meta()
+            self.samples = 0
+        self.num_rows = self.meta["num_rows"]
+        self._f = open(self.bin_file, "ab")
+
+    def _write_meta(self):
+        with open(self.meta_file, "w", encoding="utf-8") as f:
+            json.dump(self.meta, f, indent=2)
+
+    def write(self, chunk: np.ndarray):
+        """append a (rows x n) chunk as delivered by BoardShim.get_board_data"""
+        if chunk.shape[0] != self.num_rows:
+            raise ValueError("expected {} rows, got {}".format(self.num_rows, chunk.shape[0]))
+        if chunk.shape[1] == 0:
+            return
+        self._f.write(np.ascontiguousarray(chunk.T, dtype=DTYPE).tobytes())
+        self.samples += chunk.shape[1]
+        self._chunks += 1
+        if self.fsync_interval and self._chunks % self.fsync_interval == 0:
+            self.flush(sync=True)
+
+    def flush(self, sync: bool = False):
+        self._f.flush()
+        if sync:
+            os.fsync(self._f.fileno())
+
+    def close(self):
+        if not self._f.closed:
+            self.flush(sync=True)
+            self._f.close()
+
+    # so a recorder can be used directly as BoardPoller listener
+    __call__ = write
+
+
+def open_recording(path):
+    """
+    memory-map a recording
+    :return: (data, meta), data is a read-only (samples x rows) np.memmap
+    """
+    bin_file, meta_file = _paths(path)
+    with open(meta_file, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    num_rows = meta["num_rows"]
+    samples = bin_file.stat().st_size // (num_rows * DTYPE.itemsize)
+    if samples == 0:
+        return np.zeros((0, num_rows), dtype=DTYPE), meta
+    data = np.memmap(bin_file, dtype=np.dtype(meta.get("dtype", DTYPE.str)), mode="r", shape=(samples, num_rows))
+    return data, meta
+
+
+def to_csv(path, csv_file=None, chunk_samples: int = 100_000) -> Path:
+    """
+    convert a recording to the tab separated text the BrainFlow file streamer writes, with a header
+    that matches the rows (streamed in chunks, memory stays flat)
+    :return: the written csv file
+    """
+    data, meta = open_recording(path)
+    csv_file = Path(csv_file) if csv_file is not None else _paths(path)[0].with_suffix(".csv")
+    header = "\t".join(row["name"] for row in meta["channels"])
+    with open(csv_file, "w", newline="") as f:
+        f.write(header + "\n")
+        for start in range(0, data.shape[0], chunk_samples):
+            np.savetxt(f, data[start:start + chunk_samples], fmt="%.6f", delimiter="\t")
+    return csv_file
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="convert binary recordings (.bin + .json) to csv")
+    parser.add_argument("recordings", nargs="+", help="recording paths, with or without .bin suffix")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    for recording in args.recordings:
+        logging.info("✓ {}".format(to_csv(recording)))
@@ -0,0 +1,183 @@
+"""
+converter for the legacy websocket.csv session logs (data/<playtime>/websocket/websocket.csv)
+
+legacy lines come in a few shapes:
+    time: 1678374012, {"trialNumber":0,"websocketMessage":"gaze",...}
+    time: 1678373874, time: 1678373874, message: Android application is closing
+    time: 1678374012, monotonic_ns: 5220, utc: 2023-03-09T15:00:12.000000+00:00, lsl: 12.5, {...}
+    {"trialNumber":0,"websocketMessage":"gaze",...}                 (no prefix at all)
+
+files are streamed line by line, so memory stays bounded no matter how long the session was. For
+every session we write, in <session>/websocket/converted/:
+    websocket.jsonl         every line as a structured record (see websocket.SessionFormat)
+    gaze.csv, PlayerBallScore.csv, scene.csv, connect.csv    typed tables
+    index.json              per trial and event type: count, first/last source line and table rows
+"""
+import argparse
+import csv
+import json
+import logging
+import re
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from utils.clock import ReceiveStamp
+from websocket.SessionFormat import CONNECT, UNPARSED, dump_record, to_record
+
+PREFIX = re.compile(r"^(time|monotonic_ns|utc|lsl): ([^,]*), ")
+LEGACY_LOG = Path("websocket") / "websocket.csv"
+CONVERTED_DIR = "converted"
+
+# websocketMessage -> (table name, columns)
+TABLES = {
+    "gaze": ("gaze", ["line", "recv_wall_ns", "trialNumber", "unity_time", "targetName", "gazeStart"]),
+    "PlayerBallScore": ("PlayerBallScore", ["line", "recv_wall_ns", "trialNumber", "unity_time", "player",
+                                            "realPlayer", "hit"]),
+    "switch scene to": ("scene", ["line", "recv_wall_ns", "trialNumber", "unity_time", "newScene"]),
+    CONNECT: ("connect", ["line", "recv_wall_ns", "unity_time_text", "connectMessage"]),
+}
+
+
+def parse_legacy_line(line: str):
+    """
+    split a legacy log line in its receive stamp and the message Unity sent
+    :return: (ReceiveStamp, message), the stamp fields are None when the line didn't carry them
+    """
+    fields = {}
+    rest = line.rstrip("\r\n")
+    match = PREFIX.match(rest)
+    while match:
+        # doubled prefixes ("time: X, time: X, ...") repeat the same value, keep the first
+        fields.setdefault(match.group(1), match.group(2))
+        rest = rest[match.end():]
+        match = PREFIX.match(rest)
+
+    def number(key, cast):
+        try:
+            return cast(fields[key])
+        except (KeyError, ValueError):
+            return None
+
+    seconds = number("time", int)
+    wall_ns = seconds * 1_000_000_000 if seconds is not None else None
+    lsl = number("lsl", float)
+    stamp = ReceiveStamp(number("monotonic_ns", int), wall_ns, lsl if lsl == lsl else None)
+    return stamp, rest
+
+
+class _TableWriter:
+    """appends rows to one typed csv table, keeps track of the row count"""
+
+    def __init__(self, file: Path, columns: list):
+        self.rows = 0
+        self._f = open(file, "w", newline="", encoding="utf-8")
+        self._writer = csv.DictWriter(self._f, fieldnames=columns, extrasaction="ignore")
+        self._writer.writeheader()
+
+    def write(self, record: dict) -> int:
+        self._writer.writerow(record)
+        self.rows += 1
+        return self.rows - 1
+
+    def close(self):
+        self._f.close()
+
+
+def convert_session(log_file, out_dir=None) -> dict:
+    """
+    convert one legacy websocket.csv into structured and typed files, streaming line by line
+    :param log_file: path to the legacy websocket.csv
+    :param out_dir: output directory, defaults to a "converted" folder next to the log
+    :return: the session index, also written to index.json
+    """
+    log_file = Path(log_file)
+    out_dir = Path(out_dir) if out_dir is not None else log_file.parent / CONVERTED_DIR
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    tables = {}
+    index = {"source": str(log_file), "lines": 0, "events": {}, "trials": {}}
+    try:
+        with open(log_file, "r", encoding="utf-8", errors="replace") as src, \
+                open(out_dir / "websocket.jsonl", "w", encoding="utf-8") as jsonl:
+            for line_number, line in enumerate(src, start=1):
+                if not line.strip():
+                    continue
+                stamp, message = parse_legacy_line(line)
+                record = to_record(message, stamp)
+                jsonl.write(dump_record(record))
+                jsonl.write("\n")
+                record["line"] = line_number
+                event = record["websocketMessage"]
+                index["lines"] += 1
+                index["events"][event] = index["events"].get(event, 0) + 1
+
+                row = None
+                if event in TABLES:
+                    if event not in tables:
+                        name, columns = TABLES[event]
+                        tables[event] = _TableWriter(out_dir / "{}.csv".format(name), columns)
+                    row = tables[event].write(record)
+
+                trial = record.get("trialNumber")
+                trial_key = "none" if trial is None else str(trial)
+                entry = index["trials"].setdefault(trial_key, {}).get(event)
+                if entry is None:
+                    entry = {"count": 0, "first_line": line_number, "first_row": row}
+                    index["trials"][trial_key][event] = entry
+                entry["count"] += 1
+                entry["last_line"] = line_number
+                entry["last_row"] = row
+    finally:
+        for table in tables.values():
+            table.close()
+
+    index["tables"] = {event: TABLES[event][0] + ".csv" for event in tables}
+    with open(out_dir / "index.json", "w", encoding="utf-8") as f:
+        json.dump(index, f, indent=2)
+    return index
+
+
+def find_sessions(root) -> list:
+    """all legacy logs below a data root laid out as <root>/<playtime>/websocket/websocket.csv"""
+    return sorted(p for p in Path(root).glob(str(Path("*") / LEGACY_LOG)) if p.is_file())
+
+
+def _convert_worker(log_file: str):
+    index = convert_session(log_file)
+    return log_file, index["lines"], index["events"].get(UNPARSED, 0)
+
+
+def convert_sessions(log_files, workers: int = None) -> dict:
+    """
+    convert many sessions in parallel, one process per session
+    :param log_files: paths to legacy websocket.csv files, see find_sessions()
+    :param workers: number of processes, defaults to the number of CPUs
+    :return: dict of log file -> number of converted lines, None for sessions that failed
+    """
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(_convert_worker, str(f)): str(f) for f in log_files}
+        for future in as_completed(futures):
+            log_file = futures[future]
+            try:
+                _, lines, unparsed = future.result()
+                results[log_file] = lines
+                logging.info("✓ {}: {} lines ({} not JSON)".format(log_file, lines, unparsed))
+            except Exception as e:
+                results[log_file] = None
+                logging.error("❌ could not convert {}: {}".format(log_file, e))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="convert legacy websocket.csv session logs")
+    parser.add_argument("root", help="data root containing <playtime>/websocket/websocket.csv folders, "
+                                     "or a single websocket.csv")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    root = Path(args.root)
+    sessions = [root] if root.is_file() else find_sessions(root)
+    logging.info("converting {} session(s)".format(len(sessions)))
+    convert_sessions(sessions, workers=args.workers)
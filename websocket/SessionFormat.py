@@ -0,0 +1,184 @@
+"""
+structured session log: one JSON object per line (NDJSON) with typed receive fields, followed by the
+fields Unity sent. Loading a session is a single pd.read_json(lines=True) call, no regex per line.
+
+record layout:
+    recv_monotonic_ns   int     time.monotonic_ns() at receive, null for converted legacy logs
+    recv_wall_ns        int     time.time_ns() at receive, second resolution for converted legacy logs
+    recv_utc            str     ISO 8601 UTC at receive
+    recv_lsl            float   pylsl.local_clock() at receive, null without liblsl
+    client              str     "ip:port" of the sender, null if unknown
+    websocketMessage    str     event type, see event_type()
+    trialNumber         int     null for messages outside a trial
+    unity_time          float   numeric Unity "_time" (s since scene load), null otherwise
+    unity_time_text     str     textual Unity "_time" (sent with connectMessage)
+    raw                 str     original text for messages that are not a JSON object
+    ...                         all other fields Unity sent (targetName, gazeStart, player, hit, ...)
+"""
+import argparse
+import json
+import logging
+from pathlib import Path
+
+import pandas as pd
+
+from utils.clock import ReceiveStamp
+from websocket.SessionLogWriter import format_log_entry
+
+CONNECT = "connect"
+UNPARSED = "unparsed"
+RESERVED_FIELDS = ("recv_monotonic_ns", "recv_wall_ns", "recv_utc", "recv_lsl", "client", "websocketMessage",
+                   "trialNumber", "unity_time", "unity_time_text", "raw")
+DTYPES = {
+    "recv_monotonic_ns": "Int64",
+    "recv_wall_ns": "Int64",
+    "recv_lsl": "float64",
+    "trialNumber": "Int64",
+    "unity_time": "float64",
+    "gazeStart": "boolean",
+    "realPlayer": "boolean",
+    "hit": "boolean",
+}
+
+
+def event_type(payload: dict) -> str:
+    """websocketMessage if Unity sent one, 'connect' for the connectMessage greeting"""
+    if "websocketMessage" in payload:
+        return str(payload["websocketMessage"])
+    if "connectMessage" in payload:
+        return CONNECT
+    return UNPARSED
+
+
+def to_record(message, stamp: ReceiveStamp, client: str = None) -> dict:
+    """
+    turn a raw Unity message into a flat, typed session record
+    :param message: the message as received (str or bytes)
+    :param stamp: receive stamp taken as soon as the message arrived
+    :param client: identification of the sender, usually "ip:port"
+    """
+    if isinstance(message, bytes):
+        message = message.decode("utf-8", errors="replace")
+    record = {
+        "recv_monotonic_ns": stamp.monotonic_ns,
+        "recv_wall_ns": stamp.wall_ns,
+        "recv_utc": stamp.utc if stamp.wall_ns is not None else None,
+        "recv_lsl": stamp.lsl,
+        "client": client,
+    }
+    try:
+        payload = json.loads(message)
+    except ValueError:
+        payload = None
+    if not isinstance(payload, dict):
+        record.update(websocketMessage=UNPARSED, trialNumber=None, raw=message)
+        return record
+
+    unity_time = payload.pop("_time", None)
+    record["websocketMessage"] = event_type(payload)
+    payload.pop("websocketMessage", None)
+    record["trialNumber"] = payload.pop("trialNumber", None)
+    if isinstance(unity_time, (int, float)) and not isinstance(unity_time, bool):
+        record["unity_time"] = float(unity_time)
+    elif unity_time is not None:
+        record["unity_time_text"] = str(unity_time)
+    for key, value in payload.items():
+        # never let a Unity field overwrite one of our own columns
+        record["unity_" + key if key in RESERVED_FIELDS else key] = value
+    return record
+
+
+def dump_record(record: dict) -> str:
+    """a session record as one compact NDJSON line (without newline)"""
+    return json.dumps(record, ensure_ascii=False, separators=(",", ":"))
+
+
+def format_record_line(message, stamp: ReceiveStamp, client: str = None) -> str:
+    """SessionLogWriter formatter producing one NDJSON line"""
+    return dump_record(to_record(message, stamp, client))
+
+
+LOG_FORMATS = {
+    "ndjson": format_record_line,
+    "text": format_log_entry,
+}
+
+
+def client_id(websocket) -> str:
+    """"ip:port" of a websocket connection, None if the transport doesn't know it"""
+    address = websocket.remote_address
+    if not address:
+        return None
+    return "{}:{}".format(address[0], address[1])
+
+
+def read_session(file) -> pd.DataFrame:
+    """
+    load a NDJSON session log in one vectorised read
+    :param file: path to the .jsonl session log
+    :return: one row per message, typed columns as described at the top of this module
+    """
+    df = pd.read_json(file, lines=True, dtype=False, convert_dates=False)
+    for column, dtype in DTYPES.items():
+        if column in df.columns:
+            df[column] = df[column].astype(dtype)
+    if "recv_utc" in df.columns:
+        df["recv_utc"] = pd.to_datetime(df["recv_utc"], utc=True, format="ISO8601")
+    return df
+
+
+def _file_name(event) -> str:
+    return "".join(c if c.isalnum() or c in "-_" else "_" for c in str(event))
+
+
+def export_columnar(file, out_dir=None, fmt: str = "parquet") -> dict:
+    """
+    write a session log as columnar files, one per websocketMessage type: <out_dir>/<type>.parquet
+    (or .arrow for Arrow IPC). Both formats need pyarrow next to pandas.
+    :param file: path to the .jsonl session log
+    :param out_dir: output directory, defaults to a "columnar" folder next to the log
+    :param fmt: "parquet" or "arrow"
+    :return: dict of event type -> written file
+    """
+    if fmt not in ("parquet", "arrow"):
+        raise ValueError("unknown columnar format {}, use 'parquet' or 'arrow'".format(fmt))
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        raise ImportError("columnar export needs pyarrow, install it with 'pip install pyarrow'")
+
+    file = Path(file)
+    out_dir = Path(out_dir) if out_dir is not None else file.parent / "columnar"
+    out_dir.mkdir(parents=True, exist_ok=True)
+    df = read_session(file)
+    written = {}
+    for event, part in df.groupby("websocketMessage", sort=False):
+        part = part.dropna(axis="columns", how="all").reset_index(drop=True)
+        target = out_dir / "{}.{}".format(_file_name(event), fmt)
+        if fmt == "parquet":
+            part.to_parquet(target, index=False)
+        else:
+            part.to_feather(target)
+        written[event] = target
+        logging.info("exported {} {} events to {}".format(len(part), event, target))
+    return written
+
+
+def read_columnar(out_dir, event: str, columns: list = None) -> pd.DataFrame:
+    """load the events of one type written by export_columnar(), optionally only some columns"""
+    out_dir = Path(out_dir)
+    name = _file_name(event)
+    parquet = out_dir / "{}.parquet".format(name)
+    if parquet.exists():
+        return pd.read_parquet(parquet, columns=columns)
+    return pd.read_feather(out_dir / "{}.arrow".format(name), columns=columns)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="export a websocket session log to columnar files")
+    parser.add_argument("file", help="the websocket.jsonl session log")
+    parser.add_argument("--out", default=None, help="output directory (default: <log dir>/columnar)")
+    parser.add_argument("--format", default="parquet", choices=["parquet", "arrow"])
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    export_columnar(args.file, args.out, args.format)
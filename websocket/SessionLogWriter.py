@@ -0,0 +1,315 @@
+import asyncio
+import atexit
+import collections
+import logging
+import os
+import pickle
+import tempfile
+import threading
+import time
+from typing import Callable
+
+from utils.clock import ReceiveStamp
+
+_STOP = object()
+OVERFLOW_POLICIES = ("block", "drop-oldest", "spill")
+
+
+def format_log_entry(message, stamp: ReceiveStamp = None, client: str = None) -> str:
+    """
+    legacy text format: prefix a received message with its receive time on every clock we have, the
+    leading "time: <unix seconds>" is kept so older scripts reading the log still work
+    :param message: the raw message as received from Unity
+    :param stamp: result of utils.clock.stamp_now(), taken as soon as the message arrived
+    :param client: unused, the text format has no sender column
+    """
+    if stamp is None:
+        return str(message)
+    lsl = "nan" if stamp.lsl is None else "{:.6f}".format(stamp.lsl)
+    return "time: {}, monotonic_ns: {}, utc: {}, lsl: {}, {}".format(
+        stamp.unix_time, stamp.monotonic_ns, stamp.utc, lsl, message)
+
+
+class SessionLogWriter:
+    """
+    Long-lived, buffered writer for the websocket session log.
+
+    Lines are put on an in-memory queue and written to disk by a background thread, so the asyncio
+    handler never blocks on file I/O. The buffer is written out as soon as it holds ``max_batch``
+    lines or when ``flush_interval`` seconds have passed since the first pending line.
+    One writer is shared by all connections of a session.
+    Formatting (JSON parsing for the structured log) also happens on the writer thread.
+
+    The queue holds at most ``max_queue`` messages, when the disk doesn't keep up (a slow USB drive) the
+    ``overflow`` policy decides what happens to the next message:
+
+    - ``"block"``: wait for room, write_async() waits on another thread so the websocket connection stops
+      reading and the sender is slowed down instead of the event loop
+    - ``"drop-oldest"``: the oldest queued message is thrown away (counted in ``dropped``)
+    - ``"spill"``: the message goes to a temporary file on the local disk (counted in ``spilled``), as do
+      all following ones until the writer thread has caught up and copied the file into the log, so the
+      order is kept
+    """
+
+    def __init__(self, file, formatter: Callable = format_log_entry, max_batch: int = 256,
+                 flush_interval: float = 0.5, max_queue: int = 10000, overflow: str = "spill", spill_dir=None):
+        """
+        :param file: path of the session log, opened once in append mode
+        :param formatter: formatter(message, stamp, client) -> line, see websocket.SessionFormat
+        :param max_batch: number of pending lines that triggers a write
+        :param flush_interval: maximum time (s) a line stays in memory before it is written
+        :param max_queue: messages waiting for the disk at most
+        :param overflow: what to do with a message when the queue is full, one of OVERFLOW_POLICIES
+        :param spill_dir: folder of the spill files, the system temp folder if None
+        """
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError("unknown overflow policy {}, use one of {}".format(overflow, ", ".join(OVERFLOW_POLICIES)))
+        self.file = file
+        self.formatter = formatter
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.overflow = overflow
+        self.spill_dir = spill_dir
+        self._items = collections.deque()  # messages plus flush / stop requests, in order
+        self._queued = 0  # messages in _items
+        self._spill = None  # spill file being filled
+        self._cond = threading.Condition()
+        self.received = 0  # messages handed to write() so far (not necessarily on disk yet), e.g. for a message rate
+        self.dropped = 0
+        self.spilled = 0
+        self.blocked = 0  # writes that had to wait for room
+        self._closed = False
+        self._lock = threading.Lock()
+        self._f = open(file, 'a+', encoding='utf-8')
+        self._thread = threading.Thread(target=self._run, name="SessionLogWriter", daemon=True)
+        self._thread.start()
+        # make sure nothing stays in memory if the application exits without calling close()
+        atexit.register(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def queued(self) -> int:
+        """messages waiting for the disk, in memory and in the spill file"""
+        return self._queued + (self._spill.count if self._spill is not None else 0)
+
+    def stats(self) -> dict:
+        return {"received": self.received, "queued": self.queued, "dropped": self.dropped,
+                "spilled": self.spilled, "blocked": self.blocked}
+
+    def write(self, message, stamp: ReceiveStamp = None, client: str = None):
+        """
+        queue a single message, only blocks when the queue is full and the overflow policy is "block"
+        :param message: the message as received
+        :param stamp: receive stamp, taken as soon as the message arrived
+        :param client: identification of the sender, usually "ip:port"
+        """
+        if self._closed:
+            logging.warning("session log {} is closed, dropping message".format(self.file))
+            return
+        item = (message, stamp, client)
+        with self._cond:
+            self.received += 1
+            if self._spill is not None:
+                # the writer thread hasn't taken the spill file yet, keep the order
+                self._spill_item(item)
+                return
+            if self._queued >= self.max_queue:
+                if self.overflow == "spill":
+                    self._spill_item(item)
+                    return
+                if self.overflow == "drop-oldest":
+                    self._drop_oldest()
+                else:
+                    self.blocked += 1
+                    while self._queued >= self.max_queue and not self._closed and self._thread.is_alive():
+                        self._cond.wait(0.5)
+                    if self._closed or not self._thread.is_alive():
+                        self._count("dropped", "writer stopped")
+                        return
+            self._items.append(item)
+            self._queued += 1
+            self._cond.notify_all()
+
+    async def write_async(self, message, stamp: ReceiveStamp = None, client: str = None):
+        """write() for the event loop: a "block" on a full queue is waited out on another thread"""
+        if self.overflow == "block" and self._queued >= self.max_queue:
+            await asyncio.to_thread(self.write, message, stamp, client)
+        else:
+            self.write(message, stamp, client)
+
+    def _count(self, counter: str, reason: str):
+        """count a dropped / spilled message, with a warning at the 1st, 10th, 100th, ..."""
+        n = getattr(self, counter) + 1
+        setattr(self, counter, n)
+        if str(n).rstrip("0") == "1":
+            logging.warning("⚠ session log {}: {} {} message(s) ({})".format(self.file, counter, n, reason))
+
+    def _drop_oldest(self):
+        for i, item in enumerate(self._items):
+            if isinstance(item, tuple):
+                del self._items[i]
+                self._queued -= 1
+                self._count("dropped", "queue full")
+                return
+
+    def _spill_item(self, item):
+        if self._spill is None:
+            self._spill = _SpillFile(self.spill_dir)
+        self._spill.add(item)
+        self._count("spilled", "queue full, disk too slow")
+
+    def _put_control(self, item):
+        with self._cond:
+            self._items.append(item)
+            self._cond.notify_all()
+
+    def _format(self, item) -> str:
+        message, stamp, client = item
+        try:
+            return "{}\n".format(self.formatter(message, stamp, client))
+        except Exception as e:
+            # a single odd message must never stop the log, keep it as plain text
+            logging.warning("could not format message for {}: {}".format(self.file, e))
+            return "{}\n".format(message)
+
+    def flush(self, timeout: float = None) -> bool:
+        """
+        write out everything queued so far and wait until it is on disk
+        :param timeout: maximum time to wait (s), None waits indefinitely
+        :return: True when the flush completed in time
+        """
+        if self._closed:
+            return True
+        done = threading.Event()
+        self._put_control(done)
+        return done.wait(timeout)
+
+    def close(self, timeout: float = 5.0):
+        """flush all pending lines, stop the writer thread and close the file"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        atexit.unregister(self.close)
+        self._put_control(_STOP)
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logging.warning("session log writer for {} did not stop in time".format(self.file))
+
+    def _write_batch(self, batch):
+        if batch:
+            self._f.write("".join(batch))
+            batch.clear()
+        self._f.flush()
+
+    def _get(self, timeout: float = None):
+        """
+        next queued item, the spill file once the messages before it are taken, None after timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                if self._spill is not None and self._queued == 0:
+                    # the messages in memory were older, the flush / stop requests left can wait for it
+                    spill, self._spill = self._spill, None
+                    return spill
+                if self._items:
+                    item = self._items.popleft()
+                    if isinstance(item, tuple):
+                        self._queued -= 1
+                        self._cond.notify_all()  # room for a blocked write()
+                    return item
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+
+    def _write_spill(self, spill, batch):
+        for item in spill.items():
+            batch.append(self._format(item))
+            if len(batch) >= self.max_batch:
+                self._write_batch(batch)
+
+    def _run(self):
+        batch = []
+        deadline = None
+        try:
+            while True:
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                item = self._get(timeout)
+                if item is None:
+                    self._write_batch(batch)
+                    deadline = None
+                    continue
+
+                if item is _STOP:
+                    break
+                if isinstance(item, threading.Event):
+                    self._write_batch(batch)
+                    deadline = None
+                    item.set()
+                    continue
+                if isinstance(item, _SpillFile):
+                    self._write_spill(item, batch)
+                    self._write_batch(batch)
+                    deadline = None
+                    continue
+
+                batch.append(self._format(item))
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+                if len(batch) >= self.max_batch:
+                    self._write_batch(batch)
+                    deadline = None
+        except Exception as e:
+            logging.error("session log writer for {} failed: {}".format(self.file, e))
+        finally:
+            # drain whatever is still queued, release anyone waiting on a flush
+            with self._cond:
+                items, self._items, self._queued = list(self._items), collections.deque(), 0
+                spill, self._spill = self._spill, None
+                self._cond.notify_all()
+            try:
+                for item in items:
+                    if isinstance(item, threading.Event):
+                        item.set()
+                    elif isinstance(item, tuple):
+                        batch.append(self._format(item))
+                if spill is not None:
+                    self._write_spill(spill, batch)
+                self._write_batch(batch)
+                self._f.close()
+            except Exception as e:
+                logging.error("could not close session log {}: {}".format(self.file, e))
+
+
+class _SpillFile:
+    """messages that didn't fit in the queue, pickled to a temporary file until the writer gets to them"""
+
+    def __init__(self, folder=None):
+        self._f = tempfile.NamedTemporaryFile(prefix="sessionlog_", suffix=".spill", dir=folder, delete=False)
+        self.count = 0
+
+    def add(self, item):
+        pickle.dump(item, self._f, protocol=pickle.HIGHEST_PROTOCOL)
+        self.count += 1
+
+    def items(self):
+        """all spilled messages in order, the file is removed afterwards"""
+        try:
+            self._f.flush()
+            self._f.seek(0)
+            while True:
+                try:
+                    yield pickle.load(self._f)
+                except EOFError:
+                    break
+        finally:
+            self._f.close()
+            os.unlink(self._f.name)
@@ -0,0 +1,227 @@
+"""
+keeps track of every websocket client of a session (Unity, a second headset, an observer) and of what
+they send and get
+
+clients name themselves in the url, ws://<ip>:<port>/?client=headset2&role=observer, otherwise their ip
+address is the name (the port changes on every reconnect, the ip doesn't). A reconnect under the same name
+is the same client with a new connection number, so its events stay together in the log. A second
+connection under a name that is still connected (Unity and an observer on the same pc) gets <name>-2.
+
+received messages are written with the client name in the "client" field of the session log, and with
+split=True also to websocket_<name>.jsonl per client.
+
+messages to clients (the initialisation messages on connect, control messages like a new trial or support
+figure) go through a send queue per client of at most send_queue messages, sent by a task of that
+client. A client that doesn't keep up only fills its own queue: when it's full the oldest message is
+dropped (and counted), the other clients don't wait for it.
+"""
+import asyncio
+import collections
+import functools
+import logging
+import re
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+import websockets
+
+from utils.clock import stamp_now
+from websocket.SessionFormat import LOG_FORMATS
+from websocket.SessionLogWriter import SessionLogWriter
+
+UNITY = "unity"
+
+
+class HubClient:
+    """one named client, its current connection and its send queue"""
+
+    def __init__(self, name: str, role: str, send_queue: int):
+        self.name = name
+        self.role = role
+        self.websocket = None
+        self.address = None
+        self.connections = 0
+        self.received = 0
+        self.sent = 0
+        self.dropped = 0
+        self.send_queue = send_queue
+        # not an asyncio.Queue: the hub outlives a restart of the server on a new event loop
+        self.queue = collections.deque()
+        self._wakeup = None  # event of the current sender, on the loop it runs on
+
+    @property
+    def connected(self) -> bool:
+        return self.websocket is not None
+
+    def put(self, message: str):
+        """queue a message, dropping the oldest one when the queue is full (on the hub's loop)"""
+        if len(self.queue) >= self.send_queue:
+            self.queue.popleft()
+            self.dropped += 1
+        self.queue.append(message)
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _send_loop(self, websocket):
+        self._wakeup = asyncio.Event()
+        while True:
+            if not self.queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            message = self.queue.popleft()
+            try:
+                await websocket.send(message)
+            except asyncio.CancelledError:
+                # the connection is going away while this message was on its way, keep it for the next one
+                self.queue.appendleft(message)
+                raise
+            except websockets.exceptions.ConnectionClosed:
+                # the next connection of this client sends it first
+                self.queue.appendleft(message)
+                return
+            self.sent += 1
+
+    def stats(self) -> dict:
+        return {"role": self.role, "connected": self.connected, "address": self.address,
+                "connections": self.connections, "received": self.received, "sent": self.sent,
+                "queued": len(self.queue), "dropped": self.dropped}
+
+
+def _sender_done(name: str, task: asyncio.Task):
+    """a sender that fails leaves its client without params and control messages, say so"""
+    if not task.cancelled() and task.exception() is not None:
+        logging.error(f"❌ sending to {name} failed: {task.exception()!r}")
+
+
+def _request_path(websocket) -> str:
+    """request path of a connection, for both the new (websockets >= 13) and the legacy server"""
+    request = getattr(websocket, "request", None)
+    return getattr(request, "path", None) or getattr(websocket, "path", "") or ""
+
+
+class WebSocketHub:
+    """the clients of a session, see the module docstring"""
+
+    def __init__(self, params: list = None, writer: SessionLogWriter = None, out_dir=None, split: bool = False,
+                 send_queue: int = 100, log_format: str = "ndjson", encode=str, log_options: dict = None):
+        """
+        :param params: messages every client gets when it connects (player, starting support, ...)
+        :param writer: the session log every received message goes to
+        :param out_dir: folder of the per client logs
+        :param split: also write a log per client, websocket_<name>.jsonl in out_dir
+        :param send_queue: messages waiting per client at most
+        :param encode: turns a message (dict) into text, str() is what Unity has always been sent,
+            json.dumps for clients that want strict JSON
+        :param log_options: SessionLogWriter options of the per client logs (max_queue, overflow, ...)
+        """
+        self.params = params or []
+        self.writer = writer
+        self.out_dir = Path(out_dir) if out_dir is not None else None
+        self.split = split and self.out_dir is not None
+        self.send_queue = send_queue
+        self.log_format = log_format
+        self.encode = encode
+        self.log_options = log_options or {}
+        self.clients = {}
+        self.client_logs = {}
+        self._loop = None
+
+    def identify(self, websocket):
+        """(name, role) of a new connection, from ?client=...&role=... or the ip address"""
+        query = parse_qs(urlparse(_request_path(websocket)).query)
+        address = websocket.remote_address
+        name = query.get("client", [address[0] if address else "unknown"])[0]
+        # the name ends up in a file name
+        name = re.sub(r"[^A-Za-z0-9_.-]", "_", name)
+        return name, query.get("role", [UNITY])[0]
+
+    def _client_log(self, name: str) -> SessionLogWriter:
+        log = self.client_logs.get(name)
+        if log is None:
+            log = SessionLogWriter(self.out_dir / "websocket_{}.jsonl".format(name),
+                                   formatter=LOG_FORMATS[self.log_format], **self.log_options)
+            self.client_logs[name] = log
+        return log
+
+    async def handler(self, websocket, *args):
+        """websockets connection handler (the legacy server also passes the path)"""
+        name, role = self.identify(websocket)
+        base, n = name, 1
+        while name in self.clients and self.clients[name].connected:
+            n += 1
+            name = "{}-{}".format(base, n)
+        client = self.clients.get(name)
+        if client is None:
+            client = self.clients[name] = HubClient(name, role, self.send_queue)
+        client.websocket = websocket
+        client.address = "{}:{}".format(*websocket.remote_address[:2]) if websocket.remote_address else None
+        client.connections += 1
+        client.role = role
+        logging.info(f"🔌 {name} ({role}) connected from {client.address}"
+                     + (f", connection {client.connections}" if client.connections > 1 else ""))
+
+        logging.info(f"📤 Sending {len(self.params)} initialization message(s) to {name}...")
+        for param in self.params:
+            client.put(param if isinstance(param, str) else self.encode(param))
+        sender = asyncio.create_task(client._send_loop(websocket))
+        sender.add_done_callback(functools.partial(_sender_done, name))
+        log = self._client_log(name) if self.split else None
+        try:
+            async for message in websocket:
+                stamp = stamp_now()
+                client.received += 1
+                logging.info(f"📨 {name}: {message[:100]}{'...' if len(message) > 100 else ''}")
+                # with the "block" overflow policy this waits for the disk, this client isn't read meanwhile
+                if self.writer is not None:
+                    await self.writer.write_async(message, stamp, name)
+                if log is not None:
+                    await log.write_async(message, stamp, name)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        except Exception as e:
+            logging.error(f"❌ WebSocket error with {name}: {e}")
+        finally:
+            sender.cancel()
+            if client.websocket is websocket:
+                client.websocket = None
+            logging.info(f"⚠ {name} disconnected")
+            # make sure everything this client sent is on disk before we forget about it
+            for writer in (self.writer, log):
+                if writer is not None:
+                    await asyncio.to_thread(writer.flush, 5.0)
+
+    def select(self, clients: list = None, roles: list = None) -> list:
+        """the connected clients with one of these names or roles (all connected clients if both are None)"""
+        return [c for c in self.clients.values() if c.connected
+                and (clients is None or c.name in clients) and (roles is None or c.role in roles)]
+
+    def broadcast(self, message, clients: list = None, roles: list = None) -> int:
+        """
+        queue a message (dict or str) for clients, on the hub's loop
+        :return: number of clients it was queued for
+        """
+        targets = self.select(clients, roles)
+        text = message if isinstance(message, str) else self.encode(message)
+        for client in targets:
+            client.put(text)
+        return len(targets)
+
+    def attach(self, loop: asyncio.AbstractEventLoop = None):
+        """the loop the hub's clients run on, for send_threadsafe()"""
+        self._loop = loop or asyncio.get_running_loop()
+
+    def send_threadsafe(self, message, clients: list = None, roles: list = None):
+        """broadcast() from another thread (the GUI)"""
+        if self._loop is None or self._loop.is_closed():
+            logging.warning("websocket server isn't running, control message not sent")
+            return
+        self._loop.call_soon_threadsafe(self.broadcast, message, clients, roles)
+
+    def stats(self) -> dict:
+        return {name: client.stats() for name, client in self.clients.items()}
+
+    def close(self):
+        for log in self.client_logs.values():
+            log.close()
+        self.client_logs = {}
@@ -1,75 +1,108 @@
+"""
+the websocket server of a session, for Unity and any other client (see websocket.WebSocketHub)
+
+the connection settings used to differ per server script, they are now named settings of this one server:
+    ping_interval   s between keepalive pings, None: no pings (some Unity websocket plugins don't answer them)
+    ping_timeout    s to wait for the pong before the connection is closed as dead
+    close_timeout   s to wait for the closing handshake
+    compression     permessage-deflate, costs CPU per message, saves little on short JSON events
+    max_size        largest message accepted (bytes), a bigger one closes the connection
+    max_queue       received frames buffered per connection before the server stops reading that client
+
+WebSocketServerPersistent and UnityCompatibleServer now start this server with their settings. In conf.yaml
+WS.SETTINGS picks a named setting and the keys above in upper case override parts of it. Measure them with
+python -m websocket.benchmark.
+"""
 import ast
 import asyncio
 import logging
 import time
-import functools
 import pandas as pd
 import websockets
 import socket
 
+from websocket.SessionFormat import LOG_FORMATS
+from websocket.SessionLogWriter import SessionLogWriter
+from websocket.WebSocketHub import WebSocketHub
 
-def write_to_file(message, file):
-    with open(file, 'a+') as f:
-        f.write("{}\n".format(message))
+SETTINGS = {
+    # the websockets defaults, what start_ws_server always ran with
+    "default": {"ping_interval": 20, "ping_timeout": 20, "close_timeout": 10, "compression": True,
+                "max_size": 2 ** 20, "max_queue": 16},
+    # WebSocketServerPersistent, a dead headset is noticed within 30 s
+    "persistent": {"ping_interval": 20, "ping_timeout": 10, "close_timeout": 10, "compression": True,
+                   "max_size": 2 ** 20, "max_queue": 16},
+    # UnityCompatibleServer, no pings at all
+    "unity": {"ping_interval": None, "ping_timeout": None, "close_timeout": 10, "compression": True,
+              "max_size": 1000000, "max_queue": 16},
+}
 
 
-async def ws_handler(websocket, params, output_file):
-    # Log connection
-    client_address = websocket.remote_address
-    logging.info(f"🔌 Unity connected from {client_address[0]}:{client_address[1]}")
-    
-    # first sending base parameters to unity (name child etc)
-    logging.info(f"📤 Sending {len(params)} initialization message(s) to Unity...")
-    for i, param in enumerate(params, 1):
-        await websocket.send(str(param))
-        logging.info(f"   ✓ Sent message {i}: {list(param.keys())}")
-    
-    logging.info("✓ All initialization data sent to Unity")
-    logging.info("─────────────────────────────────────────────")
-    logging.info("📡 Listening for messages from Unity...")
-    
-    # then handling incoming messages
-    try:
-        async for message in websocket:
-            logging.info(f"📨 Received: {message[:100]}{'...' if len(message) > 100 else ''}")
-            write_to_file(message, output_file)
-    except websockets.exceptions.ConnectionClosed:
-        logging.info("⚠ Unity connection closed")
-    except Exception as e:
-        logging.error(f"❌ WebSocket error: {e}")
-        # message_dict = ast.literal_eval(message)
-        # for key, value in message_dict.items():
-        #     match key:
-        #         case "connectMessage":
-        #             print("connected with {}".format(value))
-        #         case "_time":
-        #             print("connection time is {}".format(value))
-        #         case "caregiver_rating":
-        #             print("care giver got a rating of {}".format(value))
-        #         case default:
-        #             print("no know command: {}".format(key))
+def server_settings(name: str = "default", **overrides) -> dict:
+    """a named setting of SETTINGS with some of its values replaced"""
+    if name not in SETTINGS:
+        raise ValueError("unknown websocket settings {}, use one of {}".format(name, ", ".join(SETTINGS)))
+    unknown = set(overrides) - set(SETTINGS[name])
+    if unknown:
+        raise ValueError("unknown websocket setting(s) {}".format(", ".join(sorted(unknown))))
+    return dict(SETTINGS[name], **overrides)
+
+
+def settings_from_config(ws: dict) -> dict:
+    """the settings of the WS block of conf.yaml: SETTINGS plus the keys (in upper case) that are present"""
+    overrides = {key.lower(): value for key, value in ws.items() if key.lower() in SETTINGS["default"]}
+    return server_settings(ws.get("SETTINGS", "default"), **overrides)
+
+
+def _serve_options(settings: dict) -> dict:
+    """keyword arguments of websockets.serve for a setting"""
+    options = dict(settings)
+    options["compression"] = "deflate" if options["compression"] else None
+    return options
 
 
 async def start_ws_server(params=None, output_file="", ip: str = 'localhost',
-                          port: int = 8080):
+                          port: int = 8080, log_format: str = "ndjson", writer: SessionLogWriter = None,
+                          hub: WebSocketHub = None, settings: dict = None, encode=str):
+    """
+    :param writer: session log to write to instead of opening output_file, the caller closes it (so it
+        survives a restart of the server)
+    :param hub: the clients of the session (see websocket.WebSocketHub), kept by the caller to send control
+        messages, a new one with params and writer if None
+    :param settings: connection settings, see the module docstring, server_settings() if None
+    :param encode: how a new hub encodes params, see WebSocketHub
+    """
     if params is None:
         params = [{"i": "test", "name": "Charles"}]
+    if settings is None:
+        settings = server_settings()
     
     logging.info(f"✓ WebSocket server starting on {ip}:{port}")
+    logging.info("  keepalive: {}, compression: {}, max_size: {}, max_queue: {}".format(
+        "every {}s, timeout {}s".format(settings["ping_interval"], settings["ping_timeout"])
+        if settings["ping_interval"] else "off", "on" if settings["compression"] else "off",
+        settings["max_size"], settings["max_queue"]))
+    own_writer = writer is None
+    if own_writer:
+        writer = SessionLogWriter(output_file, formatter=LOG_FORMATS[log_format])
+    if hub is None:
+        hub = WebSocketHub(params, writer, log_format=log_format, encode=encode)
+    hub.attach()
     
     try:
         # Create the server - websockets library handles SO_REUSEADDR automatically
-        server = await websockets.serve(
-            functools.partial(ws_handler, params=params, output_file=output_file), 
+        # leaving the block (cancelled on stop or restart) closes the socket and the client connections
+        async with websockets.serve(
+            hub.handler,
             ip,
             port,
-            family=socket.AF_INET
-        )
-        
-        logging.info(f"✓ Server ready - waiting for Unity connection...")
-        
-        # Run forever
-        await asyncio.Future()
+            family=socket.AF_INET,
+            **_serve_options(settings)
+        ):
+            logging.info(f"✓ Server ready - waiting for Unity connection...")
+            
+            # Run forever
+            await asyncio.Future()
             
     except OSError as e:
         if e.errno == 10048 or "already in use" in str(e).lower():
@@ -94,7 +127,8 @@ async def start_ws_server(params=None, output_file="", ip: str = 'localhost',
             logging.error("─────────────────────────────────────────────")
         import traceback
         traceback.print_exc()
-        input("Press Enter to continue...")
+        # no input() here: this runs next to other workers on the same loop, the caller decides to retry
+        raise
     except Exception as e:
         logging.error("─────────────────────────────────────────────")
         logging.error(f"❌ WebSocket Server Error: {e}")
@@ -102,14 +136,19 @@ async def start_ws_server(params=None, output_file="", ip: str = 'localhost',
         logging.error("─────────────────────────────────────────────")
         import traceback
         traceback.print_exc()
-        input("Press Enter to continue...")
+        raise
+    finally:
+        if own_writer:
+            writer.close()
+        else:
+            await asyncio.to_thread(writer.flush, 5.0)
 
 if __name__ == '__main__':
     websocket_data = [
         {"player": "Sander"},
         {"contingency": "20"}
     ]
-    asyncio.run(start_ws_server(params=websocket_data, output_file="test.csv", ip='192.168.50.188'))
+    asyncio.run(start_ws_server(params=websocket_data, output_file="test.jsonl", ip='192.168.50.188'))
     # loop = asyncio.get_event_loop()
     # task = loop.create_task(startWsServer())
     # try:
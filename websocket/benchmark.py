@@ -0,0 +1,180 @@
+"""
+benchmark of the websocket server settings (see websocket.WebSocketServer) with a fake Unity client on
+this pc, to pick WS.SETTINGS in conf.yaml from data:
+
+    python -m websocket.benchmark --settings default unity unity-raw --messages 20000 --rate 0
+
+for every setting the server runs in its own process with the session log writer, as in a session, and
+the fake client sends gaze events like Unity does (the shape of test.csv), as fast as possible (--rate 0)
+or at a fixed rate. The client offers permessage-deflate like websockets does, so the server setting
+decides whether it's used. Every setting also has a "-raw" variant without compression.
+
+reported per setting:
+    msg/s           messages written per second, from the first receive to the last write
+    recv->disk      p50 / p99 ms from the receive stamp to the write of the batch that holds the message
+    cpu             % of one core used by the server process while the client was sending
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import socket
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import websockets
+
+from websocket.SessionFormat import format_record_line
+from websocket.SessionLogWriter import SessionLogWriter
+from websocket.WebSocketServer import SETTINGS, start_ws_server
+
+VARIANTS = dict(SETTINGS)
+VARIANTS.update({"{}-raw".format(name): dict(settings, compression=False) for name, settings in SETTINGS.items()})
+
+
+class _TimedWriter(SessionLogWriter):
+    """session log writer that remembers how long every message waited for the disk"""
+
+    def __init__(self, file, **kwargs):
+        # before the writer thread starts
+        self.latencies = []
+        self.first_receive = None
+        self.last_write = None
+        self._pending = []
+        super().__init__(file, formatter=format_record_line, **kwargs)
+
+    def _format(self, item) -> str:
+        stamp = item[1]
+        if stamp is not None:
+            self._pending.append(stamp.monotonic_ns)
+            if self.first_receive is None:
+                self.first_receive = stamp.monotonic_ns
+        return super()._format(item)
+
+    def _write_batch(self, batch):
+        super()._write_batch(batch)
+        if self._pending:
+            self.last_write = time.monotonic_ns()
+            self.latencies.extend(self.last_write - received for received in self._pending)
+            self._pending.clear()
+
+
+def _serve(settings: dict, port: int, out_file: str, connection):
+    """server process: serve until the parent asks for the results of the expected number of messages"""
+    async def main():
+        writer = _TimedWriter(out_file)
+        server = asyncio.create_task(start_ws_server(params=[{"player": "benchmark"}], ip="127.0.0.1", port=port,
+                                                     writer=writer, settings=settings))
+        connection.send("ready")
+        command, expected = await asyncio.to_thread(connection.recv)
+        cpu_start, wall_start = time.process_time(), time.monotonic()
+        command, expected = await asyncio.to_thread(connection.recv)
+        deadline = time.monotonic() + 30
+        while writer.received < expected and time.monotonic() < deadline and not server.done():
+            await asyncio.sleep(0.01)
+        await asyncio.to_thread(writer.flush, 10.0)
+        cpu, wall = time.process_time() - cpu_start, time.monotonic() - wall_start
+        server.cancel()
+        try:
+            await server
+        except (asyncio.CancelledError, Exception):
+            pass
+        writer.close()
+        return {"received": writer.received, "latencies": writer.latencies, "cpu": cpu, "wall": wall,
+                "span": ((writer.last_write - writer.first_receive) / 1e9
+                         if writer.first_receive is not None and writer.last_write is not None else None)}
+
+    connection.send(asyncio.run(main()))
+
+
+def _gaze_events():
+    """endless gaze start / stop events as Unity sends them"""
+    trial, unity_time = 0, 0.0
+    while True:
+        for target in ("tegenspeler", "caregiver"):
+            for start in (True, False):
+                unity_time += 0.05
+                yield json.dumps({"trialNumber": trial, "websocketMessage": "gaze", "targetName": target,
+                                  "gazeStart": start, "_time": unity_time}, separators=(",", ":"))
+        trial += 1
+
+
+async def _fake_unity(port: int, messages: int, rate: float) -> int:
+    """send messages gaze events, rate per second (0: as fast as possible), returns the number sent"""
+    events = _gaze_events()
+    sent = 0
+    async with websockets.connect("ws://127.0.0.1:{}/?client=benchmark".format(port), max_size=None) as ws:
+        await ws.recv()  # the initialisation message
+        await ws.send(json.dumps({"connectMessage": "Hello from benchmark", "_time": time.ctime()}))
+        sent += 1
+        start = time.monotonic()
+        try:
+            for i in range(messages - 1):
+                if rate > 0:
+                    delay = start + i / rate - time.monotonic()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                await ws.send(next(events))
+                sent += 1
+        except websockets.exceptions.ConnectionClosed as e:
+            logging.warning("server closed the connection after {} messages: {}".format(sent, e))
+    return sent
+
+
+def run(name: str, messages: int = 10000, rate: float = 0.0) -> dict:
+    """benchmark one setting of VARIANTS, see the module docstring"""
+    settings = VARIANTS[name]
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    context = multiprocessing.get_context("spawn")
+    parent, child = context.Pipe()
+    with tempfile.TemporaryDirectory() as folder:
+        process = context.Process(target=_serve, args=(settings, port, str(Path(folder) / "benchmark.jsonl"), child),
+                                  daemon=True)
+        process.start()
+        try:
+            if not parent.poll(30) or parent.recv() != "ready":
+                raise RuntimeError("benchmark server didn't start")
+            time.sleep(0.3)  # until it listens
+            parent.send(("start", messages))
+            sent = asyncio.run(_fake_unity(port, messages, rate))
+            parent.send(("stop", sent))
+            if not parent.poll(60):
+                raise RuntimeError("benchmark server didn't report")
+            result = parent.recv()
+        finally:
+            process.join(10)
+            if process.is_alive():
+                process.kill()
+    latencies = np.asarray(result["latencies"], dtype=np.float64) / 1e6
+    return {"settings": name, "sent": sent, "written": len(latencies),
+            "msg_per_s": len(latencies) / result["span"] if result["span"] else float("nan"),
+            "p50_ms": float(np.percentile(latencies, 50)) if len(latencies) else float("nan"),
+            "p99_ms": float(np.percentile(latencies, 99)) if len(latencies) else float("nan"),
+            "cpu_percent": 100.0 * result["cpu"] / result["wall"] if result["wall"] else float("nan")}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="benchmark the websocket server settings with a fake Unity client")
+    parser.add_argument("--settings", nargs="+", default=list(VARIANTS), choices=list(VARIANTS))
+    parser.add_argument("--messages", type=int, default=10000, help="messages per setting")
+    parser.add_argument("--rate", type=float, default=0.0, help="messages per second, 0: as fast as possible")
+    parser.add_argument("--out", default=None, help="also write the results as json to this file")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format='%(message)s')
+
+    results = []
+    print("{:<16} {:>7} {:>7} {:>9} {:>9} {:>9} {:>6}".format("settings", "sent", "written", "msg/s", "p50 ms",
+                                                           "p99 ms", "cpu %"))
+    for name in args.settings:
+        result = run(name, args.messages, args.rate)
+        results.append(result)
+        print("{settings:<16} {sent:>7} {written:>7} {msg_per_s:>9.0f} {p50_ms:>9.1f} {p99_ms:>9.1f} "
+              "{cpu_percent:>6.1f}".format(**result))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)